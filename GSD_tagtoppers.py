@@ -18,83 +18,64 @@ import time
 import json
 import re
 import os
-
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google.ads.googleads.client import GoogleAdsClient
-from google.ads.googleads.errors import GoogleAdsException
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+import argparse
+import collections
+import functools
+import logging
+import signal
+import threading
 
 # Import listing tree function
-from listing_tree import rebuild_tree_with_label_and_item_ids
+from listing_tree import VALID_LABELS, compile_label_tree, label_tree_query, rebuild_tree_with_label_and_item_ids
+import account_state
+import accounting
+import batch_jobs
+import clients
+import leases
+import logs
+import prefetch
+import profiling
+import progress
+import proto_fast
+import rate_limit
+import retry_lane
+import scheduler
+import tracing
+import transport
+import tree_cache
+import tree_plan
+from operation_factory import ListingGroupOperationFactory, next_temp_id
+from partial_failure import StructuralOperationError, mutate_item_id_criteria, run_report, set_context
+from checkpoint import JOURNAL_PATH, RunJournal, acknowledging, row_key, start_unit
+from clients import (
+    SERVICE_ACCOUNT_FILE,
+    developer_token,
+    get_ads_client,
+    get_redshift_connection,
+    get_sheets_service,
+    google_ads_exception,
+    load_google_oauth_from_env,
+    login_customer_id,
+    refresh_token,
+    reset_redshift_connection,
+)
+
+log = logs.get_logger("gsd")
+sheet_log = logs.get_logger("sheet")
+tt_log = logs.get_logger("tag_toppers")
+# Per-Item-ID debug detail (TAGTOPPERS_LOG_SAMPLE=tag_toppers.items=...)
+tt_item_log = logs.get_logger("tag_toppers.items")
 
 # =========================
 # OAuth / Config
 # =========================
 
-refresh_token = os.getenv("GOOGLE_REFRESH_TOKEN", "your-refresh-token-here")
-developer_token = os.getenv("GOOGLE_DEVELOPER_TOKEN", "your-developer-token-here")
-login_customer_id = os.getenv("GOOGLE_LOGIN_CUSTOMER_ID", "your-login-customer-id")
-
-def load_google_oauth_from_env():
-    # First try environment variables
-    cid = os.getenv("GOOGLE_CLIENT_ID")
-    cs  = os.getenv("GOOGLE_CLIENT_SECRET")
-
-    # If not found, try loading from creds file
-    if not cid or not cs:
-        creds_file = os.path.join(os.path.dirname(__file__), 'creds')
-        if os.path.exists(creds_file):
-            with open(creds_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('GOOGLE_CLIENT_ID='):
-                        cid = line.split('=', 1)[1]
-                    elif line.startswith('GOOGLE_CLIENT_SECRET='):
-                        cs = line.split('=', 1)[1]
-
-    missing = []
-    if not cid: missing.append("GOOGLE_CLIENT_ID")
-    if not cs:  missing.append("GOOGLE_CLIENT_SECRET")
-    if missing:
-        raise RuntimeError(
-            "Environment variables ontbreken: "
-            + ", ".join(missing)
-            + ".\nZet deze in het 'creds' bestand of als environment variables."
-        )
-    return cid, cs
-
-client_id, client_secret = load_google_oauth_from_env()
-
-# Google Ads client (OAuth via refresh token)
-google_ads_config = {
-    "developer_token": developer_token,
-    "refresh_token":  refresh_token,
-    "client_id":      client_id,
-    "client_secret":  client_secret,
-    "login_customer_id": login_customer_id,
-    "use_proto_plus": True,
-}
-client = GoogleAdsClient.load_from_dict(google_ads_config)
-
-# Optioneel: los access token verversen (handig voor sanity check)
-creds = Credentials(
-    token=None,
-    refresh_token=refresh_token,
-    token_uri="https://oauth2.googleapis.com/token",
-    client_id=client_id,
-    client_secret=client_secret,
-)
-creds.refresh(Request())
-print("✅ Access token:", (creds.token or "")[:20], "...")
-
-# Service account voor Google Sheets / Merchant Center
-# Auto-detect Windows vs WSL path
-if os.name == 'nt':  # Windows
-    SERVICE_ACCOUNT_FILE = r'C:\Users\JoepvanSchagen\Downloads\Python\gsd-campaign-creation.json'
-else:  # WSL/Linux
-    SERVICE_ACCOUNT_FILE = '/mnt/c/Users/JoepvanSchagen/Downloads/Python/gsd-campaign-creation.json'
+# Clients are created on first use (clients.py); importing this module does no
+# network I/O. ``GSD_tagtoppers.client`` still returns the shared Ads client.
+def __getattr__(name):
+    if name == "client":
+        return get_ads_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # =========================
 # Accounts / constants
@@ -112,14 +93,20 @@ tracking_template_nl = 'https://www.beslist.nl/outclick/redirect?aff_id=900&para
 tracking_template_be = 'https://www.beslist.be/outclick/redirect?aff_id=901&params=productId%3D{product_id}%26marketingChannelId%3D14&url={lpurl}'
 tracking_template_de = 'https://www.shopcaddy.de/outclick/redirect?aff_id=910&params=productId%3D{product_id}%26marketingChannelId%3D14&url={lpurl}'
 
-last_criterion_id = 0
 script_label = "TAGTOPPERS_SCRIPT"
 
+# --daemon: seconds between sheet polls, and before a failed row is tried again
+DAEMON_POLL_INTERVAL = float(os.getenv("TAGTOPPERS_POLL_INTERVAL", "120"))
+DAEMON_RETRY_AFTER = float(os.getenv("TAGTOPPERS_RETRY_AFTER", "1800"))
+
 # =========================
 # Utilities
 # =========================
 
 def ensure_campaign_label_exists(client, customer_id, label_name):
+    known = account_state.state.label(customer_id, label_name)
+    if known:
+        return known
     google_ads_service = client.get_service("GoogleAdsService")
     label_service = client.get_service("LabelService")
 
@@ -130,6 +117,7 @@ def ensure_campaign_label_exists(client, customer_id, label_name):
     """
     response = google_ads_service.search(customer_id=customer_id, query=query)
     for row in response:
+        account_state.state.set_label(customer_id, label_name, row.label.resource_name)
         return row.label.resource_name
 
     # Label bestaat nog niet, dus aanmaken
@@ -141,9 +129,10 @@ def ensure_campaign_label_exists(client, customer_id, label_name):
         label_response = label_service.mutate_labels(
             customer_id=customer_id, operations=[label_operation]
         )
+        account_state.state.set_label(customer_id, label_name, label_response.results[0].resource_name)
         return label_response.results[0].resource_name
-    except GoogleAdsException as ex:
-        print(f'error: {ex}')
+    except google_ads_exception() as ex:
+        log.error(f'error: {ex}')
         return None
 
 def create_location_op(client, customer_id, campaign_id, country):
@@ -174,14 +163,9 @@ def create_location_op(client, customer_id, campaign_id, country):
 
     return campaign_criterion_operation
 
-def add_standard_shopping_campaign(
-    client, customer_id, merchant_center_account_id, campaign_name, budget_name,
-    tracking_template, country, shopid, shopname, label, budget, final_url_suffix=None
-):
-    campaign_service = client.get_service("CampaignService")
+def find_shopping_campaign(client, customer_id, shopid, shopname, label):
+    """Resource name of the shop's non-removed campaign for ``label``, or None."""
     google_ads_service = client.get_service("GoogleAdsService")
-
-    # Bestaat al?
     query = f""" 
     SELECT campaign.id, campaign.resource_name, campaign.status 
     FROM campaign 
@@ -192,28 +176,26 @@ def add_standard_shopping_campaign(
     response = google_ads_service.search(customer_id=customer_id, query=query)
     for row in response:
         if row.campaign.status != client.enums.CampaignStatusEnum.REMOVED:
-            print(f"                Campaign '{campaign_name}' already exists with ID {row.campaign.id}")
             return row.campaign.resource_name
+    return None
 
-    # Budget (niet gedeeld)
-    campaign_budget_service = client.get_service("CampaignBudgetService")
+def campaign_budget_op(client, budget_name, budget, resource_name=None):
     campaign_budget_operation = client.get_type("CampaignBudgetOperation")
     campaign_budget = campaign_budget_operation.create
+    if resource_name:
+        campaign_budget.resource_name = resource_name
     campaign_budget.name = budget_name
     campaign_budget.delivery_method = client.enums.BudgetDeliveryMethodEnum.STANDARD
     campaign_budget.amount_micros = budget  # bv. 5_000_000 = €5/dag
     campaign_budget.explicitly_shared = False
-    try:
-        campaign_budget_response = campaign_budget_service.mutate_campaign_budgets(
-            customer_id=customer_id, operations=[campaign_budget_operation]
-        )
-    except GoogleAdsException as ex:
-        print(f"Failed to create budget: {ex}")
-        return None
+    return campaign_budget_operation
 
-    # Campaign
+def shopping_campaign_op(client, campaign_name, merchant_center_account_id, tracking_template,
+                         budget_resource_name, final_url_suffix=None, resource_name=None):
     campaign_operation = client.get_type("CampaignOperation")
     campaign = campaign_operation.create
+    if resource_name:
+        campaign.resource_name = resource_name
     campaign.name = campaign_name
     campaign.advertising_channel_type = client.enums.AdvertisingChannelTypeEnum.SHOPPING
     campaign.shopping_setting.merchant_id = int(merchant_center_account_id)
@@ -227,27 +209,72 @@ def add_standard_shopping_campaign(
         campaign.final_url_suffix = final_url_suffix
     campaign.status = client.enums.CampaignStatusEnum.PAUSED
     campaign.manual_cpc.enhanced_cpc_enabled = False
-    campaign.campaign_budget = campaign_budget_response.results[0].resource_name
+    campaign.campaign_budget = budget_resource_name
+    return campaign_operation
+
+def campaign_label_op(client, campaign_resource_name, label_resource_name):
+    campaign_label_operation = client.get_type("CampaignLabelOperation")
+    campaign_label = campaign_label_operation.create
+    campaign_label.campaign = campaign_resource_name
+    campaign_label.label = label_resource_name
+    return campaign_label_operation
+
+def add_standard_shopping_campaign(
+    client, customer_id, merchant_center_account_id, campaign_name, budget_name,
+    tracking_template, country, shopid, shopname, label, budget, final_url_suffix=None
+):
+    campaign_service = client.get_service("CampaignService")
+
+    # Al gevonden of aangemaakt in deze run?
+    state_key = ("shopping", str(shopid), shopname, label)
+    known = account_state.state.campaign(customer_id, state_key)
+    if known:
+        return known
+
+    # Bestaat al?
+    existing = find_shopping_campaign(client, customer_id, shopid, shopname, label)
+    if existing:
+        log.info(f"                Campaign '{campaign_name}' already exists: {existing}")
+        account_state.state.set_campaign(customer_id, state_key, existing)
+        return existing
 
+    # Budget (niet gedeeld)
+    campaign_budget_service = client.get_service("CampaignBudgetService")
+    campaign_budget_operation = campaign_budget_op(client, budget_name, budget)
     try:
-        campaign_response = campaign_service.mutate_campaigns(
-            customer_id=customer_id, operations=[campaign_operation]
+        campaign_budget_response = campaign_budget_service.mutate_campaign_budgets(
+            customer_id=customer_id, operations=[campaign_budget_operation]
         )
-    except GoogleAdsException as ex:
-        print(f"Failed to create campaign '{campaign_name}': {ex}")
+    except google_ads_exception() as ex:
+        log.error(f"Failed to create budget: {ex}")
+        return None
+
+    # Campaign
+    campaign_operation = shopping_campaign_op(
+        client, campaign_name, merchant_center_account_id, tracking_template,
+        campaign_budget_response.results[0].resource_name, final_url_suffix,
+    )
+
+    try:
+        campaign_response = campaign_service.mutate_campaigns(request=account_state.mutable_request(
+            client, "MutateCampaignsRequest", customer_id, [campaign_operation]
+        ))
+    except google_ads_exception() as ex:
+        log.error(f"Failed to create campaign '{campaign_name}': {ex}")
         # probeer alsnog de resource van een bestaande te vinden
-        response_retry = google_ads_service.search(customer_id=customer_id, query=query)
-        for row in response_retry:
-            if row.campaign.status != client.enums.CampaignStatusEnum.REMOVED:
-                print(f"Campaign '{campaign_name}' gevonden na fout bij aanmaken.")
-                return row.campaign.resource_name
-        print(f"Kan campagne '{campaign_name}' niet aanmaken en geen actieve campagne gevonden.")
+        existing = find_shopping_campaign(client, customer_id, shopid, shopname, label)
+        if existing:
+            log.info(f"Campaign '{campaign_name}' gevonden na fout bij aanmaken.")
+            return existing
+        log.error(f"Kan campagne '{campaign_name}' niet aanmaken en geen actieve campagne gevonden.")
         return None
 
     campaign_resource_name = campaign_response.results[0].resource_name
+    # New campaign: no ad groups yet, later steps of this run don't search for them
+    account_state.state.set_campaign(customer_id, state_key, campaign_resource_name, created=True)
 
     # Add location targeting
-    campaign_id = campaign_resource_name.split("/")[-1]
+    campaign_id = str(campaign_response.results[0].campaign.id or campaign_resource_name.split("/")[-1])
     campaign_criterion_service = client.get_service("CampaignCriterionService")
     operations = [
         create_location_op(client, customer_id, campaign_id, country),
@@ -256,43 +283,49 @@ def add_standard_shopping_campaign(
         campaign_criterion_service.mutate_campaign_criteria(
             customer_id=customer_id, operations=operations
         )
-    except GoogleAdsException as ex:
+    except google_ads_exception() as ex:
         #handle_googleads_exception(ex)
-        print(f'error: {ex}')
+        log.error(f'error: {ex}')
 
     # Label toevoegen
     campaign_label_service = client.get_service("CampaignLabelService")
     label_resource_name = ensure_campaign_label_exists(client, customer_id, script_label)
     if label_resource_name:
-        campaign_label_operation = client.get_type("CampaignLabelOperation")
-        campaign_label = campaign_label_operation.create
-        campaign_label.campaign = campaign_resource_name
-        campaign_label.label = label_resource_name
+        campaign_label_operation = campaign_label_op(client, campaign_resource_name, label_resource_name)
         try:
             campaign_label_service.mutate_campaign_labels(
                 customer_id=customer_id, operations=[campaign_label_operation]
             )
-        except GoogleAdsException as ex:
-            print(f'error (label): {ex}')
+        except google_ads_exception() as ex:
+            log.error(f'error (label): {ex}')
 
-    print(f"                Standard shopping campaign created (and labeled): {campaign_name}")
-    time.sleep(2)  # Wait for campaign to propagate
+    log.info(f"                Standard shopping campaign created (and labeled): {campaign_name}")
     return campaign_resource_name
 
-def create_ad_group_basic(client, customer_id: str, campaign_resource_name: str, ad_group_name: str, bid_micros: int = 200_000):
-    ad_group_service = client.get_service("AdGroupService")
+def ad_group_op(client, campaign_resource_name, ad_group_name, bid_micros=200_000, resource_name=None):
     op = client.get_type("AdGroupOperation")
     ag = op.create
+    if resource_name:
+        ag.resource_name = resource_name
     ag.campaign = campaign_resource_name
     ag.name = ad_group_name
     ag.cpc_bid_micros = bid_micros
     ag.status = client.enums.AdGroupStatusEnum.ENABLED
-    resp = ad_group_service.mutate_ad_groups(customer_id=customer_id, operations=[op])
-    time.sleep(1)  # Wait for ad group to propagate
-    return resp.results[0].resource_name
+    return op
 
-def get_or_create_tag_toppers_adgroup(client, customer_id, campaign_resource, name="tag_toppers", bid_micros=200_000):
-    """Zoekt ad group op naam binnen campagne. Maakt 'm alleen aan als hij niet bestaat."""
+def create_ad_group_basic(client, customer_id: str, campaign_resource_name: str, ad_group_name: str, bid_micros: int = 200_000):
+    ad_group_service = client.get_service("AdGroupService")
+    op = ad_group_op(client, campaign_resource_name, ad_group_name, bid_micros)
+    resp = ad_group_service.mutate_ad_groups(request=account_state.mutable_request(
+        client, "MutateAdGroupsRequest", customer_id, [op]
+    ))
+    ad_group_resource_name = resp.results[0].resource_name
+    # New ad group: no ad and no listing tree yet
+    account_state.state.set_ad_group(customer_id, campaign_resource_name, ad_group_name, ad_group_resource_name, created=True)
+    return ad_group_resource_name
+
+def find_ad_group(client, customer_id, campaign_resource, name):
+    """Resource name of the non-removed ad group ``name`` in the campaign, or None."""
     ga = client.get_service("GoogleAdsService")
     q = f"""
       SELECT ad_group.resource_name, ad_group.id, ad_group.name, ad_group.status
@@ -304,16 +337,30 @@ def get_or_create_tag_toppers_adgroup(client, customer_id, campaign_resource, na
     """
     res = ga.search(customer_id=customer_id, query=q)
     for row in res:
-        print(f"                        Ad group bestaat al: {row.ad_group.id} ({row.ad_group.name})")
         return row.ad_group.resource_name
+    return None
+
+def get_or_create_tag_toppers_adgroup(client, customer_id, campaign_resource, name="tag_toppers", bid_micros=200_000):
+    """Zoekt ad group op naam binnen campagne. Maakt 'm alleen aan als hij niet bestaat."""
+    known = account_state.state.ad_group(customer_id, campaign_resource, name)
+    if known:
+        return known
+    if account_state.state.is_new(campaign_resource):
+        # Campagne is in deze run aangemaakt en heeft nog geen ad groups
+        return create_ad_group_basic(client, customer_id, campaign_resource, name, bid_micros)
+
+    existing = find_ad_group(client, customer_id, campaign_resource, name)
+    if existing:
+        log.debug(f"                        Ad group bestaat al: {existing} ({name})")
+        account_state.state.set_ad_group(customer_id, campaign_resource, name, existing)
+        return existing
 
     # niet gevonden → aanmaken
     return create_ad_group_basic(client, customer_id, campaign_resource, name, bid_micros)
 
-def add_shopping_product_ad_group_ad(client, customer_id, ad_group_resource):
-    ad_group_ad_service = client.get_service("AdGroupAdService")
+def find_ad_group_ad(client, customer_id, ad_group_resource):
+    """Resource name of a non-removed ad in the ad group, or None."""
     google_ads_service = client.get_service("GoogleAdsService")
-
     query = f"""
         SELECT ad_group_ad.ad.id, ad_group_ad.resource_name, ad_group_ad.status
         FROM ad_group_ad
@@ -322,10 +369,10 @@ def add_shopping_product_ad_group_ad(client, customer_id, ad_group_resource):
     response = google_ads_service.search(customer_id=customer_id, query=query)
     for row in response:
         if row.ad_group_ad.status != client.enums.AdGroupAdStatusEnum.REMOVED:
-            print(f"                                Ad already exists in ad group '{ad_group_resource}' with ID {row.ad_group_ad.ad.id}")
             return row.ad_group_ad.resource_name
+    return None
 
-    # Nieuw
+def shopping_product_ad_op(client, ad_group_resource):
     ad_group_ad_operation = client.get_type("AdGroupAdOperation")
     ad_group_ad = ad_group_ad_operation.create
     ad_group_ad.ad_group = ad_group_resource
@@ -334,11 +381,31 @@ def add_shopping_product_ad_group_ad(client, customer_id, ad_group_resource):
         ad_group_ad.ad.shopping_product_ad,
         client.get_type("ShoppingProductAdInfo"),
     )
-    ad_group_ad_response = ad_group_ad_service.mutate_ad_group_ads(
-        customer_id=customer_id, operations=[ad_group_ad_operation]
-    )
+    return ad_group_ad_operation
+
+def add_shopping_product_ad_group_ad(client, customer_id, ad_group_resource):
+    ad_group_ad_service = client.get_service("AdGroupAdService")
+
+    known = account_state.state.ad(ad_group_resource)
+    if known:
+        return known
+
+    # An ad group created in this run has no ads yet
+    if not account_state.state.is_new(ad_group_resource):
+        existing = find_ad_group_ad(client, customer_id, ad_group_resource)
+        if existing:
+            log.debug(f"                                Ad already exists in ad group '{ad_group_resource}': {existing}")
+            account_state.state.set_ad(ad_group_resource, existing)
+            return existing
+
+    # Nieuw
+    ad_group_ad_operation = shopping_product_ad_op(client, ad_group_resource)
+    ad_group_ad_response = ad_group_ad_service.mutate_ad_group_ads(request=account_state.mutable_request(
+        client, "MutateAdGroupAdsRequest", customer_id, [ad_group_ad_operation]
+    ))
     ad_group_ad_resource_name = ad_group_ad_response.results[0].resource_name
-    print(f"                                Created new shopping product ad in ad group '{ad_group_resource}'")
+    account_state.state.set_ad(ad_group_resource, ad_group_ad_resource_name)
+    log.info(f"                                Created new shopping product ad in ad group '{ad_group_resource}'")
     return ad_group_ad_resource_name
 
 # =========================
@@ -346,9 +413,8 @@ def add_shopping_product_ad_group_ad(client, customer_id, ad_group_resource):
 # =========================
 
 def next_id():
-    global last_criterion_id
-    last_criterion_id -= 1
-    return str(last_criterion_id)
+    # Thread-safe, process-wide temporary criterion IDs
+    return str(next_temp_id())
 
 def create_listing_group_subdivision(
     client,
@@ -357,20 +423,8 @@ def create_listing_group_subdivision(
     parent_ad_group_criterion_resource_name=None,
     listing_dimension_info=None,
 ):
-    operation = client.get_type("AdGroupCriterionOperation")
-    ad_group_criterion = operation.create
-    ad_group_criterion.resource_name = client.get_service(
-        "AdGroupCriterionService"
-    ).ad_group_criterion_path(customer_id, ad_group_id, next_id())
-    ad_group_criterion.status = client.enums.AdGroupCriterionStatusEnum.ENABLED
-
-    listing_group_info = ad_group_criterion.listing_group
-    listing_group_info.type_ = client.enums.ListingGroupTypeEnum.SUBDIVISION
-    if parent_ad_group_criterion_resource_name is not None:
-        listing_group_info.parent_ad_group_criterion = parent_ad_group_criterion_resource_name
-    if listing_dimension_info is not None:
-        client.copy_from(listing_group_info.case_value, listing_dimension_info)
-    return operation
+    factory = ListingGroupOperationFactory.for_ad_group(client, customer_id, ad_group_id)
+    return factory.subdivision(parent_ad_group_criterion_resource_name, listing_dimension_info)
 
 def create_listing_group_unit_biddable(
         client,
@@ -381,27 +435,15 @@ def create_listing_group_unit_biddable(
         targeting_negative,
         cpc_bid_micros=None
 ):
-    operation = client.get_type("AdGroupCriterionOperation")
-    criterion = operation.create
-    criterion.resource_name = client.get_service(
-        "AdGroupCriterionService"
-    ).ad_group_criterion_path(customer_id, ad_group_id, next_id())
-    criterion.status = client.enums.AdGroupCriterionStatusEnum.ENABLED
-    if cpc_bid_micros and targeting_negative == False:
-        criterion.cpc_bid_micros = cpc_bid_micros
-
-    listing_group = criterion.listing_group
-    listing_group.type_ = client.enums.ListingGroupTypeEnum.UNIT
-    listing_group.parent_ad_group_criterion = parent_ad_group_criterion_resource_name
-
     # Case values contain the listing dimension used for the node.
     # For OTHERS units, pass a ListingDimensionInfo with index but no value
-    if listing_dimension_info is not None:
-        client.copy_from(listing_group.case_value, listing_dimension_info)
-
-    if targeting_negative:
-        criterion.negative = True
-    return operation
+    factory = ListingGroupOperationFactory.for_ad_group(client, customer_id, ad_group_id)
+    return factory.unit(
+        parent_ad_group_criterion_resource_name,
+        listing_dimension_info,
+        negative=targeting_negative,
+        cpc_bid_micros=cpc_bid_micros,
+    )
 
 def _clean_shopname(name: str) -> str:
     return name.split("|")[0].strip() if name else name
@@ -429,7 +471,7 @@ def list_ad_groups_in_campaign(client, customer_id: str, campaign_resource_name:
     res = ga.search(customer_id=customer_id, query=q)
     return [(row.ad_group.id, row.ad_group.resource_name, row.ad_group.name) for row in res]
 
-def get_merchant_id_for_campaign(customer_id, shop_id):
+def get_merchant_id_for_campaign(client, customer_id, shop_id):
     try:
         ga_service = client.get_service("GoogleAdsService")
         query = f"""
@@ -445,69 +487,51 @@ def get_merchant_id_for_campaign(customer_id, shop_id):
         for row in response:
             return row.campaign.shopping_setting.merchant_id
         return None
-    except GoogleAdsException as ex:
-        print(f"❌ Google Ads API error (get_merchant_id_for_campaign): {ex.failure}")
+    except google_ads_exception() as ex:
+        log.error(f"❌ Google Ads API error (get_merchant_id_for_campaign): {ex.failure}")
         return None
 
-# --- Safe removal helpers (units -> subs) ---
-def list_listing_groups_with_depth(client, customer_id: str, ad_group_id: str):
-    ga = client.get_service("GoogleAdsService")
-    ag_path = client.get_service("AdGroupService").ad_group_path(customer_id, ad_group_id)
-    q = f"""
-      SELECT
-        ad_group_criterion.resource_name,
-        ad_group_criterion.listing_group.type,
-        ad_group_criterion.listing_group.parent_ad_group_criterion
-      FROM ad_group_criterion
-      WHERE ad_group_criterion.ad_group = '{ag_path}'
-        AND ad_group_criterion.type = 'LISTING_GROUP'
-    """
-    rows = list(ga.search(customer_id=customer_id, query=q))
-    by_res = {r.ad_group_criterion.resource_name: r for r in rows}
-    depth = {}
-    def get_depth(res):
-        if res in depth:
-            return depth[res]
-        parent = by_res[res].ad_group_criterion.listing_group.parent_ad_group_criterion
-        d = 0 if not parent else 1 + get_depth(parent)
-        depth[res] = d
-        return d
-    for r in rows:
-        get_depth(r.ad_group_criterion.resource_name)
-    return rows, depth
-
-def safe_remove_entire_listing_tree(client, customer_id: str, ad_group_id: str):
-    agc = client.get_service("AdGroupCriterionService")
-    rows, depth = list_listing_groups_with_depth(client, customer_id, ad_group_id)
-    if not rows:
-        return
-
-    # Find the root SUBDIVISION (the one with no parent)
-    root = None
-    for r in rows:
-        if not r.ad_group_criterion.listing_group.parent_ad_group_criterion:
-            root = r
-            break
-
-    if not root:
-        return
-
-    # Remove only the root - the API will cascade-delete all children
-    op = client.get_type("AdGroupCriterionOperation")
-    op.remove = root.ad_group_criterion.resource_name
-
-    try:
-        agc.mutate_ad_group_criteria(customer_id=customer_id, operations=[op])
-    except GoogleAdsException as ex:
-        # Ignore if the tree is already gone or resource not found
-        if not any(
-            (getattr(e.error_code, "criterion_error", None) and
-             e.error_code.criterion_error.name == "LISTING_GROUP_DOES_NOT_EXIST") or
-            (getattr(e.error_code, "mutate_error", None) and
-             e.error_code.mutate_error.name == "RESOURCE_NOT_FOUND")
-            for e in ex.failure.errors
-        ):
-            raise
+# --- tag_toppers inclusion tree ---
+def read_inclusion_tree(client, customer_id: str, ad_group_id):
+    """Listing tree of a tag_toppers ad group as tree_plan.snapshot() nodes."""
+    # Tree known from this run's own mutates (e.g. a new ad group): no read needed
+    known = account_state.state.tree(customer_id, ad_group_id)
+    if known is not None:
+        return known
+    # Served from the local cache unless change_status reports edits to this ad group
+    query = label_tree_query(customer_id, ad_group_id)
+    with tracing.span("tree_read", ad_group=ad_group_id) as read_span:
+        rows = tree_cache.read_tree(client, customer_id, str(ad_group_id), query)
+        read_span.set(rows=len(rows))
+    return tree_plan.snapshot(rows)
+
+
+def inclusion_tree_operations(client, customer_id: str, ad_group_id, tree, bid_micros: int):
+    """
+    Operations for a tree_plan.plan_inclusion_tree() plan.
+
+    Returns:
+        (operations, structure_count, item_ids_by_index). A diff is the unit
+        removals, the bid updates and the new units under the existing root
+        (structure_count 0). A new tree is the removal of the old root (if any),
+        the root and the negative Item-ID OTHERS - the first structure_count
+        operations - followed by all units.
+    """
+    factory = ListingGroupOperationFactory.for_ad_group(client, customer_id, ad_group_id)
+    if tree["status"] == "ok":
+        operations = [proto_fast.remove_operation(client, name) for name in tree["remove"]]
+        operations += [proto_fast.bid_update_operation(client, name, bid) for name, bid in tree["bids"].items()]
+        parent, structure_count, item_ids = tree["root"], 0, tree["add"]
+    else:
+        operations = [proto_fast.remove_operation(client, tree["root"])] if tree["root"] else []
+        # ROOT SUBDIVISION (no case_value) + Item ID OTHERS (negative - blocks everything except specific IDs)
+        root_op = factory.subdivision()
+        parent = root_op.create.resource_name
+        operations += [root_op, factory.item_id_others(parent, negative=True)]
+        structure_count, item_ids = len(operations), tree["item_ids"]
+    first = len(operations)
+    operations += factory.item_id_units(parent, item_ids, bid_micros)
+    return operations, structure_count, {first + i: item_id for i, item_id in enumerate(item_ids)}
 
 
 # -------- ONLY specific Item IDs (INCLUDE logic - for tag_toppers campaigns) --------
@@ -525,6 +549,10 @@ def rebuild_tree_with_specific_item_ids(
     └─ Specific Item IDs [POSITIVE, biddable] → Show only these items
 
     This uses INCLUSIVE logic: ONLY show specific IDs, block everything else.
+
+    An existing tree with this structure is updated in place: only the missing
+    Item IDs are added and the ones no longer requested removed, plus bid
+    updates, in one request. Any other tree is replaced.
     """
     if item_ids is None:
         item_ids = []
@@ -532,97 +560,69 @@ def rebuild_tree_with_specific_item_ids(
     # CRITICAL FIX: Ensure item_ids is a list, not a string
     # If it's a string, iterating over it gives individual characters!
     if isinstance(item_ids, str):
-        print(f"⚠️ WARNING: item_ids was a string, not a list! Converting...")
-        print(f"   String value: '{item_ids[:100]}...'")
+        tt_log.warning(f"⚠️ WARNING: item_ids was a string, not a list! Converting...")
+        tt_log.debug(f"   String value: '{item_ids[:100]}...'")
         # Try to parse it as comma-separated
         import re
         splitter = re.compile(r"[;,|\s]+")
         item_ids = [p.strip() for p in splitter.split(item_ids) if p.strip()]
-        print(f"   Converted to list with {len(item_ids)} items")
+        tt_log.debug(f"   Converted to list with {len(item_ids)} items")
 
     if not item_ids:
-        print("⚠️ No item IDs provided - skipping tree rebuild")
+        tt_log.warning("⚠️ No item IDs provided - skipping tree rebuild")
         return
 
-    # 1) Oude boom veilig verwijderen
-    safe_remove_entire_listing_tree(client, customer_id, str(ad_group_id))
-
-    agc = client.get_service("AdGroupCriterionService")
-
-    # MUTATE 1: Create root SUBDIVISION + Item ID OTHERS (negative)
-    ops1 = []
-
-    # 1. ROOT SUBDIVISION (no case_value - root is always just "everything")
-    root_op = create_listing_group_subdivision(
-        client=client,
-        customer_id=customer_id,
-        ad_group_id=str(ad_group_id),
-        parent_ad_group_criterion_resource_name=None,
-        listing_dimension_info=None  # Root has no dimension
+    # The plan deduplicates the Item IDs (LISTING_GROUP_ALREADY_EXISTS) and diffs them against the tree
+    tree = tree_plan.plan_inclusion_tree(read_inclusion_tree(client, customer_id, ad_group_id),
+                                         item_ids, default_bid_micros)
+    operations, structure_count, item_ids_by_index = inclusion_tree_operations(
+        client, customer_id, ad_group_id, tree, default_bid_micros
     )
-    root_tmp = root_op.create.resource_name
-    ops1.append(root_op)
+    if not operations:
+        tt_log.info(f"✅ Tree up to date: {tree['unchanged']} Item IDs, nothing to change.")
+        return
+    if tree["status"] == "rebuild":
+        tt_log.info("ℹ️ Existing tree is not an Item-ID inclusion tree - replacing it.")
 
-    # 2. Item ID OTHERS (negative - blocks everything except specific IDs)
-    dim_itemid_others = client.get_type("ListingDimensionInfo")
-    client.copy_from(
-        dim_itemid_others.product_item_id,
-        client.get_type("ProductItemIdInfo"),
-    )
-    # Don't set value - OTHERS case
-    ops1.append(
-        create_listing_group_unit_biddable(
-            client=client,
-            customer_id=customer_id,
-            ad_group_id=str(ad_group_id),
-            parent_ad_group_criterion_resource_name=root_tmp,
-            listing_dimension_info=dim_itemid_others,
-            targeting_negative=True,  # NEGATIVE - blocks everything else
-            cpc_bid_micros=None
-        )
+    agc = client.get_service("AdGroupCriterionService")
+    tree_cache.invalidate(customer_id, str(ad_group_id))
+
+    if structure_count:
+        # New tree: the old root is removed in the same request, so the ad group always has a tree
+        structure, operations = operations[:structure_count], operations[structure_count:]
+        resp1 = agc.mutate_ad_group_criteria(customer_id=customer_id, operations=structure)
+        account_state.state.record_criteria(customer_id, ad_group_id, structure, resp1)
+        root_actual = resp1.results[structure_count - 2].resource_name
+        for op in operations:
+            op.create.listing_group.parent_ad_group_criterion = root_actual
+        item_ids_by_index = {index - structure_count: item_id for index, item_id in item_ids_by_index.items()}
+
+    # Debug: Log IDs being sent to Google Ads
+    new_item_ids = list(item_ids_by_index.values())
+    tt_log.debug(f"DEBUG: Sending {len(new_item_ids)} new Item IDs to Google Ads:")
+    if tt_item_log.isEnabledFor(logging.DEBUG):
+        for idx, item_id in enumerate(new_item_ids[:5], 1):  # Show first 5
+            tt_item_log.debug(f"  {idx}. '{item_id}' (length: {len(str(item_id))})")
+        if len(new_item_ids) > 5:
+            tt_item_log.debug(f"  ... and {len(new_item_ids) - 5} more")
+
+    # Partial failure: a rejected Item ID costs one operation, not the whole row
+    resp2, rejected = mutate_item_id_criteria(
+        client, agc, customer_id, operations,
+        item_ids_by_index=item_ids_by_index,
+        ad_group_id=ad_group_id,
     )
-
-    # Execute first mutate
-    resp1 = agc.mutate_ad_group_criteria(customer_id=customer_id, operations=ops1)
-    root_actual = resp1.results[0].resource_name
-    time.sleep(0.5)  # Wait for criteria to propagate
-
-    # MUTATE 2: Add specific Item IDs as POSITIVE units (to show only them)
-    ops2 = []
-
-    # Deduplicate the list to avoid LISTING_GROUP_ALREADY_EXISTS errors
-    unique_item_ids = list(dict.fromkeys(item_ids))  # Preserves order while deduplicating
-
-    # Debug: Print IDs being sent to Google Ads
-    print(f"DEBUG: Sending {len(unique_item_ids)} unique Item IDs to Google Ads:")
-    for idx, item_id in enumerate(unique_item_ids[:5], 1):  # Show first 5
-        print(f"  {idx}. '{item_id}' (length: {len(str(item_id))})")
-    if len(unique_item_ids) > 5:
-        print(f"  ... and {len(unique_item_ids) - 5} more")
-
-    for item_id in unique_item_ids:
-        dim_item = client.get_type("ListingDimensionInfo")
-        dim_item.product_item_id.value = str(item_id)
-        ops2.append(
-            create_listing_group_unit_biddable(
-                client=client,
-                customer_id=customer_id,
-                ad_group_id=str(ad_group_id),
-                parent_ad_group_criterion_resource_name=root_actual,
-                listing_dimension_info=dim_item,
-                targeting_negative=False,  # POSITIVE targeting
-                cpc_bid_micros=default_bid_micros
-            )
-        )
-
-    if ops2:
-        agc.mutate_ad_group_criteria(customer_id=customer_id, operations=ops2)
-        unique_count = len(unique_item_ids)
-        total_count = len(item_ids)
-        if total_count > unique_count:
-            print(f"✅ Tree rebuilt: ONLY show {unique_count} unique Item IDs ({total_count-unique_count} duplicates removed), block all others.")
-        else:
-            print(f"✅ Tree rebuilt: ONLY show {unique_count} Item IDs, block all others.")
+    account_state.state.record_criteria(customer_id, ad_group_id, operations, resp2)
+    unique_item_ids = tree["item_ids"]
+    if tree["status"] == "ok":
+        tt_log.info(f"✅ Tree updated: +{len(new_item_ids) - len(rejected)} / -{len(tree['remove'])} Item IDs, "
+                    f"{len(tree['bids'])} bid(s) changed, {tree['unchanged']} unchanged.")
+    elif len(item_ids) > len(unique_item_ids):
+        tt_log.info(f"✅ Tree rebuilt: ONLY show {len(unique_item_ids) - len(rejected)} unique Item IDs ({len(item_ids)-len(unique_item_ids)} duplicates removed), block all others.")
+    else:
+        tt_log.info(f"✅ Tree rebuilt: ONLY show {len(unique_item_ids) - len(rejected)} Item IDs, block all others.")
+    if rejected:
+        tt_log.warning(f"⚠️ {len(rejected)} Item ID(s) rejected by Google Ads (see partial failure report)")
 
 # =========================
 # Spreadsheet I/O (tag_toppers input)
@@ -643,14 +643,14 @@ def mark_rows_as_processed(
         spreadsheet_id: Google Sheets spreadsheet ID
         worksheet_name: Name of the worksheet/tab
         column: Column letter to update (default: G)
+
+    Returns:
+        True if the sheet was updated, False otherwise
     """
     if not row_numbers:
-        return
+        return False
 
-    service_account_file = SERVICE_ACCOUNT_FILE
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]  # Need write permission
-    creds = service_account.Credentials.from_service_account_file(service_account_file, scopes=scopes)
-    service = build("sheets", "v4", credentials=creds)
+    service = get_sheets_service(write=True)  # Need write permission
     sheet = service.spreadsheets()
 
     # Build batch update data
@@ -667,17 +667,22 @@ def mark_rows_as_processed(
     }
 
     try:
-        result = sheet.values().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body=body
-        ).execute()
+        with accounting.call("sheets.values.batchUpdate") as call:
+            result = sheet.values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body=body
+            ).execute()
+            # Sheets cells, not Ads operations: they don't count toward the daily total
+            call.rows = len(data)
         updated_cells = result.get('totalUpdatedCells', 0)
-        print(f"✅ Marked {len(row_numbers)} row(s) as processed in column {column} ({updated_cells} cells updated)")
+        sheet_log.info(f"✅ Marked {len(row_numbers)} row(s) as processed in column {column} ({updated_cells} cells updated)")
+        return True
     except Exception as e:
-        print(f"❌ Error updating spreadsheet: {e}")
-        print(f"   Make sure the service account has edit access to the spreadsheet!")
+        sheet_log.error(f"❌ Error updating spreadsheet: {e}")
+        sheet_log.error(f"   Make sure the service account has edit access to the spreadsheet!")
         import traceback
         traceback.print_exc()
+        return False
 
 
 def get_spreadsheet_input(
@@ -685,15 +690,14 @@ def get_spreadsheet_input(
     worksheet_name: str = "tag_toppers",
     return_json: bool = True
 ):
-    service_account_file = SERVICE_ACCOUNT_FILE
-    scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
-    creds = service_account.Credentials.from_service_account_file(service_account_file, scopes=scopes)
-    service = build("sheets", "v4", credentials=creds)
+    service = get_sheets_service()
     sheet = service.spreadsheets()
 
     rng = f"{worksheet_name}!A:G"
-    resp = sheet.values().get(spreadsheetId=spreadsheet_id, range=rng).execute()
-    rows = resp.get("values", [])
+    with accounting.call("sheets.values.get") as call:
+        resp = sheet.values().get(spreadsheetId=spreadsheet_id, range=rng).execute()
+        rows = resp.get("values", [])
+        call.rows = len(rows)
 
     if not rows:
         return "[] " if return_json else []
@@ -737,17 +741,17 @@ def get_spreadsheet_input(
         raw_cell = r[5] if len(r) > 5 else ""
         item_ids  = parse_item_ids(raw_cell)  # Item IDs to INCLUDE (positive targeting)
 
-        # DEBUG: Print extraction details for first shop
-        if len(results) == 0 and item_ids:
-            print(f"\n=== DEBUG: Spreadsheet extraction (row {i}) ===")
-            print(f"Shop: {shop_name} (ID: {shop_id})")
-            print(f"Raw cell value (first 200 chars): '{raw_cell[:200]}'...")
-            print(f"Parsed to {len(item_ids)} IDs")
-            print(f"First 5 IDs:")
+        # DEBUG: Log extraction details for first shop
+        if len(results) == 0 and item_ids and sheet_log.isEnabledFor(logging.DEBUG):
+            sheet_log.debug(f"\n=== DEBUG: Spreadsheet extraction (row {i}) ===")
+            sheet_log.debug(f"Shop: {shop_name} (ID: {shop_id})")
+            sheet_log.debug(f"Raw cell value (first 200 chars): '{raw_cell[:200]}'...")
+            sheet_log.debug(f"Parsed to {len(item_ids)} IDs")
+            sheet_log.debug(f"First 5 IDs:")
             for idx, item_id in enumerate(item_ids[:5], 1):
-                print(f"  {idx}. '{item_id}' (length: {len(item_id)})")
-            print(f"item_ids type: {type(item_ids)}")
-            print("=" * 50 + "\n")
+                sheet_log.debug(f"  {idx}. '{item_id}' (length: {len(item_id)})")
+            sheet_log.debug(f"item_ids type: {type(item_ids)}")
+            sheet_log.debug("=" * 50 + "\n")
 
         if shop_id or shop_name:
             results.append({
@@ -760,19 +764,71 @@ def get_spreadsheet_input(
 
     return json.dumps(results, ensure_ascii=False) if return_json else results
 
+
+def coalesce_rows(rows):
+    """
+    Merges sheet rows for the same (shop_id, domain) into one row, so every
+    ad group of a shop is rebuilt once per run:
+
+        row       - first source row (journal identity of the merged row)
+        rows      - all source rows, marked as processed together
+        shop_name - from the most recent row
+        item_ids  - deduplicated union, in sheet order
+
+    Rows without shop_id or domain are passed on as they are (process_row skips them).
+    """
+    merged = {}
+    result = []
+    for row in rows:
+        shop_id = str(row.get("shop_id") or "").strip()
+        domain = str(row.get("domain") or "").strip().upper()
+        if not shop_id or not domain:
+            result.append({**row, "rows": [row.get("row")]})
+            continue
+
+        group = merged.get((shop_id, domain))
+        if group is None:
+            group = merged[(shop_id, domain)] = {**row, "rows": [row.get("row")], "item_ids": []}
+            group["_seen"] = set()
+            result.append(group)
+        else:
+            group["rows"].append(row.get("row"))
+            group["shop_name"] = row.get("shop_name") or group["shop_name"]
+        for item_id in row.get("item_ids") or []:
+            if item_id not in group["_seen"]:
+                group["_seen"].add(item_id)
+                group["item_ids"].append(item_id)
+
+    for group in merged.values():
+        del group["_seen"]
+        if len(group["rows"]) > 1:
+            sheet_log.info(f"🔗 Rijen {group['rows']} samengevoegd voor shop {group['shop_id']} ({group['domain']}): "
+                           f"{len(group['item_ids'])} unieke Item ID(s)")
+    return result
+
 # =========================
 # Tag-toppers campaign creation (label + item ID based)
 # =========================
 
-def create_tag_toppers_campaign(client, customer_id: str, mc_id: int, tracking_template: str, shopid: str, shopname: str, item_ids=None):
+# €5/dag
+TAG_TOPPERS_BUDGET_MICROS = 30_000_000
+
+def _tag_toppers_names(shopid, shopname):
+    """(base shop name, campaign name, budget name) of a shop's tag_toppers campaign."""
     base_shop = _clean_shopname(shopname)
     campaign_name = f"[shop:{base_shop}] [shop_id:{shopid}] [channel:directshopping] [label:tag_toppers]"
     budget_name = f"budget_{base_shop}_{shopid}_directshopping_tag_toppers_{int(time.time())}"
-    # €5/dag
-    budget_micros = 30_000_000
+    return base_shop, campaign_name, budget_name
+
+def _country(customer_id):
+    return "NL" if customer_id == customer_id_nl else ("BE" if customer_id == customer_id_be else "DE")
+
+def create_tag_toppers_campaign(client, customer_id: str, mc_id: int, tracking_template: str, shopid: str, shopname: str, item_ids=None):
+    base_shop, campaign_name, budget_name = _tag_toppers_names(shopid, shopname)
+    budget_micros = TAG_TOPPERS_BUDGET_MICROS
 
     # Gebruik MC-id uit bestaande campagne indien beschikbaar
-    mc_id_effective = get_merchant_id_for_campaign(customer_id, shopid) or mc_id
+    mc_id_effective = get_merchant_id_for_campaign(client, customer_id, shopid) or mc_id
 
     camp_res = add_standard_shopping_campaign(
         client=client,
@@ -781,7 +837,7 @@ def create_tag_toppers_campaign(client, customer_id: str, mc_id: int, tracking_t
         campaign_name=campaign_name,
         budget_name=budget_name,
         tracking_template=tracking_template,
-        country="NL" if customer_id == customer_id_nl else ("BE" if customer_id == customer_id_be else "DE"),
+        country=_country(customer_id),
         shopid=str(shopid),
         shopname=base_shop,
         label="tag_toppers",
@@ -789,7 +845,7 @@ def create_tag_toppers_campaign(client, customer_id: str, mc_id: int, tracking_t
         final_url_suffix=None
     )
     if not camp_res:
-        print(f"                ❌ Kon campagne niet aanmaken voor {base_shop} ({shopid})")
+        log.error(f"                ❌ Kon campagne niet aanmaken voor {base_shop} ({shopid})")
         return None
 
     # hergebruik of maak ad group
@@ -797,38 +853,17 @@ def create_tag_toppers_campaign(client, customer_id: str, mc_id: int, tracking_t
     ag_id = ag_res.split("/")[-1]
 
     # Boom plaatsen (ONLY specific item IDs)
-    rebuild_tree_with_specific_item_ids(
-        client, customer_id, int(ag_id),
-        item_ids=item_ids,
-        default_bid_micros=200_000
-    )
-
-    # Add shopping product ad with retry logic for concurrent modification errors
-    max_retries = 3
-    retry_delay = 2  # Start with 2 seconds
-
-    for attempt in range(max_retries):
-        try:
-            time.sleep(retry_delay)  # Wait for product partition tree to stabilize
-            add_shopping_product_ad_group_ad(client, customer_id, ag_res)
-            print(f"                🆕 Campagne opgebouwd: {campaign_name}")
-            break  # Success, exit retry loop
-        except GoogleAdsException as ex:
-            # Check if it's a concurrent modification error
-            is_concurrent_error = any(
-                (getattr(e.error_code, "database_error", None) and
-                 str(e.error_code.database_error) == "CONCURRENT_MODIFICATION")
-                for e in ex.failure.errors
-            )
+    with profiling.unit("ad_group", f"tag_toppers_{ag_id}", shop_id=shopid, customer=customer_id):
+        rebuild_tree_with_specific_item_ids(
+            client, customer_id, int(ag_id),
+            item_ids=item_ids,
+            default_bid_micros=200_000
+        )
 
-            if is_concurrent_error and attempt < max_retries - 1:
-                retry_delay *= 2  # Exponential backoff
-                print(f"                ⚠️ Concurrent modification detected, retrying in {retry_delay}s (attempt {attempt + 1}/{max_retries})...")
-                continue
-            else:
-                # Either not a concurrent error, or we've exhausted retries
-                print(f"                ❌ Failed to create ad after {attempt + 1} attempts")
-                raise
+    # Add shopping product ad. A CONCURRENT_MODIFICATION is raised: process_row puts the
+    # tag_toppers step on the deferred retry lane (retry_lane.py) instead of retrying inline
+    add_shopping_product_ad_group_ad(client, customer_id, ag_res)
+    log.info(f"                🆕 Campagne opgebouwd: {campaign_name}")
 
     return camp_res
 
@@ -859,22 +894,20 @@ def get_branded(shop_name):
     """
 
     try:
-        with closing(psycopg2.connect(
-            dbname='beslistbi',
-            user='j_vanschagen',
-            password='asjWQ@dmasm(asdm23',
-            host='production-redshiftstack-127n6djd-beslistredshift-zjsoh9hkk262.ccr4dsiux3yc.eu-central-1.redshift.amazonaws.com',
-            port='5439'
-        )) as conn, conn, closing(conn.cursor()) as cur:
+        # Shared connection (clients.py): stays open across rows and daemon cycles
+        conn = get_redshift_connection()
+        with conn, conn.cursor() as cur, accounting.call("redshift.get_branded") as call:
             cur.execute(sql, (shop_name,))
             row = cur.fetchone()
+            call.rows = 1 if row else 0
             if row and row[0] is not None:
                 # Sommige drivers geven bool terug; cast naar int
                 return int(row[0])
             return 0
     except Exception as e:
-        # Optioneel: loggen met print/logging
-        # print(f"get_branded_for_shop error: {e}")
+        # Verbinding weggooien; de volgende aanroep maakt een nieuwe
+        log.debug(f"get_branded_for_shop error: {e}")
+        reset_redshift_connection()
         return 0
 
 
@@ -897,9 +930,7 @@ def get_negatives(shopname):
     return [shopname, domain]
 
 
-def add_negative_keywords(client, customer_id, campaign_resource_name, negative_keywords):
-    campaign_criterion_service = client.get_service("CampaignCriterionService")
-
+def negative_keyword_ops(client, campaign_resource_name, negative_keywords):
     # Maak een lijst van operations om zowel EXACT als PHRASE varianten toe te voegen
     operations = []
 
@@ -914,16 +945,22 @@ def add_negative_keywords(client, customer_id, campaign_resource_name, negative_
             campaign_criterion.keyword.match_type = match_type  # Voeg zowel EXACT als PHRASE toe
 
             operations.append(campaign_criterion_operation)
+    return operations
+
+
+def add_negative_keywords(client, customer_id, campaign_resource_name, negative_keywords):
+    campaign_criterion_service = client.get_service("CampaignCriterionService")
+    operations = negative_keyword_ops(client, campaign_resource_name, negative_keywords)
 
     # Verstuur de mutatie-aanvraag naar Google Ads API
     try:
         response = campaign_criterion_service.mutate_campaign_criteria(
             customer_id=customer_id, operations=operations
         )
-        print(
+        log.info(
             f"                {len(negative_keywords) * 2} negatieve zoekwoorden toegevoegd (EXACT & PHRASE) aan campagne {campaign_resource_name}: {negative_keywords}")
-    except GoogleAdsException as ex:
-        print(f"                [Error] Fout bij toevoegen van negatieve zoekwoorden: {ex}")
+    except google_ads_exception() as ex:
+        log.error(f"                [Error] Fout bij toevoegen van negatieve zoekwoorden: {ex}")
 
 
 # =========================
@@ -933,84 +970,771 @@ def add_negative_keywords(client, customer_id, campaign_resource_name, negative_
 # no_data
 # [label_test] [shop:Wibra.nl] [shop_id:652337] [channel:directshopping] [label:no_data] [fallback]
 
-if __name__ == "__main__":
-    tag_rows = get_spreadsheet_input(return_json=False)
-    print(f"nr of CPR-shops to process: {len(tag_rows)}")
+def resolve_account(domain):
+    """Returns (customer_id, tracking_template, mc_id) for a sheet domain, or None if unknown."""
+    if domain == 'BE':
+        return customer_id_be, tracking_template_be, mc_id_be
+    elif domain == 'NL':
+        return customer_id_nl, tracking_template_nl, mc_id_nl
+    elif domain == 'DE':
+        return customer_id_de, tracking_template_de, mc_id_de
+    return None
 
-    processed_rows = []  # Track successfully processed row numbers
 
-    for campagne_data_cpr in tag_rows:
-        shopname = campagne_data_cpr.get("shop_name", "")
-        shopid = campagne_data_cpr.get("shop_id", "")
-        domain = campagne_data_cpr.get("domain", "")
-        item_ids = campagne_data_cpr.get("item_ids", [])
-        row_number = campagne_data_cpr.get("row")  # Get row number for tracking
+def prefetch_row(client, campagne_data_cpr):
+    """
+    Reads what process_row will read for a row - campaign lookup, ad-group
+    listing, label trees - into the prefetch pipeline (on a prefetch thread).
+    """
+    shopname = campagne_data_cpr.get("shop_name", "")
+    shopid = campagne_data_cpr.get("shop_id", "")
+    account = resolve_account(campagne_data_cpr.get("domain", ""))
+    if not shopid or not shopname or account is None:
+        return
+    customer_id = account[0]
+
+    with tracing.span("prefetch", category="prefetch", row=campagne_data_cpr.get("row"), shop_id=shopid), \
+            accounting.scope(shop=f"{shopid}:{shopname}"):
+        campaigns = prefetch.pipeline.fetch(
+            ("campaigns", customer_id, str(shopid), shopname),
+            lambda: find_campaigns_for_shop(client, customer_id, str(shopid), shopname),
+        )
+        for camp_id, camp_name, camp_res in campaigns or []:
+            ad_groups = prefetch.pipeline.fetch(
+                ("ad_groups", customer_id, camp_res),
+                lambda: list_ad_groups_in_campaign(client, customer_id, camp_res),
+            )
+            for ag_id, ag_res, ag_name in ad_groups or []:
+                if ag_name.lower().strip() not in VALID_LABELS:
+                    continue
+                query = label_tree_query(customer_id, ag_id)
+                prefetch.pipeline.fetch(
+                    ("tree", str(customer_id), str(ag_id), query),
+                    lambda: tree_cache.read_tree(client, customer_id, ag_id, query),
+                )
+
+
+def _rebuild_label_ad_group(client, customer_id, campaign_id, ag_id, ag_name, campagne_data_cpr, journal):
+    shopid = campagne_data_cpr.get("shop_id", "")
+    shopname = campagne_data_cpr.get("shop_name", "")
+    item_ids = campagne_data_cpr.get("item_ids", [])
+
+    start_unit()
+    with tracing.span("label_ad_group", customer=customer_id, ad_group=ag_id,
+                      ad_group_name=ag_name, item_ids=len(item_ids)), \
+            accounting.scope(ad_group=ag_id), \
+            progress.tracker.ad_group(ag_id, f"{shopname}/{ag_name}"), \
+            profiling.unit("ad_group", ag_id, shop_id=shopid, label=ag_name):
+        rebuild_tree_with_label_and_item_ids(
+            client, customer_id, int(ag_id),
+            ad_group_name=ag_name,
+            item_ids=item_ids,
+            default_bid_micros=200_000
+        )
+    journal.unit_done("ad_group_done", row_key(campagne_data_cpr), ag_id,
+                      campaign_id=str(campaign_id), ad_group_name=ag_name)
+    return True
+
+
+def rebuild_label_ad_group(client, customer_id, campaign_id, ag_id, ag_name, campagne_data_cpr, journal, deferred=None):
+    """
+    Rebuilds one label ad group of a row with its Item IDs and records it in
+    the journal. Runs on a scheduler thread; returns False if it failed.
+    After a transient error the ad group goes to the ``deferred`` retry lane
+    (retry_lane.py) and the row continues.
+    """
+    unit = functools.partial(_rebuild_label_ad_group, client, customer_id, campaign_id, ag_id, ag_name,
+                             campagne_data_cpr, journal)
+    try:
+        return unit()
+    except (google_ads_exception(), StructuralOperationError) as ex:
+        if deferred is not None and retry_lane.is_transient(ex):
+            deferred.defer(row_key(campagne_data_cpr), f"Ad group {ag_id} ({ag_name})", unit, ex,
+                           resources=[f"ad_group:{customer_id}:{ag_id}"])
+            return True
+        log.error(f"                ❌ Fout in ad group {ag_id}: {getattr(ex, 'failure', ex)}")
+        progress.tracker.error()
+        return False
+
+
+def _build_tag_toppers(client, campagne_data_cpr, journal, customer_id, tracking_template, mc_id):
+    shopname = campagne_data_cpr.get("shop_name", "")
+    shopid = campagne_data_cpr.get("shop_id", "")
+    item_ids = campagne_data_cpr.get("item_ids", [])
+
+    start_unit()
+    with tracing.span("tag_toppers", customer=customer_id, item_ids=len(item_ids)):
+        campaign_resource_name = create_tag_toppers_campaign(client, customer_id, mc_id, tracking_template, str(shopid), shopname, item_ids)
+    # A new campaign changes this shop's campaign lookup
+    prefetch.pipeline.invalidate("campaigns", customer_id, str(shopid))
+    with tracing.span("redshift_branded"):
+        branded = get_branded(shopname)
+
+    if branded == 0:
+        negative_keywords = get_negatives(shopname)
+        with tracing.span("negative_keywords", customer=customer_id, keywords=len(negative_keywords)):
+            add_negative_keywords(client, customer_id, campaign_resource_name, negative_keywords)
+
+    journal.unit_done("tag_toppers_done", row_key(campagne_data_cpr), campaign=campaign_resource_name)
+    return True
+
+
+def process_row(client, campagne_data_cpr, journal, deferred=None):
+    """
+    Processes one sheet row: label+Item ID trees in the existing campaigns
+    (ad groups rebuilt concurrently, see scheduler.py), then the tag_toppers
+    campaign. Completed ad groups and the tag_toppers step are recorded in the
+    journal and skipped when a run is resumed. With a ``deferred`` retry lane,
+    units that hit a transient error are retried there later.
+
+    Returns:
+        True if the row completed without critical errors, False if it failed,
+        None if it was skipped (missing fields / unknown domain),
+        retry_lane.DEFERRED if units of the row wait in ``deferred``.
+    """
+    shopname = campagne_data_cpr.get("shop_name", "")
+    shopid = campagne_data_cpr.get("shop_id", "")
+    domain = campagne_data_cpr.get("domain", "")
+    item_ids = campagne_data_cpr.get("item_ids", [])
+    row_number = campagne_data_cpr.get("row")  # Get row number for tracking
+    key = row_key(campagne_data_cpr)
+
+    if not shopid or not shopname or not domain:
+        log.warning(f"⚠️ Rij overgeslagen (ontbrekende velden): {campagne_data_cpr}")
+        return None
+
+    account = resolve_account(domain)
+    if account is None:
+        log.warning(f"⚠️ Onbekend domein: {domain}; rij overgeslagen.")
+        return None
+    customer_id, tracking_template, mc_id = account
+
+    row_processed_successfully = True  # Track if this row completed without critical errors
+    set_context(row=row_number, shop_id=str(shopid), shop_name=shopname, domain=domain)
+
+    # 1) Bestaande campagnes: boom vervangen door label+item IDs (OLD LOGIC - INVERSE)
+    with tracing.span("campaign_lookup", customer=customer_id):
+        existing = prefetch.pipeline.take(
+            ("campaigns", customer_id, str(shopid), shopname),
+            lambda: find_campaigns_for_shop(client, customer_id, str(shopid), shopname),
+        )
+    if existing:
+        # Ad groups of all campaigns are rebuilt concurrently (one lock per ad group)
+        tasks = []
+        for camp_id, camp_name, camp_res in existing:
+            log.info(f"                ➕ Label+Item ID boom in campagne: {camp_name} ({camp_id})")
+            with tracing.span("ad_group_listing", customer=customer_id, campaign=camp_id):
+                ad_groups = prefetch.pipeline.take(
+                    ("ad_groups", customer_id, camp_res),
+                    lambda: list_ad_groups_in_campaign(client, customer_id, camp_res),
+                )
+            for ag_id, ag_res, ag_name in ad_groups:
+                if journal.is_done("ad_group_done", key, ag_id):
+                    log.info(f"                ⏭️ Ad group {ag_id} ({ag_name}) al verwerkt in deze run")
+                    continue
+                tasks.append(([f"ad_group:{customer_id}:{ag_id}"], functools.partial(
+                    rebuild_label_ad_group, client, customer_id, camp_id, ag_id, ag_name,
+                    campagne_data_cpr, journal, deferred,
+                )))
+        if not all(scheduler.run_all(tasks)):
+            row_processed_successfully = False
+    else:
+        log.info(f"                ℹ️ Geen bestaande campagnes gevonden voor shop_id {shopid} + shop {shopname}")
+
+    # 2) Nieuwe (of hergebruik) tag_toppers campagne opzetten met ONLY specific item IDs (NEW LOGIC - INCLUSIVE)
+    if journal.is_done("tag_toppers_done", key):
+        log.info(f"                ⏭️ tag_toppers campagne al verwerkt in deze run")
+    else:
+        unit = functools.partial(_build_tag_toppers, client, campagne_data_cpr, journal,
+                                 customer_id, tracking_template, mc_id)
+        try:
+            unit()
+        except google_ads_exception() as ex:
+            if deferred is not None and retry_lane.is_transient(ex):
+                deferred.defer(key, f"tag_toppers {shopname} ({shopid})", unit, ex)
+            else:
+                log.error(f"                ❌ Google Ads API error (create_tag_toppers): {ex.failure}")
+                progress.tracker.error()
+                row_processed_successfully = False
+        except StructuralOperationError as ex:
+            if deferred is not None and retry_lane.is_transient(ex):
+                deferred.defer(key, f"tag_toppers {shopname} ({shopid})", unit, ex)
+            else:
+                log.error(f"                ❌ Tree error (create_tag_toppers): {ex}")
+                progress.tracker.error()
+                row_processed_successfully = False
+
+    if row_processed_successfully and deferred is not None and deferred.pending(key):
+        return retry_lane.DEFERRED
+    return row_processed_successfully
+
+
+# =========================
+# Batch-job backfill (--batch-job)
+# =========================
+
+def _ad_group_done(journal, key, ag_id, campaign_id, ag_name, resource_names):
+    journal.unit_done("ad_group_done", key, ag_id, campaign_id=str(campaign_id), ad_group_name=ag_name)
+
+
+def _tag_toppers_done(journal, key, campaign, campaign_position, resource_names):
+    if campaign_position is not None:
+        campaign = resource_names[campaign_position]
+    journal.unit_done("tag_toppers_done", key, campaign=campaign)
+
+
+def compile_tag_toppers(client, plan, journal, key, customer_id, mc_id, tracking_template, shopid, shopname, item_ids):
+    """
+    Batch-job counterpart of the tag_toppers step: adds whatever is missing
+    (budget, campaign with location and label, ad group, ad) plus the new
+    inclusion tree and the negative keywords to ``plan``, linked by temporary IDs.
+    """
+    base_shop, campaign_name, budget_name = _tag_toppers_names(shopid, shopname)
+    campaign = find_shopping_campaign(client, customer_id, str(shopid), base_shop, "tag_toppers")
+    ad_group = find_ad_group(client, customer_id, campaign, "tag_toppers") if campaign else None
+    unit = plan.unit(key, f"tag_toppers {shopname} ({shopid})")
+    # The journal gets the campaign's resource name; a new one comes from the job results
+    campaign_position = None
+
+    if campaign is None:
+        mc_id_effective = get_merchant_id_for_campaign(client, customer_id, shopid) or mc_id
+        budget = batch_jobs.temp_resource_name(customer_id, "campaignBudgets")
+        unit.add("campaign_budget_operation", [
+            campaign_budget_op(client, budget_name, TAG_TOPPERS_BUDGET_MICROS, resource_name=budget)
+        ])
+        campaign = batch_jobs.temp_resource_name(customer_id, "campaigns")
+        campaign_position = unit.add("campaign_operation", [
+            shopping_campaign_op(client, campaign_name, mc_id_effective, tracking_template, budget, resource_name=campaign)
+        ])
+        unit.add("campaign_criterion_operation", [
+            create_location_op(client, customer_id, campaign.split("/")[-1], _country(customer_id))
+        ], optional=True)
+        label_resource_name = ensure_campaign_label_exists(client, customer_id, script_label)
+        if label_resource_name:
+            unit.add("campaign_label_operation", [campaign_label_op(client, campaign, label_resource_name)], optional=True)
+
+    has_ad = False
+    nodes = []
+    if ad_group is None:
+        ad_group = batch_jobs.temp_resource_name(customer_id, "adGroups")
+        unit.add("ad_group_operation", [ad_group_op(client, campaign, "tag_toppers", 200_000, resource_name=ad_group)])
+    else:
+        has_ad = find_ad_group_ad(client, customer_id, ad_group) is not None
+        nodes = read_inclusion_tree(client, customer_id, ad_group.split("/")[-1])
+
+    # Only the changes to an existing inclusion tree; a new tree goes in right after removing
+    # the old one (consecutive listing-group operations are validated as one tree)
+    if item_ids:
+        ad_group_id = ad_group.split("/")[-1]
+        tree = tree_plan.plan_inclusion_tree(nodes, item_ids, 200_000)
+        operations, _, item_ids_by_index = inclusion_tree_operations(client, customer_id, ad_group_id, tree, 200_000)
+        if operations:
+            unit.add("ad_group_criterion_operation", operations, item_ids=item_ids_by_index)
+    else:
+        tt_log.warning("⚠️ No item IDs provided - skipping tree rebuild")
+
+    if not has_ad:
+        unit.add("ad_group_ad_operation", [shopping_product_ad_op(client, ad_group)])
+
+    if get_branded(shopname) == 0:
+        unit.add("campaign_criterion_operation",
+                 negative_keyword_ops(client, campaign, get_negatives(shopname)), optional=True)
+    unit.done = functools.partial(_tag_toppers_done, journal, key, campaign, campaign_position)
+
+
+def compile_row(client, campagne_data_cpr, journal, plans):
+    """
+    Batch-job counterpart of process_row: reads what the row needs and adds
+    its label ad groups and tag_toppers step to the BatchPlan of its account
+    (``plans``, by customer ID). Units without operations are recorded in the
+    journal right away.
+
+    Returns:
+        True if the row was compiled, False if it failed, None if it was skipped.
+    """
+    shopname = campagne_data_cpr.get("shop_name", "")
+    shopid = campagne_data_cpr.get("shop_id", "")
+    domain = campagne_data_cpr.get("domain", "")
+    item_ids = campagne_data_cpr.get("item_ids", [])
+    key = row_key(campagne_data_cpr)
+
+    if not shopid or not shopname or not domain:
+        log.warning(f"⚠️ Rij overgeslagen (ontbrekende velden): {campagne_data_cpr}")
+        return None
+    account = resolve_account(domain)
+    if account is None:
+        log.warning(f"⚠️ Onbekend domein: {domain}; rij overgeslagen.")
+        return None
+    customer_id, tracking_template, mc_id = account
+    set_context(row=campagne_data_cpr.get("row"), shop_id=str(shopid), shop_name=shopname, domain=domain)
+
+    if customer_id not in plans:
+        plans[customer_id] = batch_jobs.BatchPlan(customer_id, client)
+    plan = plans[customer_id]
 
-        if not shopid or not shopname or not domain:
-            print(f"⚠️ Rij overgeslagen (ontbrekende velden): {campagne_data_cpr}")
+    try:
+        with tracing.span("campaign_lookup", customer=customer_id):
+            existing = prefetch.pipeline.take(
+                ("campaigns", customer_id, str(shopid), shopname),
+                lambda: find_campaigns_for_shop(client, customer_id, str(shopid), shopname),
+            )
+        for camp_id, camp_name, camp_res in existing:
+            with tracing.span("ad_group_listing", customer=customer_id, campaign=camp_id):
+                ad_groups = prefetch.pipeline.take(
+                    ("ad_groups", customer_id, camp_res),
+                    lambda: list_ad_groups_in_campaign(client, customer_id, camp_res),
+                )
+            for ag_id, ag_res, ag_name in ad_groups:
+                if journal.is_done("ad_group_done", key, ag_id):
+                    continue
+                with tracing.span("label_ad_group", customer=customer_id, ad_group=ag_id, ad_group_name=ag_name):
+                    operations, item_ids_by_index = compile_label_tree(
+                        client, customer_id, int(ag_id), ag_name, item_ids, default_bid_micros=200_000
+                    )
+                done = functools.partial(_ad_group_done, journal, key, ag_id, camp_id, ag_name)
+                if operations:
+                    plan.unit(key, f"Ad group {ag_id} ({ag_name})", done).add(
+                        "ad_group_criterion_operation", operations, item_ids=item_ids_by_index
+                    )
+                else:
+                    done([])
+
+        if not journal.is_done("tag_toppers_done", key):
+            with tracing.span("tag_toppers", customer=customer_id, item_ids=len(item_ids)):
+                compile_tag_toppers(client, plan, journal, key, customer_id, mc_id, tracking_template,
+                                    str(shopid), shopname, item_ids)
+    except (google_ads_exception(), StructuralOperationError) as ex:
+        log.error(f"                ❌ Fout bij compileren van rij {campagne_data_cpr.get('row')}: {getattr(ex, 'failure', ex)}")
+        plan.discard(key)
+        return False
+    return True
+
+
+def run_batch(ads_client, tag_rows, journal):
+    """
+    Batch-job mode: compiles all rows into BatchJobs (batch_jobs.py) instead of
+    mutating shop by shop, runs them server-side and marks the rows whose
+    operations all succeeded. Returns the keys of the rows that failed or were skipped.
+    """
+    log.info(f"nr of CPR-shops to compile: {len(tag_rows)}")
+    prefetch.pipeline.start(tag_rows, functools.partial(prefetch_row, ads_client))
+
+    plans = {}
+    compiled = []
+    processed_rows = []
+    unfinished_rows = []
+    for index, campagne_data_cpr in enumerate(tag_rows):
+        prefetch.pipeline.advance(index)
+        row_number = campagne_data_cpr.get("row")
+        source_rows = [r for r in campagne_data_cpr.get("rows") or [row_number] if r]
+        if row_key(campagne_data_cpr) in journal.finished_rows:
+            log.info(f"⏭️ Rij {row_number} al verwerkt in deze run")
+            processed_rows.extend(r for r in source_rows if r not in journal.marked_rows)
             continue
 
-        if domain == 'BE':
-            customer_id = customer_id_be
-            tracking_template = tracking_template_be
-            mc_id = mc_id_be
-        elif domain == 'NL':
-            customer_id = customer_id_nl
-            tracking_template = tracking_template_nl
-            mc_id = mc_id_nl
-        elif domain == 'DE':
-            customer_id = customer_id_de
-            tracking_template = tracking_template_de
-            mc_id = mc_id_de
+        with tracing.span("shop_compile", row=row_number, shop_id=campagne_data_cpr.get("shop_id"),
+                          shop=campagne_data_cpr.get("shop_name")), \
+                accounting.scope(shop=f"{campagne_data_cpr.get('shop_id')}:{campagne_data_cpr.get('shop_name')}"):
+            compiled_ok = compile_row(ads_client, campagne_data_cpr, journal, plans)
+        if compiled_ok:
+            compiled.append(campagne_data_cpr)
+            continue
+        unfinished_rows.append(row_key(campagne_data_cpr))
+        if compiled_ok is False:
+            journal.row_finished(campagne_data_cpr, False)
+    prefetch.pipeline.stop()
+
+    operations = sum(len(plan.operations) for plan in plans.values())
+    log.info(f"\n📦 {len(compiled)} rij(en) gecompileerd: {operations} operatie(s) voor {len(plans)} account(s)")
+    outcome = batch_jobs.submit(batch_jobs.BatchJobs(ads_client), list(plans.values()))
+
+    for campagne_data_cpr in compiled:
+        success = outcome.get(row_key(campagne_data_cpr), True)
+        journal.row_finished(campagne_data_cpr, success)
+        if success:
+            processed_rows.extend(r for r in campagne_data_cpr.get("rows") or [campagne_data_cpr.get("row")] if r)
         else:
-            print(f"⚠️ Onbekend domein: {domain}; rij overgeslagen.")
+            unfinished_rows.append(row_key(campagne_data_cpr))
+
+    finish_run(journal, processed_rows)
+    return unfinished_rows
+
+
+def wrapped_ads_client():
+    """
+    The shared Ads client with one service handle per service (tuned transport),
+    journal acknowledgement, accounting, tracing and the rate governor.
+    """
+    # The governor is outermost: every retry is traced and accounted, waits are not API latency
+    return rate_limit.governed_client(tracing.traced_client(accounting.accounted_client(
+        acknowledging(transport.registered_client(get_ads_client()))
+    )))
+
+
+def run_rows(ads_client, tag_rows, journal, leases=None):
+    """
+    Processes the given sheet rows, marks the successful ones in the sheet and
+    writes the per-run reports. One call is one run (or one daemon cycle).
+    With ``leases`` (sharded mode) only rows whose lease could be claimed are
+    processed. Returns the keys of the rows that failed or were skipped.
+    """
+    log.info(f"nr of CPR-shops to process: {len(tag_rows)}")
+    progress.tracker.start(collections.Counter(row.get("domain") or "?" for row in tag_rows))
+
+    # Campaigns, ad groups and trees of the next shops are read while this one is processed
+    prefetch.pipeline.start(tag_rows, functools.partial(prefetch_row, ads_client))
+
+    processed_rows = []  # Track successfully processed row numbers
+    unfinished_rows = []  # row keys that failed or were skipped
+
+    # Units that failed with a transient error are retried between shops and at the end
+    deferred = retry_lane.DeferredQueue()
+    waiting = {}  # row key -> row whose units wait in the retry lane
+
+    def finish_row(row, success):
+        source_rows = [r for r in row.get("rows") or [row.get("row")] if r]
+        progress.tracker.shop_finished(row.get("domain") or "?", success=success is not False)
+        if leases is not None:
+            # Skipped rows (None) are skipped by every worker: done as well
+            leases.release(row_key(row), success is not False)
+        if not success:
+            unfinished_rows.append(row_key(row))
+        if success is None:
+            return
+        journal.row_finished(row, success)
+
+        # Mark row(s) as processed if completed successfully
+        if success:
+            processed_rows.extend(source_rows)
+
+    def settle(keys):
+        for key in keys:
+            row = waiting.pop(key, None)
+            if row is not None:
+                finish_row(row, not deferred.failed(key))
+
+    for index, campagne_data_cpr in enumerate(tag_rows):
+        row_number = campagne_data_cpr.get("row")
+        prefetch.pipeline.advance(index)
+
+        account = campagne_data_cpr.get("domain") or "?"
+
+        # Source rows merged into this one by coalesce_rows()
+        source_rows = [r for r in campagne_data_cpr.get("rows") or [row_number] if r]
+
+        if row_key(campagne_data_cpr) in journal.finished_rows:
+            log.info(f"⏭️ Rij {row_number} al verwerkt in deze run")
+            processed_rows.extend(r for r in source_rows if r not in journal.marked_rows)
+            progress.tracker.shop_finished(account)
+            if leases is not None and leases.claim(row_key(campagne_data_cpr)):
+                leases.release(row_key(campagne_data_cpr), True)
             continue
 
-        row_processed_successfully = True  # Track if this row completed without critical errors
+        if leases is not None and not leases.claim(row_key(campagne_data_cpr)):
+            log.info(f"⏭️ Rij {row_number} wordt door een andere worker verwerkt")
+            progress.tracker.shop_finished(account)
+            continue
 
-        # 1) Bestaande campagnes: boom vervangen door label+item IDs (OLD LOGIC - INVERSE)
-        existing = find_campaigns_for_shop(client, customer_id, str(shopid), shopname)
-        if existing:
-            for camp_id, camp_name, camp_res in existing:
-                print(f"                ➕ Label+Item ID boom in campagne: {camp_name} ({camp_id})")
-                ad_groups = list_ad_groups_in_campaign(client, customer_id, camp_res)
-                for ag_id, ag_res, ag_name in ad_groups:
-                    try:
-                        rebuild_tree_with_label_and_item_ids(
-                            client, customer_id, int(ag_id),
-                            ad_group_name=ag_name,
-                            item_ids=item_ids,
-                            default_bid_micros=200_000
-                        )
-                    except GoogleAdsException as ex:
-                        print(f"                ❌ Fout in ad group {ag_id}: {ex.failure}")
-                        row_processed_successfully = False
+        with tracing.span("shop", row=row_number, shop_id=campagne_data_cpr.get("shop_id"),
+                          shop=campagne_data_cpr.get("shop_name"), domain=campagne_data_cpr.get("domain")), \
+                accounting.scope(shop=f"{campagne_data_cpr.get('shop_id')}:{campagne_data_cpr.get('shop_name')}"), \
+                profiling.unit("shop", f"{row_number}_{campagne_data_cpr.get('shop_id')}",
+                               shop=campagne_data_cpr.get("shop_name")):
+            row_processed_successfully = process_row(ads_client, campagne_data_cpr, journal, deferred)
+        if row_processed_successfully == retry_lane.DEFERRED:
+            # Finished (and its lease released) once its deferred units are resolved
+            waiting[row_key(campagne_data_cpr)] = campagne_data_cpr
         else:
-            print(f"                ℹ️ Geen bestaande campagnes gevonden voor shop_id {shopid} + shop {shopname}")
+            finish_row(campagne_data_cpr, row_processed_successfully)
+        settle(deferred.run_due())
+
+    if waiting:
+        log.info(f"\n⏳ {len(deferred)} uitgestelde unit(s) van {len(waiting)} rij(en) opnieuw proberen...")
+        with tracing.span("deferred_drain", units=len(deferred)):
+            settle(deferred.drain())
+    if deferred.deferred:
+        log.info(f"⏳ Uitgesteld: {deferred.deferred} unit(s), {deferred.recovered} alsnog gelukt")
+
+    prefetch.pipeline.stop()
+    progress.tracker.stop()
+    if prefetch.pipeline.hits:
+        log.debug(f"Prefetch: {prefetch.pipeline.hits} hit(s), {prefetch.pipeline.misses} miss(es)")
+
+    finish_run(journal, processed_rows)
+    return unfinished_rows
+
+
+def write_run_reports(directory="reports"):
+    """Writes the rejected Item IDs, API accounting, profile summary and trace of the run (or job)."""
+    # Per-run report of Item IDs rejected in partial-failure mutates
+    report_path = run_report.write(directory)
+    if report_path:
+        summary = run_report.summary()
+        log.warning(f"\n⚠️ {summary['rejected_item_ids']} Item ID(s) rejected: {summary['rejected_by_error_code']}")
+        log.warning(f"   Report: {report_path}")
+
+    # Requests / operations / rows / bytes per shop, ad group and function
+    ledger = accounting.current_ledger()
+    accounting_path = ledger.write(directory)
+    if accounting_path:
+        totals = ledger.report()["totals"]
+        log.info(f"\n📊 API-gebruik: {totals['requests']} requests, {totals['operations']} operaties "
+                 f"(vandaag {ledger.daily_total()}/{ledger.budget})")
+        log.info(f"   Report: {accounting_path}")
+
+    profile_summary = profiling.write_summary()
+    if profile_summary:
+        log.info(f"\n🔬 Profielen: {profile_summary}")
+
+    trace_path = tracing.write(directory)
+    if trace_path:
+        log.info(f"\n⏱️ Trace: {trace_path}")
+        log.info(tracing.summary_table())
+
+
+def finish_run(journal, processed_rows):
+    """Marks ``processed_rows`` in the sheet, writes the run reports and resets the per-run state."""
+    # Batch update all processed rows in the spreadsheet
+    if processed_rows:
+        log.info(f"\n📝 Updating spreadsheet: marking {len(processed_rows)} row(s) as processed...")
+        log.debug(f"   Rows: {processed_rows}")
+        with tracing.span("write_back", rows=len(processed_rows)):
+            marked = mark_rows_as_processed(processed_rows)
+        if marked:
+            journal.rows_marked(processed_rows)
+    else:
+        log.warning(f"\n⚠️ No rows were successfully processed, spreadsheet will not be updated")
+
+    write_run_reports()
+
+    governor = rate_limit.governor
+    if governor.throttled or governor.waited_s >= 1:
+        log.info(f"⏳ Rate limit: {governor.waited_s:.1f}s gewacht, {governor.throttled} quotafout(en), "
+                 f"tempo nu {governor.factor:.0%}")
+
+    # Next run only checks change_status from this run's start onwards
+    tree_cache.commit()
+
+    # Daemon mode: the next cycle gets fresh reports and reads what others changed
+    account_state.state.reset()
+    run_report.reset()
+    accounting.reset()
+    profiling.reset()
+    tracing.reset()
+
+
+def run_daemon(poll_interval, resume=False):
+    """
+    Polls the tag_toppers sheet every ``poll_interval`` seconds and processes
+    new rows right away, with the Ads/Sheets/Redshift clients kept warm.
+
+    Rows that failed or were skipped are retried after ``DAEMON_RETRY_AFTER``
+    seconds instead of on every poll. The journal stays open across cycles until every
+    processed row is marked in the sheet, so a failed write-back is retried
+    without processing the rows again. SIGINT/SIGTERM stop the daemon after
+    the current cycle (a second SIGINT interrupts it).
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set() and signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        log.info("\n🛑 Stoppen na de huidige cyclus...")
+        stop.set()
 
-        # 2) Nieuwe (of hergebruik) tag_toppers campagne opzetten met ONLY specific item IDs (NEW LOGIC - INCLUSIVE)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    clients.warm_up()
+    ads_client = None
+    journal = None
+    failed_at = {}  # row_key -> time.monotonic() of the last failed/skipped attempt
+    log.info(f"🔁 Daemon gestart: sheet wordt elke {poll_interval:.0f}s gecontroleerd")
+
+    while not stop.is_set():
         try:
-            campaign_resource_name = create_tag_toppers_campaign(client, customer_id, mc_id, tracking_template, str(shopid), shopname, item_ids)
-            branded = get_branded(shopname)
+            with tracing.span("sheet_read"):
+                tag_rows = coalesce_rows(get_spreadsheet_input(return_json=False))
+            now = time.monotonic()
+            tag_rows = [row for row in tag_rows
+                        if now - failed_at.get(row_key(row), -DAEMON_RETRY_AFTER) >= DAEMON_RETRY_AFTER]
+
+            if tag_rows:
+                if ads_client is None:
+                    ads_client = wrapped_ads_client()
+                if journal is None:
+                    journal = RunJournal.open(resume=resume)
+                resume = False
+
+                failed = run_rows(ads_client, tag_rows, journal)
+                for key in failed:
+                    failed_at[key] = time.monotonic()
+                for row in tag_rows:
+                    if row_key(row) not in failed:
+                        failed_at.pop(row_key(row), None)
+
+                unmarked = [r for r in journal.finished_rows.values() if r and r not in journal.marked_rows]
+                if not unmarked:
+                    journal.finish()
+                    journal = None
+        except Exception as e:
+            # Keep polling; the next cycle starts from the sheet again
+            log.exception(f"❌ Daemon-cyclus mislukt: {e}")
+            progress.tracker.stop()
+
+        stop.wait(poll_interval)
+
+    if journal is not None:
+        journal.finish()
+    log.info("Klaar.")
+
+
+def run_sharded(worker_id=None, lease_ttl=None, resume=False):
+    """
+    Sharded mode: several workers (processes or hosts sharing the lease
+    database) read the same sheet, and each processes only the rows it can
+    lease (leases.py). Runs until every row is done or failed for good; while
+    other workers still hold rows it waits, so it takes those rows over when a
+    worker dies and its leases expire.
+    """
+    store = leases.LeaseStore(owner=worker_id, ttl=lease_ttl or leases.LEASE_TTL)
+    # One journal per worker; --resume needs the same --worker-id
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]+", "_", store.owner)
+    journal_path = os.path.join(os.path.dirname(JOURNAL_PATH) or ".", f"journal_{safe_id}.jsonl")
+    journal = RunJournal.open(path=journal_path, resume=resume)
+
+    clients.warm_up()
+    with tracing.span("sheet_read"):
+        tag_rows = coalesce_rows(get_spreadsheet_input(return_json=False))
+    with tracing.span("ads_client"):
+        ads_client = wrapped_ads_client()
+    log.info(f"🧩 Worker {store.owner}: {len(tag_rows)} shop(s) in de sheet")
+
+    with store.heartbeat():
+        while True:
+            states = store.states([row_key(row) for row in tag_rows])
+            free = [row for row in tag_rows if states[row_key(row)] == "free"]
+            held = sum(1 for state in states.values() if state == "held")
+            if free:
+                run_rows(ads_client, free, journal, leases=store)
+            elif held:
+                log.info(f"⏳ {held} shop(s) in behandeling bij andere workers, wachten...")
+                tracing.sleep(min(store.ttl / 3, 30))
+            else:
+                break
 
-            if branded == 0:
-                negative_keywords = get_negatives(shopname)
-                add_negative_keywords(client, customer_id, campaign_resource_name, negative_keywords)
+    done = sum(1 for state in store.states([row_key(row) for row in tag_rows]).values() if state == "done")
+    log.info(f"🧩 Worker {store.owner}: {done}/{len(tag_rows)} shop(s) klaar over alle workers")
+    store.close()
+    journal.finish()
+    log.info("Klaar.")
 
-        except GoogleAdsException as ex:
-            print(f"                ❌ Google Ads API error (create_tag_toppers): {ex.failure}")
-            row_processed_successfully = False
 
-        # Mark row as processed if completed successfully
-        if row_processed_successfully and row_number:
-            processed_rows.append(row_number)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GSD tag-toppers: Item-ID trees for label and tag_toppers campaigns")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Continue the last unfinished run from the checkpoint journal, skipping completed rows and ad groups"
+    )
+    parser.add_argument(
+        "--trace", action="store_true",
+        help="Record per-phase spans and write a Chrome/Perfetto trace to reports/ (same as TAGTOPPERS_TRACE=1)"
+    )
+    parser.add_argument(
+        "--profile", choices=["shop", "ad_group", "all"],
+        help="cProfile + tracemalloc per shop and/or per tree rebuild, written to reports/profiles/ "
+             "(same as TAGTOPPERS_PROFILE)"
+    )
+    parser.add_argument(
+        "--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Log level (default: TAGTOPPERS_LOG_LEVEL or INFO)"
+    )
+    parser.add_argument(
+        "--log-format", choices=["text", "json"],
+        help="Log output format (default: TAGTOPPERS_LOG_FORMAT or text)"
+    )
+    parser.add_argument(
+        "--no-tree-cache", action="store_true",
+        help="Read every listing tree from the API instead of using the change_status-validated tree cache"
+    )
+    parser.add_argument(
+        "--ad-group-workers", type=int,
+        help="Label ad groups of a shop rebuilt in parallel (default: TAGTOPPERS_AD_GROUP_WORKERS or 4; 1 = sequential)"
+    )
+    parser.add_argument(
+        "--plan-processes", type=int,
+        help="Processes that plan large listing-tree rebuilds (default: TAGTOPPERS_PLAN_PROCESSES or all cores; 1 = in-process)"
+    )
+    parser.add_argument(
+        "--shard", action="store_true",
+        help="Sharded run: process only the rows this worker can lease, next to other workers on the same lease database"
+    )
+    parser.add_argument(
+        "--worker-id",
+        help="Worker name in --shard mode (default: host:pid; set it to use --resume)"
+    )
+    parser.add_argument(
+        "--lease-ttl", type=float,
+        help="Seconds a lease stays valid without heartbeat in --shard mode (default: TAGTOPPERS_LEASE_TTL or 300)"
+    )
+    parser.add_argument(
+        "--prefetch", type=int,
+        help="Shops whose campaigns, ad groups and trees are read ahead (default: TAGTOPPERS_PREFETCH or 2; 0 = off)"
+    )
+    parser.add_argument(
+        "--batch-job", action="store_true",
+        help="Backfill: compile all rows into Google Ads BatchJobs and run them server-side instead of mutating per shop"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Keep running: poll the sheet and process new rows as they appear, with clients kept warm"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=DAEMON_POLL_INTERVAL,
+        help="Seconds between sheet polls in --daemon mode (default: TAGTOPPERS_POLL_INTERVAL or 120)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.log_level or args.log_format:
+        logs.configure(level=args.log_level, fmt=args.log_format)
+
+    if args.no_tree_cache:
+        tree_cache.set_enabled(False)
+    if args.trace:
+        tracing.set_enabled(True)
+    if args.profile:
+        profiling.set_mode(args.profile)
+    if args.ad_group_workers:
+        scheduler.set_workers(args.ad_group_workers)
+    if args.plan_processes:
+        tree_plan.set_processes(args.plan_processes)
+    if args.prefetch is not None:
+        prefetch.set_window(args.prefetch)
+
+    if args.daemon:
+        run_daemon(args.poll_interval, resume=args.resume)
+        return
+    if args.shard:
+        run_sharded(args.worker_id, args.lease_ttl, resume=args.resume)
+        return
+
+    journal = RunJournal.open(resume=args.resume)
 
-    # Batch update all processed rows in the spreadsheet
-    if processed_rows:
-        print(f"\n📝 Updating spreadsheet: marking {len(processed_rows)} row(s) as processed...")
-        print(f"   Rows: {processed_rows}")
-        mark_rows_as_processed(processed_rows)
+    # Token refresh / Ads client construction runs while the sheet is read
+    clients.warm_up()
+    with tracing.span("sheet_read"):
+        tag_rows = coalesce_rows(get_spreadsheet_input(return_json=False))
+
+    with tracing.span("ads_client"):
+        ads_client = wrapped_ads_client()
+    if args.batch_job:
+        run_batch(ads_client, tag_rows, journal)
     else:
-        print(f"\n⚠️ No rows were successfully processed, spreadsheet will not be updated")
+        run_rows(ads_client, tag_rows, journal)
 
-    print("Klaar.")
\ No newline at end of file
+    journal.finish()
+    log.info("Klaar.")
+
+
+if __name__ == "__main__":
+    main()
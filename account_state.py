@@ -0,0 +1,187 @@
+"""
+In-memory model of the account state this run wrote (read-your-writes).
+
+Creating mutates ask for the created resource back
+(``response_content_type=MUTABLE_RESOURCE``, see ``mutable_request``) and
+record it in ``state``. Later steps of the same run look it up there instead
+of reading back what was just written or sleeping "for propagation":
+
+    state.campaign(customer_id, key)              - campaign found/created for a shop
+    state.ad_group(customer_id, campaign, name)   - ad group found/created in a campaign
+    state.ad(ad_group)                            - shopping product ad of an ad group
+    state.label(customer_id, name)                - label resource name
+    state.tree(customer_id, ad_group_id)          - listing tree as tree_plan.snapshot()
+                                                    nodes, or None if unknown
+
+A campaign or ad group created in this run is known to be empty: it has no
+ad groups, no ad and no listing tree until the run adds them, so ``is_new()``
+lets the callers skip those searches. Listing trees are only known for ad
+groups created in this run; ``record_criteria`` keeps them up to date from
+the operations and the resource names in the mutate response (listing-group
+creates already contain the whole criterion, so those mutates don't ask for
+it back and the response stays small).
+
+The model only holds what this run wrote or looked up. ``reset()`` clears it
+after every run and daemon cycle, so hand edits made between runs are always
+read from the API. Jobs of the job API run concurrently, so each job gets its
+own model inside ``with scoped():``; ``state`` resolves to the model of the
+current context (scheduler tasks and deferred retries inherit it).
+"""
+
+import contextlib
+import contextvars
+import threading
+
+import proto_fast
+import tree_plan
+
+
+def mutable_request(client, request_type, customer_id, operations):
+    """``request_type`` (e.g. 'MutateCampaignsRequest') that returns the mutated resources."""
+    request = client.get_type(request_type)
+    request.customer_id = customer_id
+    request.operations = operations
+    request.response_content_type = client.enums.ResponseContentTypeEnum.MUTABLE_RESOURCE
+    return request
+
+
+def _tree_key(customer_id, ad_group_id):
+    return str(customer_id), str(ad_group_id)
+
+
+class AccountState:
+    """Thread-safe store of what this run created or looked up."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._campaigns = {}
+            self._ad_groups = {}
+            self._ads = {}
+            self._labels = {}
+            self._trees = {}
+            self._new = set()
+
+    # ---- campaigns, ad groups, ads, labels ----
+
+    def campaign(self, customer_id, key):
+        return self._campaigns.get((str(customer_id), key))
+
+    def set_campaign(self, customer_id, key, resource_name, created=False):
+        with self._lock:
+            self._campaigns[(str(customer_id), key)] = resource_name
+            if created:
+                self._new.add(resource_name)
+
+    def ad_group(self, customer_id, campaign, name):
+        return self._ad_groups.get((str(customer_id), campaign, name))
+
+    def set_ad_group(self, customer_id, campaign, name, resource_name, created=False):
+        with self._lock:
+            self._ad_groups[(str(customer_id), campaign, name)] = resource_name
+            if created:
+                self._new.add(resource_name)
+                # A new ad group has no listing tree yet
+                self._trees[_tree_key(customer_id, resource_name.split("/")[-1])] = {}
+
+    def ad(self, ad_group):
+        return self._ads.get(ad_group)
+
+    def set_ad(self, ad_group, resource_name):
+        with self._lock:
+            self._ads[ad_group] = resource_name
+
+    def label(self, customer_id, name):
+        return self._labels.get((str(customer_id), name))
+
+    def set_label(self, customer_id, name, resource_name):
+        with self._lock:
+            self._labels[(str(customer_id), name)] = resource_name
+
+    def is_new(self, resource_name) -> bool:
+        """Whether this run created the campaign/ad group, i.e. it is empty apart from what the run added."""
+        return resource_name in self._new
+
+    # ---- listing trees ----
+
+    def tree(self, customer_id, ad_group_id):
+        """The ad group's listing-tree nodes (copies), or None if the run doesn't know the tree."""
+        with self._lock:
+            nodes = self._trees.get(_tree_key(customer_id, ad_group_id))
+            return None if nodes is None else [dict(node) for node in nodes.values()]
+
+    def set_tree(self, customer_id, ad_group_id, nodes):
+        with self._lock:
+            self._trees[_tree_key(customer_id, ad_group_id)] = {node["resource_name"]: dict(node) for node in nodes}
+
+    def forget_tree(self, customer_id, ad_group_id):
+        with self._lock:
+            self._trees.pop(_tree_key(customer_id, ad_group_id), None)
+
+    def record_criteria(self, customer_id, ad_group_id, operations, response):
+        """
+        Applies a listing-group mutate to the known tree: removes drop the node
+        and its subtree, creates add the criterion under the resource name the
+        API returned (temporary parent names resolved from the same response),
+        bid updates change the node's bid.
+        Operations without a result (rejected in a partial-failure mutate) are skipped.
+        """
+        key = _tree_key(customer_id, ad_group_id)
+        with self._lock:
+            nodes = self._trees.get(key)
+            if nodes is None:
+                return
+            pairs = [(proto_fast.raw(op), result.resource_name) for op, result in zip(operations, response.results)]
+            created = {op.create.resource_name: name for op, name in pairs
+                       if name and op.WhichOneof("operation") == "create"}
+            for op, name in pairs:
+                if not name:
+                    continue
+                if op.WhichOneof("operation") == "remove":
+                    self._drop_subtree(nodes, op.remove)
+                elif op.WhichOneof("operation") == "create":
+                    node = tree_plan.snapshot_node(op.create)
+                    node["resource_name"] = name
+                    node["parent"] = created.get(node["parent"], node["parent"])
+                    nodes[name] = node
+                elif op.WhichOneof("operation") == "update" and name in nodes:
+                    nodes[name]["bid_micros"] = int(op.update.cpc_bid_micros)
+
+    @staticmethod
+    def _drop_subtree(nodes, resource_name):
+        doomed = {resource_name}
+        changed = True
+        while changed:
+            children = {name for name, node in nodes.items() if node["parent"] in doomed and name not in doomed}
+            doomed |= children
+            changed = bool(children)
+        for name in doomed:
+            nodes.pop(name, None)
+
+
+# Model of the job being processed in this context (job API), see scoped()
+_scoped = contextvars.ContextVar("account_state", default=None)
+_run_state = AccountState()
+
+
+class _CurrentState:
+    """``state``: the AccountState of the current job, or the run-wide one."""
+
+    def __getattr__(self, name):
+        return getattr(_scoped.get() or _run_state, name)
+
+
+state = _CurrentState()
+
+
+@contextlib.contextmanager
+def scoped():
+    """Gives the calls made inside the block (one job) their own, empty AccountState."""
+    token = _scoped.set(AccountState())
+    try:
+        yield
+    finally:
+        _scoped.reset(token)
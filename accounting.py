@@ -0,0 +1,358 @@
+"""
+API call and operation accounting, with a running total against a daily budget.
+
+Every ``GoogleAdsService.search*`` and ``mutate_*`` call made through the
+``accounted_client`` wrapper, and every Sheets/Redshift call wrapped in
+``call(...)``, is counted per shop, ad group and calling function:
+
+    requests   - API requests
+    operations - mutate operations (a search request counts as one)
+    rows       - search rows / mutate results returned
+    bytes_out  - serialized request size (mutate operations)
+    bytes_in   - serialized response size
+    latency_s  - time spent inside the API call
+
+Developer-token limits count operations per day (Pacific time), so
+``operations`` is also added to a persisted daily total
+(``reports/quota_usage.json``) and compared against
+``TAGTOPPERS_DAILY_OPERATION_BUDGET`` (default 15,000, the Basic access
+limit). Warnings are printed at 80% and 100% of the budget.
+
+``write()`` stores the per-run report as ``reports/accounting_<timestamp>.json``.
+Jobs of the job API run concurrently; inside ``with scoped():`` a job records
+its calls in its own ledger (``current_ledger()``), and every ledger adds its
+operations to the shared daily total.
+"""
+
+import contextlib
+import contextvars
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import logs
+import proto_fast
+
+log = logs.get_logger("accounting")
+
+DAILY_OPERATION_BUDGET = int(os.getenv("TAGTOPPERS_DAILY_OPERATION_BUDGET", "15000"))
+USAGE_PATH = os.getenv("TAGTOPPERS_QUOTA_USAGE", os.path.join("reports", "quota_usage.json"))
+
+# Quota days roll over at midnight Pacific time
+_QUOTA_TIME_ZONE = ZoneInfo("America/Los_Angeles")
+_WARN_FRACTION = 0.8
+
+# Shop / ad group the current calls are made for
+_scope = contextvars.ContextVar("accounting_scope", default={})
+# Ledger of the job being processed in this context (job API), see scoped()
+_job_ledger = contextvars.ContextVar("accounting_ledger", default=None)
+# Ledgers of concurrent jobs update the daily usage file one at a time
+_usage_lock = threading.Lock()
+
+# Frames of the client wrappers are skipped when resolving the calling function
+_WRAPPER_FILES = {"accounting.py", "tracing.py", "checkpoint.py", "partial_failure.py", "rate_limit.py",
+                  "contextlib.py"}
+
+_FIELDS = ("requests", "operations", "rows", "bytes_out", "bytes_in", "latency_s")
+
+
+def _empty():
+    return dict.fromkeys(_FIELDS, 0)
+
+
+class Ledger:
+    """Thread-safe counters for one run, plus the persisted daily total."""
+
+    def __init__(self, budget=DAILY_OPERATION_BUDGET, usage_path=USAGE_PATH):
+        self._lock = threading.Lock()
+        self.budget = budget
+        self.usage_path = usage_path
+        self.totals = _empty()
+        self.by_shop = {}
+        self.by_ad_group = {}
+        self.by_function = {}
+        self.by_api = {}
+        self._day, self._day_start = self._load_daily_usage()
+        self._saved_operations = 0
+        self._warned = set()
+
+    # ---- daily usage ----
+
+    @staticmethod
+    def _quota_day() -> str:
+        return datetime.datetime.now(_QUOTA_TIME_ZONE).strftime("%Y-%m-%d")
+
+    def _load_daily_usage(self):
+        day = self._quota_day()
+        try:
+            with open(self.usage_path, "r", encoding="utf-8") as f:
+                usage = json.load(f)
+        except (OSError, ValueError):
+            usage = {}
+        return day, int(usage.get(day, 0))
+
+    def daily_total(self) -> int:
+        """Operations used today, including earlier runs."""
+        with self._lock:
+            return self._day_start + self.totals["operations"]
+
+    def save_daily_usage(self):
+        """Adds this run's operations (since the last save) to the persisted daily total."""
+        with _usage_lock:
+            try:
+                with open(self.usage_path, "r", encoding="utf-8") as f:
+                    usage = json.load(f)
+            except (OSError, ValueError):
+                usage = {}
+            with self._lock:
+                operations = self.totals["operations"]
+                usage[self._day] = usage.get(self._day, self._day_start) + operations - self._saved_operations
+                self._saved_operations = operations
+            # Keep a month of history
+            usage = dict(sorted(usage.items())[-31:])
+            os.makedirs(os.path.dirname(self.usage_path) or ".", exist_ok=True)
+            with open(self.usage_path, "w", encoding="utf-8") as f:
+                json.dump(usage, f, indent=2)
+
+    def _check_budget(self, daily):
+        if not self.budget:
+            return
+        for fraction in (_WARN_FRACTION, 1.0):
+            if daily >= fraction * self.budget and fraction not in self._warned:
+                self._warned.add(fraction)
+                log.warning(f"⚠️ Operatie-budget: {daily}/{self.budget} operaties vandaag ({daily / self.budget:.0%})")
+
+    # ---- recording ----
+
+    def record(self, api, function, requests=1, operations=0, rows=0, bytes_out=0, bytes_in=0, latency_s=0.0):
+        scope = _scope.get()
+        values = {
+            "requests": requests, "operations": operations, "rows": rows,
+            "bytes_out": bytes_out, "bytes_in": bytes_in, "latency_s": latency_s,
+        }
+        keys = [
+            (self.by_api, api),
+            (self.by_function, function),
+            (self.by_shop, scope.get("shop")),
+            (self.by_ad_group, scope.get("ad_group")),
+        ]
+        with self._lock:
+            for field, value in values.items():
+                self.totals[field] += value
+            for table, key in keys:
+                if key is None:
+                    continue
+                counters = table.setdefault(str(key), _empty())
+                for field, value in values.items():
+                    counters[field] += value
+            daily = self._day_start + self.totals["operations"]
+            self._check_budget(daily)
+
+    def report(self):
+        with self._lock:
+            def rounded(table):
+                return {key: {**c, "latency_s": round(c["latency_s"], 3)} for key, c in table.items()}
+            return {
+                "totals": {**self.totals, "latency_s": round(self.totals["latency_s"], 3)},
+                "daily": {
+                    "date": self._day,
+                    "operations": self._day_start + self.totals["operations"],
+                    "budget": self.budget,
+                },
+                "by_api": rounded(self.by_api),
+                "by_function": rounded(self.by_function),
+                "by_shop": rounded(self.by_shop),
+                "by_ad_group": rounded(self.by_ad_group),
+            }
+
+    def write(self, directory="reports"):
+        """Writes the run report, updates the daily total and returns the report path."""
+        if not self.totals["requests"]:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"accounting_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        self.save_daily_usage()
+        return path
+
+
+ledger = Ledger()
+
+
+def reset():
+    """Starts a new run ledger (daemon mode: one report per poll cycle)."""
+    global ledger
+    ledger = Ledger()
+
+
+def current_ledger() -> Ledger:
+    """The ledger of the current job, or the run ledger."""
+    return _job_ledger.get() or ledger
+
+
+@contextlib.contextmanager
+def scoped():
+    """Records the calls made inside the block (one job) in their own ledger."""
+    token = _job_ledger.set(Ledger(budget=ledger.budget, usage_path=ledger.usage_path))
+    try:
+        yield
+    finally:
+        _job_ledger.reset(token)
+
+
+@contextlib.contextmanager
+def scope(**attributes):
+    """Attributes calls made inside the block to a shop and/or ad group."""
+    token = _scope.set({**_scope.get(), **attributes})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _calling_function() -> str:
+    """Name of the first function on the stack outside the client wrappers."""
+    frame = sys._getframe(2)
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _WRAPPER_FILES:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "?"
+
+
+class _Call:
+    __slots__ = ("rows", "bytes_in", "bytes_out", "operations")
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.operations = 0
+
+
+@contextlib.contextmanager
+def call(api):
+    """
+    Accounts a call made outside the Ads client wrapper (Sheets, Redshift,
+    the batch-job upload); set ``rows``/``bytes_in`` on the yielded object
+    when known. ``operations`` count toward the Google Ads daily total: set
+    them for Ads calls only.
+
+        with accounting.call("sheets.values.get") as c:
+            resp = ...execute()
+            c.rows = len(resp.get("values", []))
+    """
+    function = _calling_function()
+    record = _Call()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        current_ledger().record(api, function, operations=record.operations, rows=record.rows,
+                                bytes_out=record.bytes_out, bytes_in=record.bytes_in,
+                                latency_s=time.perf_counter() - start)
+
+
+# ---- Google Ads client wrapper ----
+
+def _byte_size(message) -> int:
+    try:
+        return proto_fast.raw(message).ByteSize()
+    except (AttributeError, TypeError):
+        return 0
+
+
+def _mutate_operations(args, kwargs):
+    operations = kwargs.get("operations")
+    if operations is None and kwargs.get("request") is not None:
+        operations = getattr(kwargs["request"], "operations", None)
+    if operations is None and len(args) > 1:
+        operations = args[1]
+    return operations if operations is not None else []
+
+
+class _AccountedService:
+    def __init__(self, service, service_name):
+        self._service = service
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        api = f"{self._service_name}.{name}"
+        if name.startswith("mutate"):
+            return self._mutate(attr, api)
+        if name.startswith("search"):
+            return self._search(attr, api)
+        return attr
+
+    @staticmethod
+    def _mutate(method, api):
+        def mutate(*args, **kwargs):
+            function = _calling_function()
+            operations = _mutate_operations(args, kwargs)
+            response = None
+            start = time.perf_counter()
+            try:
+                response = method(*args, **kwargs)
+                return response
+            finally:
+                # Failed attempts (also the retried RESOURCE_EXHAUSTED ones) are counted too
+                current_ledger().record(
+                    api, function,
+                    operations=len(operations),
+                    rows=len(getattr(response, "results", None) or []),
+                    bytes_out=sum(_byte_size(op) for op in operations),
+                    bytes_in=_byte_size(response) if response is not None else 0,
+                    latency_s=time.perf_counter() - start,
+                )
+        return mutate
+
+    @staticmethod
+    def _search(method, api):
+        def search(*args, **kwargs):
+            function = _calling_function()
+            start = time.perf_counter()
+            pager = method(*args, **kwargs)
+            latency = time.perf_counter() - start
+
+            def rows():
+                # Pages are fetched lazily; only time spent fetching is counted
+                nonlocal latency
+                count = 0
+                size = 0
+                iterator = iter(pager)
+                try:
+                    while True:
+                        fetch_start = time.perf_counter()
+                        try:
+                            row = next(iterator)
+                        except StopIteration:
+                            latency += time.perf_counter() - fetch_start
+                            return
+                        latency += time.perf_counter() - fetch_start
+                        count += 1
+                        size += _byte_size(row)
+                        yield row
+                finally:
+                    current_ledger().record(api, function, operations=1, rows=count, bytes_in=size, latency_s=latency)
+            return rows()
+        return search
+
+
+class _AccountedClient:
+    def __init__(self, client):
+        self._client = client
+
+    def get_service(self, name, *args, **kwargs):
+        return _AccountedService(self._client.get_service(name, *args, **kwargs), name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def accounted_client(client):
+    """Wraps a GoogleAdsClient so every search/mutate call is counted."""
+    return _AccountedClient(client)
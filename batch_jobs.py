@@ -0,0 +1,436 @@
+"""
+BatchJobService submission for large backfills (``--batch-job``).
+
+A full backfill (every shop, every label ad group) is millions of mutate
+operations; sent synchronously that is hours of round trips and rate-limit
+waits. In batch-job mode a run still reads what it needs (campaign lookups,
+ad groups, label trees), but sends no mutates: every row is compiled into
+operations linked by temporary IDs and collected in a ``BatchPlan`` per
+account, which runs server-side as one or more BatchJobs:
+
+    plan = batch_jobs.BatchPlan(customer_id, client)
+    unit = plan.unit(key, name, done=callback)   - one journal unit of a row
+    unit.add("campaign_operation", [op])         - MutateOperation field + operations;
+                                                   returns their position in done()'s names
+    outcome = batch_jobs.submit(service, plans)  - create, upload, run, poll, read results
+
+Temporary IDs only resolve within one job, so a row is never split across
+jobs; a plan larger than ``TAGTOPPERS_BATCH_JOB_MAX_OPERATIONS`` (default
+1,000,000) becomes several jobs, cut at row boundaries. Operations are
+uploaded in chunks of ``TAGTOPPERS_BATCH_UPLOAD_CHUNK`` (default 5000) with
+the sequence token of the previous chunk. All jobs are started before the
+first one is polled; polling starts at ``TAGTOPPERS_BATCH_POLL_INTERVAL``
+seconds (default 15) and backs off to 5 minutes, for at most
+``TAGTOPPERS_BATCH_TIMEOUT`` seconds (default 6 hours).
+
+Results are mapped back per unit: a unit whose operations all succeeded calls
+``done(resource_names)`` (the journal entry of that ad group or tag_toppers
+step). A rejected Item-ID operation is recorded in the partial-failure report
+like in the synchronous path; any other rejected operation fails the unit and
+its row. ``submit`` returns ``{row key: success}``.
+
+``LocalBatchJobService`` is an in-process stand-in with the same methods,
+used by the tests.
+"""
+
+import bisect
+import os
+import time
+
+import accounting
+import logs
+import proto_fast
+import tracing
+from operation_factory import next_temp_id
+from partial_failure import current_context, run_report
+
+log = logs.get_logger("batch_jobs")
+
+MAX_JOB_OPERATIONS = int(os.getenv("TAGTOPPERS_BATCH_JOB_MAX_OPERATIONS", "1000000"))
+UPLOAD_CHUNK = int(os.getenv("TAGTOPPERS_BATCH_UPLOAD_CHUNK", "5000"))
+POLL_INTERVAL = float(os.getenv("TAGTOPPERS_BATCH_POLL_INTERVAL", "15"))
+TIMEOUT = float(os.getenv("TAGTOPPERS_BATCH_TIMEOUT", str(6 * 3600)))
+RESULTS_PAGE_SIZE = 1000
+_MAX_POLL_INTERVAL = 300.0
+
+
+def temp_resource_name(customer_id, collection) -> str:
+    """Resource name with a fresh temporary ID, e.g. ``customers/1/campaigns/-7``."""
+    return f"customers/{customer_id}/{collection}/{next_temp_id()}"
+
+
+class _Unit:
+    """Operations of one journal unit (a label ad group, the tag_toppers step of a shop)."""
+
+    __slots__ = ("key", "name", "done", "start", "end", "item_ids", "optional", "errors", "_plan", "context")
+
+    def __init__(self, plan, key, name, done):
+        self._plan = plan
+        self.key = key
+        self.name = name
+        self.done = done
+        self.start = self.end = len(plan.operations)
+        self.item_ids = {}  # plan operation index -> Item ID
+        self.optional = set()  # plan operation indexes whose rejection is only logged
+        self.errors = []
+        self.context = current_context()
+
+    def add(self, field, operations, item_ids=None, optional=False):
+        """
+        Appends ``operations`` as MutateOperations with ``field`` set (e.g.
+        'ad_group_criterion_operation'). ``item_ids`` maps positions in
+        ``operations`` to Item IDs; rejections of those only go to the report.
+        Rejected ``optional`` operations (location, label, negative keywords)
+        are logged without failing the unit, like in the synchronous path.
+        Returns the position of the first added operation in the unit's results.
+        """
+        first = len(self._plan.operations)
+        self._plan.extend(field, operations)
+        for position, item_id in (item_ids or {}).items():
+            self.item_ids[first + position] = item_id
+        self.end = len(self._plan.operations)
+        if optional:
+            self.optional.update(range(first, self.end))
+        return first - self.start
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class BatchPlan:
+    """
+    Operations of one account for a BatchJob, in execution order, with the
+    unit each belongs to. Without a client the operations are kept as
+    (field, operation) pairs, as ``LocalBatchJobService`` expects.
+    """
+
+    def __init__(self, customer_id, client=None):
+        self.customer_id = str(customer_id)
+        self._client = client
+        self.operations = []
+        self.units = []
+
+    def unit(self, key, name, done=None):
+        unit = _Unit(self, key, name, done)
+        self.units.append(unit)
+        return unit
+
+    def extend(self, field, operations):
+        if self._client is None:
+            self.operations.extend((field, operation) for operation in operations)
+            return
+        self.operations.extend(proto_fast.mutate_operation(self._client, field, operation)
+                               for operation in operations)
+
+    def discard(self, key):
+        """Drops the units of row ``key`` that are still at the end of the plan (compile failed halfway)."""
+        while self.units and self.units[-1].key == key:
+            unit = self.units.pop()
+            del self.operations[unit.start:]
+
+    def jobs(self, max_operations=None):
+        """Splits the units into jobs of at most ``max_operations``, never splitting a row."""
+        max_operations = max_operations or MAX_JOB_OPERATIONS
+        rows = []
+        for unit in self.units:
+            if not len(unit):
+                continue
+            if rows and rows[-1][0] == unit.key:
+                rows[-1][1].append(unit)
+            else:
+                rows.append((unit.key, [unit]))
+
+        jobs, current, size = [], [], 0
+        for _, units in rows:
+            row_size = sum(len(unit) for unit in units)
+            if current and size + row_size > max_operations:
+                jobs.append(current)
+                current, size = [], 0
+            current.extend(units)
+            size += row_size
+        if current:
+            jobs.append(current)
+        return jobs
+
+
+class _Job:
+    def __init__(self, plan, units):
+        self.plan = plan
+        self.units = units
+        self.starts = [unit.start for unit in units]
+        self.first = units[0].start
+        self.operations = plan.operations[units[0].start:units[-1].end]
+        self.resource_name = None
+        self.lro = None
+        self.finished = False
+
+    def unit_of(self, plan_index):
+        return self.units[bisect.bisect_right(self.starts, plan_index) - 1]
+
+
+def _create_and_upload(service, job):
+    operation = service.batch_job_operation()
+    response = service.mutate_batch_job(customer_id=job.plan.customer_id, operation=operation)
+    job.resource_name = response.result.resource_name
+
+    sequence_token = None
+    for offset in range(0, len(job.operations), UPLOAD_CHUNK):
+        chunk = job.operations[offset:offset + UPLOAD_CHUNK]
+        with accounting.call("BatchJobService.add_batch_job_operations") as call:
+            call.operations = len(chunk)
+            response = service.add_batch_job_operations(
+                resource_name=job.resource_name,
+                sequence_token=sequence_token,
+                mutate_operations=chunk,
+            )
+        sequence_token = response.next_sequence_token
+    log.info(f"📦 Batch job {job.resource_name}: {len(job.operations)} operatie(s) geüpload "
+             f"({len(job.units)} unit(s))")
+    job.lro = service.run_batch_job(resource_name=job.resource_name)
+
+
+def _wait(jobs, clock=time.monotonic, sleep=tracing.sleep):
+    deadline = clock() + TIMEOUT
+    interval = POLL_INTERVAL
+    while True:
+        for job in jobs:
+            if not job.finished:
+                job.finished = job.lro.done()
+        waiting = sum(1 for job in jobs if not job.finished)
+        if not waiting:
+            return True
+        if clock() >= deadline:
+            log.error(f"❌ {waiting} batch job(s) na {TIMEOUT:.0f}s nog niet klaar; hun rijen blijven open")
+            return False
+        log.info(f"⏳ {waiting}/{len(jobs)} batch job(s) bezig, volgende controle over {interval:.0f}s")
+        sleep(interval)
+        interval = min(_MAX_POLL_INTERVAL, interval * 2)
+
+
+def _error_code(service, status) -> str:
+    codes = service.error_codes(status)
+    return codes[0] if codes else f"status.{status.code}"
+
+
+def _read_results(service, job):
+    applied = 0
+    rejected = []
+    for result in service.list_batch_job_results(resource_name=job.resource_name, page_size=RESULTS_PAGE_SIZE):
+        plan_index = job.first + result.operation_index
+        unit = job.unit_of(plan_index)
+        status = result.status
+        if status is not None and status.code:
+            failure = {
+                **unit.context,
+                "customer_id": job.plan.customer_id,
+                "item_id": unit.item_ids.get(plan_index),
+                "error_code": _error_code(service, status),
+                "message": status.message,
+            }
+            if failure["item_id"] is not None:
+                rejected.append(failure)
+            elif plan_index in unit.optional:
+                log.warning(f"⚠️ {unit.name}: operatie afgewezen ({failure['error_code']}): {status.message}")
+            else:
+                unit.errors.append(failure)
+            continue
+        applied += 1
+        service.record_result(unit, plan_index, result)
+    run_report.add(rejected, applied)
+    if rejected:
+        log.warning(f"⚠️ {len(rejected)} Item ID(s) afgewezen in {job.resource_name} (zie partial failure report)")
+
+
+def submit(service, plans, max_operations=None, clock=time.monotonic, sleep=tracing.sleep):
+    """
+    Runs ``plans`` as BatchJobs through ``service`` (``BatchJobs`` or
+    ``LocalBatchJobService``) and maps the results back to the rows.
+
+    Returns:
+        {row key: True if every unit of the row succeeded, else False}
+    """
+    jobs = [_Job(plan, units) for plan in plans for units in plan.jobs(max_operations)]
+    outcome = {unit.key: True for plan in plans for unit in plan.units}
+    # Units with nothing to send are done as they are
+    for plan in plans:
+        for unit in plan.units:
+            if not len(unit) and unit.done is not None:
+                unit.done([])
+    if not jobs:
+        return outcome
+
+    with tracing.span("batch_upload", jobs=len(jobs)):
+        for job in jobs:
+            _create_and_upload(service, job)
+    with tracing.span("batch_wait", jobs=len(jobs)):
+        _wait(jobs, clock=clock, sleep=sleep)
+
+    for job in jobs:
+        if not job.finished:
+            for unit in job.units:
+                outcome[unit.key] = False
+            continue
+        with tracing.span("batch_results", job=job.resource_name, operations=len(job.operations)):
+            _read_results(service, job)
+        for unit in job.units:
+            if unit.errors:
+                codes = sorted({failure["error_code"] for failure in unit.errors})
+                log.error(f"❌ {unit.name}: {len(unit.errors)} operatie(s) afgewezen in batch job: {', '.join(codes)}")
+                outcome[unit.key] = False
+            elif unit.done is not None:
+                unit.done(service.results_of(unit))
+    return outcome
+
+
+class BatchJobs:
+    """BatchJobService of a Google Ads client, with the helpers ``submit`` needs."""
+
+    def __init__(self, client):
+        self._client = client
+        self._service = client.get_service("BatchJobService")
+        self._results = {}  # plan operation index -> resource name
+
+    def batch_job_operation(self):
+        operation = self._client.get_type("BatchJobOperation")
+        self._client.copy_from(operation.create, self._client.get_type("BatchJob"))
+        return operation
+
+    def mutate_batch_job(self, **kwargs):
+        return self._service.mutate_batch_job(**kwargs)
+
+    def add_batch_job_operations(self, **kwargs):
+        return self._service.add_batch_job_operations(**kwargs)
+
+    def run_batch_job(self, **kwargs):
+        return self._service.run_batch_job(**kwargs)
+
+    def list_batch_job_results(self, **kwargs):
+        return self._service.list_batch_job_results(**kwargs)
+
+    def error_codes(self, status):
+        """Google Ads error codes in a result status (``GoogleAdsFailure`` details)."""
+        failure_type = type(self._client.get_type("GoogleAdsFailure"))
+        codes = []
+        for detail in status.details:
+            for error in failure_type.deserialize(detail.value).errors:
+                error_code = proto_fast.raw(error.error_code)
+                which = error_code.WhichOneof("error_code")
+                if which:
+                    codes.append(f"{which}.{proto_fast.enum_name(error_code, which)}")
+        return codes
+
+    def record_result(self, unit, plan_index, result):
+        response = proto_fast.raw(result.mutate_operation_response)
+        which = response.WhichOneof("response")
+        self._results[plan_index] = getattr(response, which).resource_name if which else ""
+
+    def results_of(self, unit):
+        return [self._results.pop(index, "") for index in range(unit.start, unit.end)]
+
+
+class _Result:
+    __slots__ = ("resource_name",)
+
+    def __init__(self, resource_name):
+        self.resource_name = resource_name
+
+
+class _LocalOperation:
+    def __init__(self, polls):
+        self._polls = polls
+
+    def done(self):
+        self._polls -= 1
+        return self._polls < 0
+
+
+class _Status:
+    __slots__ = ("code", "message", "details")
+
+    def __init__(self, code=0, message="", details=()):
+        self.code = code
+        self.message = message
+        self.details = list(details)
+
+
+class _JobResult:
+    __slots__ = ("operation_index", "status", "mutate_operation_response")
+
+    def __init__(self, operation_index, status, response):
+        self.operation_index = operation_index
+        self.status = status
+        self.mutate_operation_response = response
+
+
+class LocalBatchJobService:
+    """
+    In-process stand-in for ``BatchJobs``: keeps the uploaded (field, operation)
+    pairs, checks sequence tokens, finishes a job after ``polls`` polls and
+    returns one result per operation. ``reject(field, operation)`` returns an
+    error code to reject an operation with; an operation's resource name is
+    ``resource_name(field, operation)`` (default: derived from the job).
+    """
+
+    def __init__(self, polls=1, reject=None, resource_name=None):
+        self.polls = polls
+        self.reject = reject or (lambda field, operation: None)
+        self.resource_name = resource_name
+        self.jobs = {}
+        self.uploads = []  # (job resource name, chunk size)
+        self._results = {}
+
+    def batch_job_operation(self):
+        return None
+
+    def mutate_batch_job(self, customer_id, operation):
+        resource_name = f"customers/{customer_id}/batchJobs/{len(self.jobs) + 1}"
+        self.jobs[resource_name] = {"operations": [], "token": None, "state": "PENDING"}
+        return _JobResponse(_Result(resource_name))
+
+    def add_batch_job_operations(self, resource_name, sequence_token, mutate_operations):
+        job = self.jobs[resource_name]
+        if sequence_token != job["token"]:
+            raise ValueError(f"sequence token {sequence_token!r}, expected {job['token']!r}")
+        if job["state"] != "PENDING":
+            raise ValueError(f"{resource_name} is already {job['state']}")
+        job["operations"].extend(mutate_operations)
+        job["token"] = f"{resource_name}:{len(job['operations'])}"
+        self.uploads.append((resource_name, len(mutate_operations)))
+        return _TokenResponse(job["token"])
+
+    def run_batch_job(self, resource_name):
+        self.jobs[resource_name]["state"] = "RUNNING"
+        return _LocalOperation(self.polls)
+
+    def list_batch_job_results(self, resource_name, page_size=RESULTS_PAGE_SIZE):
+        for index, (field, operation) in enumerate(self.jobs[resource_name]["operations"]):
+            error_code = self.reject(field, operation)
+            if error_code:
+                yield _JobResult(index, _Status(3, error_code, [error_code]), None)
+                continue
+            name = (self.resource_name(field, operation) if self.resource_name
+                    else f"{resource_name}/results/{index}")
+            yield _JobResult(index, _Status(), _Result(name))
+
+    def error_codes(self, status):
+        return list(status.details)
+
+    def record_result(self, unit, plan_index, result):
+        self._results[plan_index] = result.mutate_operation_response.resource_name
+
+    def results_of(self, unit):
+        return [self._results.pop(index, "") for index in range(unit.start, unit.end)]
+
+
+class _JobResponse:
+    __slots__ = ("result",)
+
+    def __init__(self, result):
+        self.result = result
+
+
+class _TokenResponse:
+    __slots__ = ("next_sequence_token",)
+
+    def __init__(self, token):
+        self.next_sequence_token = token
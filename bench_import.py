@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark: import time of GSD_tagtoppers (and the other entry modules).
+
+Each import runs in a fresh interpreter, so nothing is cached between
+samples. Reports the median wall time per module, whether any Google client
+library was imported (it shouldn't be: clients are created lazily, see
+clients.py), and the slowest imports from ``python -X importtime``.
+
+Usage:
+    python bench_import.py [samples]
+"""
+
+import statistics
+import subprocess
+import sys
+
+MODULES = ["GSD_tagtoppers", "listing_tree"]
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+heavy = sorted(m for m in sys.modules if m.startswith(("google.ads", "googleapiclient", "grpc", "google.auth")))
+print(f"{{elapsed:.3f}}|{{','.join(heavy)}}")
+"""
+
+
+def measure(module):
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    elapsed, heavy = output.split("|", 1)
+    return float(elapsed), [m for m in heavy.split(",") if m]
+
+
+def slowest_imports(module, limit=10):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for module in MODULES:
+        timings = []
+        heavy = []
+        for _ in range(samples):
+            elapsed, heavy = measure(module)
+            timings.append(elapsed)
+        print(f"{module}: median {statistics.median(timings):.1f} ms "
+              f"(min {min(timings):.1f}, max {max(timings):.1f}, {samples} samples)")
+        print(f"   Google client libraries imported: {', '.join(heavy) if heavy else 'none'}")
+
+    print(f"\nSlowest imports of {MODULES[0]} (cumulative):")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative_us, self_us, name in slowest_imports(MODULES[0]):
+        print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
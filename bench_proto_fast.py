@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark: proto-plus vs raw-protobuf fast path (proto_fast.py).
+
+Measures CPU time and peak Python memory for
+  1. building 10k Item-ID exclusion operations (the hot loop of
+     _add_item_id_exclusions_to_subdivision / rebuild_tree_with_specific_item_ids),
+     proto-plus per-item construction vs the raw-protobuf operation factory
+  2. reading 10k listing-group search rows the way the tree reader does
+
+No network access is needed: the client uses anonymous credentials and the
+search rows are constructed locally.
+
+Usage:
+    python bench_proto_fast.py [n_operations]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from google.auth.credentials import AnonymousCredentials
+from google.ads.googleads.client import GoogleAdsClient
+
+import proto_fast
+from operation_factory import ListingGroupOperationFactory, next_temp_id
+
+CUSTOMER_ID = "1234567890"
+AD_GROUP_ID = "987654321"
+PARENT = f"customers/{CUSTOMER_ID}/adGroupCriteria/{AD_GROUP_ID}~111"
+
+
+def measure(fn):
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    result = fn()
+    cpu = time.process_time() - cpu_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak, result
+
+
+def build_operations_proto_plus(client, n):
+    """Per-item proto-plus construction, as the builders did before the factory."""
+    ops = []
+    for i in range(n):
+        dim_item = client.get_type("ListingDimensionInfo")
+        dim_item.product_item_id.value = f"ITEM_{i}"
+
+        operation = client.get_type("AdGroupCriterionOperation")
+        criterion = operation.create
+        criterion.resource_name = client.get_service(
+            "AdGroupCriterionService"
+        ).ad_group_criterion_path(CUSTOMER_ID, AD_GROUP_ID, str(next_temp_id()))
+        criterion.status = client.enums.AdGroupCriterionStatusEnum.ENABLED
+        listing_group = criterion.listing_group
+        listing_group.type_ = client.enums.ListingGroupTypeEnum.UNIT
+        listing_group.parent_ad_group_criterion = PARENT
+        client.copy_from(listing_group.case_value, dim_item)
+        criterion.negative = True
+        ops.append(operation)
+    return ops
+
+
+def build_operations_raw(client, n):
+    factory = ListingGroupOperationFactory.for_ad_group(client, CUSTOMER_ID, AD_GROUP_ID)
+    return factory.item_id_exclusions(PARENT, (f"ITEM_{i}" for i in range(n)))
+
+
+def make_search_rows(client, n):
+    """Raw GoogleAdsRow messages shaped like the tree reader's query results."""
+    row_cls = type(proto_fast.raw(client.get_type("GoogleAdsRow")))
+    unit = int(client.enums.ListingGroupTypeEnum.UNIT)
+    rows = []
+    for i in range(n):
+        row = row_cls()
+        criterion = row.ad_group_criterion
+        criterion.resource_name = f"customers/{CUSTOMER_ID}/adGroupCriteria/{AD_GROUP_ID}~{i + 1000}"
+        criterion.negative = True
+        criterion.listing_group.type = unit
+        criterion.listing_group.parent_ad_group_criterion = PARENT
+        criterion.listing_group.case_value.product_item_id.value = f"ITEM_{i}"
+        rows.append(row)
+    return rows
+
+
+def read_rows(rows, wrap):
+    """Field accesses of the tree_map loop in rebuild_tree_with_label_and_item_ids."""
+    nodes = {}
+    for row in proto_fast.rows(wrap(r) for r in rows):
+        criterion = row.ad_group_criterion
+        lg = criterion.listing_group
+        if proto_fast.RAW_PROTO:
+            node_type = proto_fast.listing_group_type_name(lg)
+            case_value = lg.case_value if proto_fast.has_content(lg.case_value) else None
+        else:
+            node_type = lg.type_.name
+            case_value = lg.case_value
+        dim = proto_fast.dimension_of(case_value) if case_value else None
+        nodes[criterion.resource_name] = (node_type, lg.parent_ad_group_criterion, dim,
+                                          case_value.product_item_id.value if dim else None,
+                                          criterion.negative)
+    return nodes
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    client = GoogleAdsClient(
+        credentials=AnonymousCredentials(),
+        developer_token="bench",
+        use_proto_plus=True,
+    )
+    row_wrapper = type(client.get_type("GoogleAdsRow"))
+    search_rows = make_search_rows(client, n)
+
+    # Warm up type/service caches so both modes are measured hot
+    build_operations_proto_plus(client, 10)
+    build_operations_raw(client, 10)
+
+    results = {}
+    for label, raw_mode, build in (("proto-plus", False, build_operations_proto_plus),
+                                   ("raw protobuf", True, build_operations_raw)):
+        proto_fast.set_raw_proto(raw_mode)
+        results[label] = {
+            "build": measure(lambda: build(client, n))[:2],
+            "read": measure(lambda: read_rows(search_rows, row_wrapper.wrap))[:2],
+        }
+
+    print(f"Operations / rows: {n}")
+    print(f"{'mode':<14}{'build CPU (s)':>15}{'build peak (MB)':>17}{'read CPU (s)':>14}{'read peak (MB)':>16}")
+    for label, r in results.items():
+        (b_cpu, b_mem), (r_cpu, r_mem) = r["build"], r["read"]
+        print(f"{label:<14}{b_cpu:>15.3f}{b_mem / 1e6:>17.1f}{r_cpu:>14.3f}{r_mem / 1e6:>16.1f}")
+
+    base, fast = results["proto-plus"], results["raw protobuf"]
+    per_10k = 10_000 / n
+    print(f"\nSaved per 10k operations: "
+          f"{(base['build'][0] - fast['build'][0]) * per_10k:.3f}s CPU, "
+          f"{(base['build'][1] - fast['build'][1]) * per_10k / 1e6:.1f} MB peak")
+    print(f"Saved per 10k rows read: "
+          f"{(base['read'][0] - fast['read'][0]) * per_10k:.3f}s CPU, "
+          f"{(base['read'][1] - fast['read'][1]) * per_10k / 1e6:.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-call gRPC overhead, new channel per call vs shared channel.
+
+Starts a local gRPC stand-in server with a Search and a Mutate method (echo,
+bytes in/bytes out) and measures the median wall time per call for
+
+  1. new channel + stub per call   (what get_service() per call amounts to)
+  2. shared channel                (transport.registered_client)
+  3. shared channel, tuned         (channel_options() + tuning_interceptor():
+                                    gzip compression and per-call deadlines)
+
+with a small search-sized request and a mutate-sized request of N
+operations. On localhost compression only costs CPU; against the real API it
+saves upload bytes for large mutates, so compare case 3 with case 2 on the
+large payload to see its CPU price.
+
+Usage:
+    python bench_transport.py [calls] [mutate_operations]
+"""
+
+import statistics
+import sys
+import time
+from concurrent import futures
+
+import grpc
+
+import transport
+
+SEARCH_METHOD = "/google.ads.googleads.v0.services.GoogleAdsService/Search"
+MUTATE_METHOD = "/google.ads.googleads.v0.services.AdGroupCriterionService/MutateAdGroupCriteria"
+# Roughly the serialized size of one Item-ID listing-group operation
+OPERATION_BYTES = b"customers/1234567890/adGroupCriteria/987654321~-1234|ITEM_ID|sku-000123|" * 2
+
+
+def _echo(request, context):
+    return request
+
+
+def start_server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), options=transport.channel_options())
+    server.add_generic_rpc_handlers([
+        grpc.method_handlers_generic_handler("google.ads.googleads.v0.services.GoogleAdsService", {
+            "Search": grpc.unary_unary_rpc_method_handler(_echo),
+        }),
+        grpc.method_handlers_generic_handler("google.ads.googleads.v0.services.AdGroupCriterionService", {
+            "MutateAdGroupCriteria": grpc.unary_unary_rpc_method_handler(_echo),
+        }),
+    ])
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"127.0.0.1:{port}"
+
+
+def timed(calls, fn):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    server, address = start_server()
+    search_request = b"SELECT ad_group_criterion.resource_name FROM ad_group_criterion" * 3
+    mutate_request = OPERATION_BYTES * operations
+
+    def new_channel_call(method, request):
+        def call():
+            with grpc.insecure_channel(address) as channel:
+                channel.unary_unary(method)(request, timeout=30)
+        return call
+
+    shared = grpc.insecure_channel(address)
+    tuned = grpc.intercept_channel(
+        grpc.insecure_channel(address, options=transport.channel_options()), transport.tuning_interceptor()
+    )
+
+    def shared_call(channel, method, request):
+        stub = channel.unary_unary(method)
+        return lambda: stub(request)
+
+    print(f"{calls} calls per case; mutate payload {len(mutate_request) / 1024:.0f} KiB ({operations} ops)")
+    print(f"{'case':<36}{'search µs':>12}{'mutate µs':>12}")
+    for label, make in (
+        ("new channel per call", new_channel_call),
+        ("shared channel", lambda m, r: shared_call(shared, m, r)),
+        ("shared channel, tuned (gzip)", lambda m, r: shared_call(tuned, m, r)),
+    ):
+        search = timed(calls, make(SEARCH_METHOD, search_request))
+        mutate = timed(max(1, calls // 10), make(MUTATE_METHOD, mutate_request))
+        print(f"{label:<36}{search:>12.0f}{mutate:>12.0f}")
+
+    shared.close()
+    tuned.close()
+    server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Crash-safe checkpoint journal for long runs.
+
+Every completed unit of work is appended to a JSON-lines journal and fsynced
+before the next unit starts:
+
+    run_started   - new run (run_id)
+    ad_group_done - label ad group tree rebuilt (row, shop, ad group, ops)
+    tag_toppers_done - tag_toppers campaign/tree/ad/negatives done for a row
+    row_done      - sheet row finished (success flag)
+    rows_marked   - rows written back as processed in the sheet
+    run_finished  - end of run
+
+``ops`` is the number of operations the API acknowledged for the unit
+(results with a resource name in mutate responses), counted by the
+``acknowledging`` client wrapper.
+
+With ``--resume`` the last unfinished run is loaded: completed rows are not
+processed again (only marked in the sheet if that didn't happen yet) and
+within a row, completed ad groups and the tag_toppers step are skipped.
+"""
+
+import contextvars
+import json
+import os
+import time
+import uuid
+
+import logs
+
+log = logs.get_logger("checkpoint")
+
+JOURNAL_PATH = os.getenv("TAGTOPPERS_JOURNAL", os.path.join("checkpoints", "journal.jsonl"))
+
+# Operations acknowledged by the API for the unit currently being processed
+_acknowledged = contextvars.ContextVar("acknowledged_operations", default=None)
+
+
+def row_key(row: dict) -> str:
+    """Stable identity of a sheet row across runs."""
+    return f"{row.get('row')}:{row.get('shop_id')}"
+
+
+class RunJournal:
+    """Append-only journal for one run (new or resumed)."""
+
+    def __init__(self, path, run_id, completed=None):
+        self.path = path
+        self.run_id = run_id
+        # {(event, row_key, ad_group_id)} of completed units, from the resumed run
+        self.completed = completed or set()
+        self.finished_rows = {}      # row_key -> row number, rows that completed successfully
+        self.marked_rows = set()     # row numbers already written back to the sheet
+
+    @classmethod
+    def open(cls, path=JOURNAL_PATH, resume=False):
+        """Starts a new run, or continues the last unfinished run when ``resume`` is set."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        if resume:
+            journal = cls._load_unfinished(path)
+            if journal is not None:
+                journal.append("run_resumed")
+                return journal
+            log.info("ℹ️ Geen onafgemaakte run in journal gevonden, nieuwe run gestart.")
+
+        journal = cls(path, run_id=f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}")
+        journal.append("run_started")
+        return journal
+
+    @classmethod
+    def _load_unfinished(cls, path):
+        if not os.path.exists(path):
+            return None
+
+        runs = {}
+        last_run_id = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from a crash mid-write
+                    continue
+                run_id = record.get("run_id")
+                if record.get("event") == "run_started":
+                    last_run_id = run_id
+                runs.setdefault(run_id, []).append(record)
+
+        if last_run_id is None:
+            return None
+        records = runs[last_run_id]
+        if any(r["event"] == "run_finished" for r in records):
+            return None
+
+        journal = cls(path, last_run_id)
+        for r in records:
+            event = r["event"]
+            if event in ("ad_group_done", "tag_toppers_done"):
+                journal.completed.add((event, r.get("row_key"), r.get("ad_group_id")))
+            elif event == "row_done" and r.get("success"):
+                journal.finished_rows[r["row_key"]] = r.get("row")
+            elif event == "rows_marked":
+                journal.marked_rows.update(r.get("rows", []))
+
+        log.info(f"🔁 Hervatten van run {last_run_id}: {len(journal.finished_rows)} rij(en) klaar, "
+                 f"{sum(1 for c in journal.completed if c[0] == 'ad_group_done')} ad group(s) klaar")
+        return journal
+
+    def append(self, event, **fields):
+        record = {"ts": time.time(), "run_id": self.run_id, "event": event, **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---- unit bookkeeping ----
+
+    def is_done(self, event, key, ad_group_id=None) -> bool:
+        return (event, key, str(ad_group_id) if ad_group_id is not None else None) in self.completed
+
+    def unit_done(self, event, key, ad_group_id=None, **fields):
+        ad_group_id = str(ad_group_id) if ad_group_id is not None else None
+        self.completed.add((event, key, ad_group_id))
+        self.append(event, row_key=key, ad_group_id=ad_group_id, ops=take_acknowledged(), **fields)
+
+    def row_finished(self, row: dict, success: bool):
+        key = row_key(row)
+        if success:
+            self.finished_rows[key] = row.get("row")
+        self.append("row_done", row_key=key, row=row.get("row"), shop_id=row.get("shop_id"), success=success)
+
+    def rows_marked(self, rows):
+        self.marked_rows.update(rows)
+        self.append("rows_marked", rows=list(rows))
+
+    def finish(self):
+        self.append("run_finished")
+
+
+# ---- acknowledged operations ----
+
+def start_unit():
+    """Resets the acknowledged-operation counter for the unit about to run."""
+    _acknowledged.set([0])
+
+
+def take_acknowledged() -> int:
+    counter = _acknowledged.get()
+    count = counter[0] if counter else 0
+    _acknowledged.set([0])
+    return count
+
+
+def _count_acknowledged(response):
+    counter = _acknowledged.get()
+    if counter is None:
+        return
+    results = getattr(response, "results", None) or []
+    counter[0] += sum(1 for r in results if getattr(r, "resource_name", ""))
+
+
+class _AcknowledgingService:
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not name.startswith("mutate_"):
+            return attr
+
+        def mutate(*args, **kwargs):
+            response = attr(*args, **kwargs)
+            _count_acknowledged(response)
+            return response
+        return mutate
+
+
+class _AcknowledgingClient:
+    def __init__(self, client):
+        self._client = client
+
+    def get_service(self, *args, **kwargs):
+        return _AcknowledgingService(self._client.get_service(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def acknowledging(client):
+    """Wraps a GoogleAdsClient so every mutate_* response is counted for the journal."""
+    return _AcknowledgingClient(client)
@@ -0,0 +1,246 @@
+"""
+Lazily constructed API clients for the tag-toppers scripts.
+
+Importing ``GSD_tagtoppers`` used to build a ``GoogleAdsClient`` and refresh
+an OAuth token over the network at module level. All clients are now created
+on first use by the factories below (thread-safe, one instance per process):
+
+    get_ads_client()            - GoogleAdsClient (proto-plus)
+    get_sheets_service(write)   - Sheets v4 service (read-only or read-write)
+    get_redshift_connection()   - psycopg2 connection to Redshift (reopened
+                                  after ``reset_redshift_connection()``)
+    google_ads_exception()      - GoogleAdsException class, for ``except``
+
+The heavy Google libraries are imported inside the factories, so importing a
+module that only needs helpers costs milliseconds (see ``bench_import.py``).
+
+The OAuth access token is cached on disk (``TAGTOPPERS_TOKEN_CACHE``, default
+``cache/oauth_token.json``) and reused until shortly before it expires, so
+most runs start without a token refresh. ``warm_up()`` builds the Ads client
+(and refreshes the token if needed) on a background thread, so the refresh
+overlaps with the sheet read.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import logs
+
+log = logs.get_logger("clients")
+
+# =========================
+# OAuth / Config
+# =========================
+
+refresh_token = os.getenv("GOOGLE_REFRESH_TOKEN", "your-refresh-token-here")
+developer_token = os.getenv("GOOGLE_DEVELOPER_TOKEN", "your-developer-token-here")
+login_customer_id = os.getenv("GOOGLE_LOGIN_CUSTOMER_ID", "your-login-customer-id")
+
+# Service account voor Google Sheets / Merchant Center
+# Auto-detect Windows vs WSL path
+if os.name == 'nt':  # Windows
+    SERVICE_ACCOUNT_FILE = r'C:\Users\JoepvanSchagen\Downloads\Python\gsd-campaign-creation.json'
+else:  # WSL/Linux
+    SERVICE_ACCOUNT_FILE = '/mnt/c/Users/JoepvanSchagen/Downloads/Python/gsd-campaign-creation.json'
+
+# Redshift (branded lookup)
+REDSHIFT = {
+    "dbname": os.getenv("REDSHIFT_DBNAME", "beslistbi"),
+    "user": os.getenv("REDSHIFT_USER", "j_vanschagen"),
+    "password": os.getenv("REDSHIFT_PASSWORD", "asjWQ@dmasm(asdm23"),
+    "host": os.getenv("REDSHIFT_HOST", "production-redshiftstack-127n6djd-beslistredshift-zjsoh9hkk262.ccr4dsiux3yc.eu-central-1.redshift.amazonaws.com"),
+    "port": os.getenv("REDSHIFT_PORT", "5439"),
+}
+
+TOKEN_CACHE = os.getenv("TAGTOPPERS_TOKEN_CACHE", os.path.join("cache", "oauth_token.json"))
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+# Refresh a cached token when it expires within this margin
+_EXPIRY_MARGIN = datetime.timedelta(minutes=5)
+
+# Separate locks, so the Sheets service can be built while the Ads client warms up
+_ads_lock = threading.Lock()
+_sheets_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_redshift_lock = threading.Lock()
+_ads_client = None
+_sheets_services = {}
+_redshift_connection = None
+_warm_up_thread = None
+
+
+def load_google_oauth_from_env():
+    # First try environment variables
+    cid = os.getenv("GOOGLE_CLIENT_ID")
+    cs  = os.getenv("GOOGLE_CLIENT_SECRET")
+
+    # If not found, try loading from creds file
+    if not cid or not cs:
+        creds_file = os.path.join(os.path.dirname(__file__), 'creds')
+        if os.path.exists(creds_file):
+            with open(creds_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('GOOGLE_CLIENT_ID='):
+                        cid = line.split('=', 1)[1]
+                    elif line.startswith('GOOGLE_CLIENT_SECRET='):
+                        cs = line.split('=', 1)[1]
+
+    missing = []
+    if not cid: missing.append("GOOGLE_CLIENT_ID")
+    if not cs:  missing.append("GOOGLE_CLIENT_SECRET")
+    if missing:
+        raise RuntimeError(
+            "Environment variables ontbreken: "
+            + ", ".join(missing)
+            + ".\nZet deze in het 'creds' bestand of als environment variables."
+        )
+    return cid, cs
+
+
+def google_ads_exception():
+    """GoogleAdsException, imported on first use: ``except google_ads_exception() as ex:``."""
+    from google.ads.googleads.errors import GoogleAdsException
+    return GoogleAdsException
+
+
+# ---- OAuth token cache ----
+
+def _token_owner(client_id) -> str:
+    # The cache belongs to one client/refresh-token pair; never store the refresh token itself
+    return hashlib.sha256(f"{client_id}:{refresh_token}".encode("utf-8")).hexdigest()
+
+
+def _load_cached_token(client_id):
+    try:
+        with open(TOKEN_CACHE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if cached.get("owner") != _token_owner(client_id):
+        return None, None
+    expiry = datetime.datetime.fromisoformat(cached["expiry"])
+    if expiry - _EXPIRY_MARGIN <= datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None):
+        return None, None
+    return cached["token"], expiry
+
+
+def _save_token(client_id, credentials):
+    if not credentials.token or not credentials.expiry:
+        return
+    os.makedirs(os.path.dirname(TOKEN_CACHE) or ".", exist_ok=True)
+    tmp_path = f"{TOKEN_CACHE}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({
+            "owner": _token_owner(client_id),
+            "token": credentials.token,
+            # google-auth uses naive UTC datetimes
+            "expiry": credentials.expiry.isoformat(),
+        }, f)
+    os.replace(tmp_path, TOKEN_CACHE)
+
+
+def oauth_credentials():
+    """
+    User credentials for the Ads API, with the cached access token when it is
+    still valid; otherwise refreshed once and written back to the cache.
+    """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    client_id, client_secret = load_google_oauth_from_env()
+    token, expiry = _load_cached_token(client_id)
+    credentials = Credentials(
+        token=token,
+        refresh_token=refresh_token,
+        token_uri=TOKEN_URI,
+        client_id=client_id,
+        client_secret=client_secret,
+        expiry=expiry,
+    )
+    if token:
+        log.info("✅ Access token uit cache")
+    else:
+        credentials.refresh(Request())
+        _save_token(client_id, credentials)
+        log.info(f"✅ Access token: {(credentials.token or '')[:20]} ...")
+    return credentials
+
+
+# ---- factories ----
+
+def get_ads_client():
+    """The process-wide GoogleAdsClient, created on first use."""
+    global _ads_client
+    with _ads_lock:
+        if _ads_client is None:
+            from google.ads.googleads.client import GoogleAdsClient
+
+            # Google Ads client (OAuth via cached access token + refresh token)
+            _ads_client = GoogleAdsClient(
+                credentials=oauth_credentials(),
+                developer_token=developer_token,
+                login_customer_id=login_customer_id,
+                use_proto_plus=True,
+            )
+        return _ads_client
+
+
+def get_sheets_service(write=False):
+    """Sheets v4 service with the service account (read-only unless ``write``)."""
+    with _sheets_lock:
+        service = _sheets_services.get(write)
+        if service is None:
+            from google.oauth2 import service_account
+            from googleapiclient.discovery import build
+
+            scopes = ["https://www.googleapis.com/auth/spreadsheets" if write
+                      else "https://www.googleapis.com/auth/spreadsheets.readonly"]
+            creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scopes)
+            service = build("sheets", "v4", credentials=creds)
+            _sheets_services[write] = service
+        return service
+
+
+def get_redshift_connection():
+    """The process-wide Redshift connection, (re)opened when missing or closed."""
+    global _redshift_connection
+    with _redshift_lock:
+        if _redshift_connection is None or _redshift_connection.closed:
+            import psycopg2
+
+            _redshift_connection = psycopg2.connect(**REDSHIFT)
+        return _redshift_connection
+
+
+def reset_redshift_connection():
+    """Closes the Redshift connection after an error; the next call reconnects."""
+    global _redshift_connection
+    with _redshift_lock:
+        if _redshift_connection is not None:
+            try:
+                _redshift_connection.close()
+            except Exception:
+                pass
+        _redshift_connection = None
+
+
+def warm_up():
+    """Builds the Ads client on a background thread (token refresh overlaps the sheet read)."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _ads_client is not None or _warm_up_thread is not None:
+            return
+
+        def build():
+            try:
+                get_ads_client()
+            except Exception as e:
+                # The main thread builds it again and raises there
+                log.warning(f"⚠️ Ads client warm-up mislukt: {e}")
+
+        _warm_up_thread = threading.Thread(target=build, name="ads-client-warm-up", daemon=True)
+        _warm_up_thread.start()
@@ -0,0 +1,247 @@
+"""
+Durable work queue for on-demand shop jobs (see ``job_server.py``).
+
+Jobs are rows in a local SQLite database (``TAGTOPPERS_JOB_DB``, default
+``checkpoints/jobs.sqlite3``), so accepted jobs survive a restart:
+
+    queued   - accepted, waiting for a worker
+    running  - claimed by a worker (put back to queued when the server starts)
+    done     - processed without errors
+    failed   - processed with errors, or raised
+
+A worker never claims a job for a shop/domain that another worker is still
+processing, so two jobs for the same shop can't touch its ad groups at the
+same time (CONCURRENT_MODIFICATION). Every job records when it was created,
+started and finished; ``stats()`` reports queue wait and run time
+percentiles over the recent jobs.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import logs
+
+log = logs.get_logger("jobs")
+
+QUEUE_PATH = os.getenv("TAGTOPPERS_JOB_DB", os.path.join("checkpoints", "jobs.sqlite3"))
+# Idle workers check the database at least this often (jobs submitted by another process)
+_IDLE_POLL = 5.0
+_STATS_WINDOW = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    shop_id     TEXT NOT NULL,
+    shop_name   TEXT NOT NULL,
+    domain      TEXT NOT NULL,
+    item_ids    TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+class JobQueue:
+    """Thread-safe SQLite job queue; one connection shared by the server and its workers."""
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["item_ids"] = json.loads(job["item_ids"])
+        created, started, finished = job["created_at"], job["started_at"], job["finished_at"]
+        job["queued_s"] = round((started or time.time()) - created, 3)
+        job["run_s"] = round((finished or time.time()) - started, 3) if started else None
+        job["total_s"] = round(finished - created, 3) if finished else None
+        return job
+
+    # ---- producer side ----
+
+    def submit(self, shop_id, shop_name, domain, item_ids) -> dict:
+        """Stores a new job and wakes an idle worker; returns the job."""
+        job_id = uuid.uuid4().hex[:12]
+        with self._available:
+            self._db.execute(
+                "INSERT INTO jobs (id, shop_id, shop_name, domain, item_ids, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, str(shop_id), shop_name, domain, json.dumps([str(i) for i in item_ids]), time.time()),
+            )
+            self._available.notify()
+        log.info(f"📥 Job {job_id}: shop {shop_id} ({shop_name}, {domain}), {len(item_ids)} Item ID(s)")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list(self, status=None, limit=50):
+        """Most recent jobs first, optionally for one status."""
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def stats(self) -> dict:
+        """Job counts per status and latency percentiles of the last finished jobs."""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            finished = self._db.execute(
+                "SELECT created_at, started_at, finished_at FROM jobs "
+                "WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+                (_STATS_WINDOW,),
+            ).fetchall()
+
+        latency = {}
+        for name, values in (
+            ("queued_s", sorted(r["started_at"] - r["created_at"] for r in finished)),
+            ("run_s", sorted(r["finished_at"] - r["started_at"] for r in finished)),
+            ("total_s", sorted(r["finished_at"] - r["created_at"] for r in finished)),
+        ):
+            latency[name] = {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95),
+                             "max": _percentile(values, 1.0)}
+        return {"counts": counts, "latency": latency, "window": len(finished)}
+
+    # ---- worker side ----
+
+    def requeue_running(self) -> int:
+        """Puts jobs left running by a previous server process back in the queue."""
+        with self._available:
+            count = self._db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+            if count:
+                self._available.notify_all()
+        if count:
+            log.info(f"🔁 {count} onafgemaakte job(s) opnieuw in de wachtrij gezet")
+        return count
+
+    def claim(self, timeout=None, stop=None):
+        """
+        Marks the oldest queued job whose shop isn't being processed as running
+        and returns it; waits up to ``timeout`` seconds for one, or until the
+        ``stop`` event is set (None: no job).
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._available:
+            while True:
+                row = self._db.execute(
+                    """
+                    SELECT * FROM jobs AS j
+                    WHERE j.status = 'queued'
+                      AND NOT EXISTS (
+                          SELECT 1 FROM jobs AS r
+                          WHERE r.status = 'running' AND r.shop_id = j.shop_id AND r.domain = j.domain
+                      )
+                    ORDER BY j.created_at
+                    LIMIT 1
+                    """
+                ).fetchone()
+                if row is not None:
+                    started = time.time()
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (started, row["id"]),
+                    )
+                    job = self._to_dict(row)
+                    job.update(status="running", started_at=started, attempts=job["attempts"] + 1,
+                               queued_s=round(started - job["created_at"], 3))
+                    return job
+
+                remaining = deadline - time.monotonic() if deadline else 0
+                if remaining <= 0 or (stop is not None and stop.is_set()):
+                    return None
+                self._available.wait(min(remaining, _IDLE_POLL))
+
+    def finish(self, job_id, success: bool, error=None):
+        with self._available:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                ("done" if success else "failed", error, time.time(), job_id),
+            )
+            # A job for the same shop may be claimable now
+            self._available.notify_all()
+
+
+class WorkerPool:
+    """``workers`` threads that claim jobs and run ``handler(job)`` (truthy = success)."""
+
+    def __init__(self, queue: JobQueue, handler, workers=4):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.queue.requeue_running()
+        self._stop.clear()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Lets running jobs finish, then joins the workers."""
+        self._stop.set()
+        with self.queue._available:
+            self.queue._available.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self.queue.claim(timeout=_IDLE_POLL, stop=self._stop)
+            if job is None:
+                continue
+            log.info(f"▶️ Job {job['id']} gestart na {job['queued_s']:.1f}s in de wachtrij")
+            try:
+                success = bool(self.handler(job))
+                error = None if success else "Eén of meer stappen mislukt (zie log)"
+            except Exception as e:
+                log.exception(f"❌ Job {job['id']} mislukt: {e}")
+                success, error = False, f"{type(e).__name__}: {e}"
+            self.queue.finish(job["id"], success, error)
+            finished = self.queue.get(job["id"])
+            log.info(f"{'✅' if success else '❌'} Job {job['id']} klaar in {finished['total_s']:.1f}s "
+                     f"(wachtrij {finished['queued_s']:.1f}s, verwerking {finished['run_s']:.1f}s)")
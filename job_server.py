@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+HTTP job API for on-demand shop processing.
+
+Account managers can push one shop's Item IDs without waiting for a sheet
+pass. Jobs are stored in the durable queue (``job_queue.py``) and processed
+by a worker pool with the same per-shop logic as the sheet run
+(``GSD_tagtoppers.process_row``: label+Item ID trees in the existing
+campaigns, then the tag_toppers campaign).
+
+Endpoints:
+    POST /jobs             {"shop_id", "shop_name", "domain", "item_ids"} -> 202 + job
+    GET  /jobs/{job_id}    status, error, queued_s / run_s / total_s
+    GET  /jobs?status=     recent jobs
+    GET  /stats            job counts and latency percentiles
+    GET  /health
+
+Every job writes its own rejected-ID report, API accounting, profiles and
+trace (when enabled) to ``reports/jobs/<job_id>/``.
+
+Usage (needs ``fastapi`` and ``uvicorn``, which the sheet run doesn't):
+    python job_server.py [--host 127.0.0.1] [--port 8080] [--workers 4]
+"""
+
+import argparse
+import os
+import threading
+
+import account_state
+import accounting
+import logs
+import partial_failure
+import profiling
+import retry_lane
+import tracing
+import tree_cache
+from checkpoint import RunJournal, row_key
+from job_queue import JobQueue, WorkerPool
+
+log = logs.get_logger("jobs")
+
+JOB_JOURNAL_PATH = os.getenv("TAGTOPPERS_JOB_JOURNAL", os.path.join("checkpoints", "jobs_journal.jsonl"))
+JOB_REPORTS_DIR = os.getenv("TAGTOPPERS_JOB_REPORTS", os.path.join("reports", "jobs"))
+DOMAINS = ("NL", "BE", "DE")
+
+
+class ShopJobHandler:
+    """Runs one job through ``process_row`` with the shared Ads client and journal."""
+
+    def __init__(self, journal_path=JOB_JOURNAL_PATH):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._ads_client = None
+        self._journal = None
+
+    def _setup(self):
+        # GSD_tagtoppers is imported here: the API process starts without the Google libraries
+        import GSD_tagtoppers
+
+        with self._lock:
+            if self._ads_client is None:
+                self._ads_client = GSD_tagtoppers.wrapped_ads_client()
+                self._journal = RunJournal.open(self.journal_path)
+        return GSD_tagtoppers
+
+    def __call__(self, job):
+        gsd = self._setup()
+        row = {
+            # Unique per job, so journal units of an earlier job for the same shop aren't skipped
+            "row": f"job:{job['id']}",
+            "shop_id": job["shop_id"],
+            "shop_name": job["shop_name"],
+            "domain": job["domain"],
+            "item_ids": job["item_ids"],
+        }
+        # Own account state and reports: workers run jobs concurrently, and what this
+        # job created is not assumed to be unchanged for the next one
+        directory = os.path.join(JOB_REPORTS_DIR, str(job["id"]))
+        with account_state.scoped(), partial_failure.scoped(), accounting.scoped(), \
+                profiling.scoped(os.path.join(directory, "profiles")), tracing.scoped():
+            try:
+                # A transient failure is retried after the job's other units (retry_lane.py)
+                deferred = retry_lane.DeferredQueue()
+                success = gsd.process_row(self._ads_client, row, self._journal, deferred)
+                if success == retry_lane.DEFERRED:
+                    deferred.drain()
+                    success = not deferred.failed(row_key(row))
+            finally:
+                gsd.write_run_reports(directory)
+        if success is not None:
+            self._journal.row_finished(row, success)
+        # Store the change_status sync, the next job checks again
+        tree_cache.commit()
+        return success
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.finish()
+
+
+def create_app(queue: JobQueue):
+    """The FastAPI application for ``queue``."""
+    try:
+        from fastapi import FastAPI, HTTPException
+        from pydantic import BaseModel, Field
+    except ImportError as e:
+        raise RuntimeError("De job-API heeft fastapi nodig: pip install fastapi uvicorn") from e
+
+    class JobRequest(BaseModel):
+        shop_id: str
+        shop_name: str
+        domain: str
+        item_ids: list[str] = Field(default_factory=list)
+
+    app = FastAPI(title="GSD tag-toppers jobs")
+
+    @app.post("/jobs", status_code=202)
+    def submit_job(request: JobRequest):
+        domain = request.domain.strip().upper()
+        if domain not in DOMAINS:
+            raise HTTPException(status_code=422, detail=f"Onbekend domein: {request.domain}")
+        if not request.shop_id.strip() or not request.shop_name.strip():
+            raise HTTPException(status_code=422, detail="shop_id en shop_name zijn verplicht")
+        item_ids = list(dict.fromkeys(i.strip() for i in request.item_ids if i.strip()))
+        return queue.submit(request.shop_id.strip(), request.shop_name.strip(), domain, item_ids)
+
+    @app.get("/jobs/{job_id}")
+    def get_job(job_id: str):
+        job = queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} niet gevonden")
+        return job
+
+    @app.get("/jobs")
+    def list_jobs(status: str = None, limit: int = 50):
+        return queue.list(status=status, limit=min(limit, 500))
+
+    @app.get("/stats")
+    def stats():
+        return queue.stats()
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GSD tag-toppers: HTTP job API for single-shop processing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("TAGTOPPERS_JOB_WORKERS", "4")),
+                        help="Jobs processed in parallel (different shops only; default 4)")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    import clients
+
+    queue = JobQueue()
+    handler = ShopJobHandler()
+    pool = WorkerPool(queue, handler, workers=args.workers)
+    clients.warm_up()
+    pool.start()
+    log.info(f"🚀 Job-API op http://{args.host}:{args.port} met {args.workers} worker(s)")
+    try:
+        uvicorn.run(create_app(queue), host=args.host, port=args.port)
+    finally:
+        pool.stop()
+        handler.close()
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Shop leases for sharded runs (``--shard``).
+
+Several worker processes, on one host or on hosts that share the lease
+database, read the same sheet. A worker only processes a row after it has
+claimed the row's lease in a shared SQLite store (``TAGTOPPERS_LEASE_DB``,
+default ``checkpoints/leases.sqlite3``). SQLite here is a local stand-in for
+a distributed lock service. A lease is
+
+    active  - held by ``owner`` until ``expires_at``; the owner heartbeats
+              while it works, so a lease only expires when its worker died
+    done    - row processed; never claimed again
+    failed  - given up after MAX_ATTEMPTS failed attempts
+
+A worker that fails a row releases the lease right away, so another worker can
+take the row over. A crashed worker stops heartbeating, and its leases are
+reassigned once they expire. Claims run in ``BEGIN IMMEDIATE`` transactions,
+so two workers can never both hold the same row.
+"""
+
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import logs
+
+log = logs.get_logger("leases")
+
+LEASE_PATH = os.getenv("TAGTOPPERS_LEASE_DB", os.path.join("checkpoints", "leases.sqlite3"))
+LEASE_TTL = float(os.getenv("TAGTOPPERS_LEASE_TTL", "300"))
+MAX_ATTEMPTS = int(os.getenv("TAGTOPPERS_LEASE_ATTEMPTS", "3"))
+# Finished leases are kept this long, then pruned
+_KEEP_FINISHED_S = 30 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    key         TEXT PRIMARY KEY,
+    owner       TEXT,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    expires_at  REAL NOT NULL DEFAULT 0,
+    updated_at  REAL NOT NULL
+);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseStore:
+    """Leases of one worker (``owner``) in the shared store."""
+
+    def __init__(self, owner=None, path=LEASE_PATH, ttl=LEASE_TTL, max_attempts=MAX_ATTEMPTS):
+        self.owner = owner or default_worker_id()
+        self.path = path
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE status != 'active' AND updated_at < ?",
+                       (time.time() - _KEEP_FINISHED_S,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def claim(self, key) -> bool:
+        """Takes the lease of ``key`` if it is free, expired or already ours."""
+        now = time.time()
+        with self._transaction() as db:
+            lease = db.execute("SELECT * FROM leases WHERE key = ?", (key,)).fetchone()
+            if lease is None:
+                db.execute("INSERT INTO leases (key, owner, status, attempts, expires_at, updated_at) "
+                           "VALUES (?, ?, 'active', 1, ?, ?)", (key, self.owner, now + self.ttl, now))
+                return True
+            if lease["status"] != "active":
+                return False
+            if lease["owner"] != self.owner and lease["expires_at"] > now:
+                return False
+            if lease["owner"] and lease["owner"] != self.owner:
+                log.warning(f"⚠️ Lease {key} van {lease['owner']} verlopen, overgenomen door {self.owner}")
+            db.execute("UPDATE leases SET owner = ?, attempts = attempts + 1, expires_at = ?, updated_at = ? "
+                       "WHERE key = ?", (self.owner, now + self.ttl, now, key))
+            return True
+
+    def renew(self) -> int:
+        """Extends every active lease of this worker; returns how many."""
+        now = time.time()
+        with self._transaction() as db:
+            return db.execute("UPDATE leases SET expires_at = ?, updated_at = ? "
+                              "WHERE owner = ? AND status = 'active' AND expires_at > ?",
+                              (now + self.ttl, now, self.owner, now)).rowcount
+
+    def release(self, key, success: bool):
+        """
+        Marks the row done, or frees it for another worker after a failure
+        (failed for good after ``max_attempts`` attempts).
+        """
+        now = time.time()
+        with self._transaction() as db:
+            lease = db.execute("SELECT * FROM leases WHERE key = ? AND owner = ?", (key, self.owner)).fetchone()
+            if lease is None or lease["status"] != "active":
+                return
+            if success:
+                status, owner = "done", self.owner
+            elif lease["attempts"] >= self.max_attempts:
+                status, owner = "failed", self.owner
+                log.warning(f"⚠️ Lease {key}: {lease['attempts']} pogingen mislukt, rij wordt niet meer opgepakt")
+            else:
+                status, owner = "active", None
+            db.execute("UPDATE leases SET status = ?, owner = ?, expires_at = 0, updated_at = ? WHERE key = ?",
+                       (status, owner, now, key))
+
+    def states(self, keys) -> dict:
+        """key -> 'done' | 'failed' | 'held' (active lease of another worker) | 'free'."""
+        now = time.time()
+        with self._lock:
+            rows = {row["key"]: row for row in self._db.execute("SELECT * FROM leases").fetchall()}
+        states = {}
+        for key in keys:
+            lease = rows.get(key)
+            if lease is None:
+                states[key] = "free"
+            elif lease["status"] != "active":
+                states[key] = lease["status"]
+            elif lease["owner"] and lease["owner"] != self.owner and lease["expires_at"] > now:
+                states[key] = "held"
+            else:
+                states[key] = "free"
+        return states
+
+    @contextlib.contextmanager
+    def heartbeat(self, interval=None):
+        """Renews this worker's leases every ``interval`` seconds (ttl / 3) inside the block."""
+        interval = interval or self.ttl / 3
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except sqlite3.Error as e:
+                    log.warning(f"⚠️ Lease-heartbeat mislukt: {e}")
+
+        thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,191 @@
+"""
+Partial-failure mutates for item-ID operations, with a per-run report of
+rejected item IDs.
+
+Without partial failure a single malformed or rejected item ID fails the whole
+mutate, so the sheet row is retried in full on the next run. With
+``partial_failure=True`` the API applies every valid operation and returns the
+errors of the rejected ones in ``partial_failure_error``; we map those back to
+the item IDs and collect them in ``run_report``.
+
+Jobs of the job API run concurrently; inside ``with scoped():`` a job
+collects its rejected IDs in its own report (``run_report`` resolves to it).
+
+Operations that are not item-ID units (subdivisions, Item-ID OTHERS) are part
+of the tree structure: if one of those is rejected, the item IDs below it are
+meaningless, so ``StructuralOperationError`` is raised and the row fails like
+before.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+# Shop/row context of the unit being processed, attached to every rejected ID
+_context = contextvars.ContextVar("partial_failure_context", default={})
+
+
+class StructuralOperationError(RuntimeError):
+    """A non-item-ID operation was rejected in a partial-failure mutate."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        codes = ", ".join(sorted({f["error_code"] for f in failures}))
+        super().__init__(f"{len(failures)} structural listing-group operation(s) rejected: {codes}")
+
+
+class PartialFailureReport:
+    """Thread-safe collector of rejected item IDs for one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rejected = []
+        self.applied_count = 0
+
+    def add(self, failures, applied_count):
+        with self._lock:
+            self.rejected.extend(failures)
+            self.applied_count += applied_count
+
+    def reset(self):
+        with self._lock:
+            self.rejected = []
+            self.applied_count = 0
+
+    def summary(self):
+        by_code = {}
+        for failure in self.rejected:
+            by_code[failure["error_code"]] = by_code.get(failure["error_code"], 0) + 1
+        return {
+            "applied_operations": self.applied_count,
+            "rejected_item_ids": len(self.rejected),
+            "rejected_by_error_code": by_code,
+        }
+
+    def write(self, directory="reports"):
+        """Writes the report as JSON and returns the path (None if nothing was rejected)."""
+        if not self.rejected:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"partial_failures_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with self._lock:
+            payload = {"summary": self.summary(), "rejected": list(self.rejected)}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        return path
+
+
+# Report of the job being processed in this context (job API), see scoped()
+_job_report = contextvars.ContextVar("partial_failure_report", default=None)
+_run_report = PartialFailureReport()
+
+
+class _CurrentReport:
+    """``run_report``: the report of the current job, or the run-wide one."""
+
+    def __getattr__(self, name):
+        return getattr(_job_report.get() or _run_report, name)
+
+
+run_report = _CurrentReport()
+
+
+@contextlib.contextmanager
+def scoped():
+    """Collects the rejected IDs of the calls made inside the block (one job) in their own report."""
+    token = _job_report.set(PartialFailureReport())
+    try:
+        yield
+    finally:
+        _job_report.reset(token)
+
+
+def set_context(**context):
+    """Sets the shop/row context for rejected IDs recorded from the current thread."""
+    _context.set(context)
+
+
+def current_context() -> dict:
+    """Row/shop context of the unit being processed in the current thread."""
+    return _context.get()
+
+
+def _error_code(error):
+    error_code = error.error_code
+    which = type(error_code).pb(error_code).WhichOneof("error_code")
+    if not which:
+        return "UNKNOWN"
+    return f"{which}.{getattr(error_code, which).name}"
+
+
+def _parse_partial_failures(client, response):
+    """Returns [(operation_index, error_code, message)] from a partial-failure response."""
+    status = response.partial_failure_error
+    if not status or not status.code:
+        return []
+
+    failure_type = type(client.get_type("GoogleAdsFailure"))
+    parsed = []
+    for detail in status.details:
+        failure = failure_type.deserialize(detail.value)
+        for error in failure.errors:
+            index = None
+            for element in error.location.field_path_elements:
+                if element.field_name == "operations":
+                    index = element.index
+                    break
+            parsed.append((index, _error_code(error), error.message))
+    return parsed
+
+
+def mutate_item_id_criteria(client, agc_service, customer_id, operations, item_ids_by_index, ad_group_id=None):
+    """
+    Sends AdGroupCriterion operations with partial failure enabled.
+
+    Args:
+        operations: AdGroupCriterionOperations (proto-plus or raw)
+        item_ids_by_index: {operation index: item ID} for the item-ID units;
+            all other operations are treated as structural
+        ad_group_id: Recorded in the report
+
+    Returns:
+        (response, rejected) where rejected is a list of dicts with
+        item_id, error_code and message. Applied operations have a non-empty
+        resource_name in ``response.results``.
+
+    Raises:
+        StructuralOperationError: a non-item-ID operation was rejected
+    """
+    request = client.get_type("MutateAdGroupCriteriaRequest")
+    request.customer_id = customer_id
+    request.operations = operations
+    request.partial_failure = True
+
+    response = agc_service.mutate_ad_group_criteria(request=request)
+
+    context = _context.get()
+    rejected = []
+    structural = []
+    for index, error_code, message in _parse_partial_failures(client, response):
+        failure = {
+            **context,
+            "customer_id": str(customer_id),
+            "ad_group_id": str(ad_group_id) if ad_group_id is not None else None,
+            "item_id": item_ids_by_index.get(index),
+            "error_code": error_code,
+            "message": message,
+        }
+        if failure["item_id"] is None:
+            structural.append(failure)
+        else:
+            rejected.append(failure)
+
+    applied = sum(1 for result in response.results if result.resource_name)
+    run_report.add(rejected, applied)
+
+    if structural:
+        raise StructuralOperationError(structural)
+    return response, rejected
@@ -0,0 +1,181 @@
+"""
+Pipelined prefetch of the next shops' account state.
+
+A run is read-then-write per shop: the connection idles while a tree is
+planned and the CPU idles while mutates are in flight. While the current shop
+is being processed, ``pipeline`` reads what the next ``TAGTOPPERS_PREFETCH``
+shops (default 2, 0 disables) will need on a small thread pool: the campaign
+lookup, the ad-group listing and the label ad groups' listing trees.
+
+    pipeline.start(rows, prefetch_row)   - per run; prefetch_row(row) reads one
+                                           row's state through pipeline.fetch()
+    pipeline.advance(index)              - row ``index`` starts: schedules the
+                                           rows in the window, drops older ones
+    pipeline.take(key, loader)           - the main path: the prefetched value,
+                                           waiting for it if still in flight,
+                                           or ``loader()`` if there is none
+    pipeline.invalidate(*prefix)         - drops entries whose key starts with
+                                           ``prefix`` (also while in flight)
+
+Every tree the tool mutates goes through ``tree_cache.invalidate()``, which
+also invalidates the prefetched copy of that tree, so a prefetched tree is
+never older than the last mutation of its ad group. A prefetch error is
+never raised from the background: ``take()`` then calls the loader on the
+main path, where the normal error handling applies.
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+import tree_cache
+
+log = logs.get_logger("prefetch")
+
+WINDOW = max(0, int(os.getenv("TAGTOPPERS_PREFETCH", "2")))
+
+
+def set_window(window: int):
+    """Number of shops read ahead (0 disables prefetching)."""
+    global WINDOW
+    WINDOW = max(0, int(window))
+
+
+class _Entry:
+    __slots__ = ("row", "done", "value", "error")
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Pipeline:
+    """Bounded read-ahead window over the rows of one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._claimed = set()
+        self._rows = []
+        self._prefetch_row = None
+        self._scheduled = set()
+        self._current = -1
+        self._pool = None
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, rows, prefetch_row, window=None):
+        """Starts a run over ``rows``; ``prefetch_row(row)`` reads one row ahead."""
+        self.stop()
+        window = WINDOW if window is None else window
+        with self._lock:
+            self._rows = list(rows)
+            self._prefetch_row = prefetch_row
+            self._window = window
+            self._scheduled = set()
+            self._current = -1
+            self.hits = self.misses = 0
+            if window > 0:
+                self._pool = ThreadPoolExecutor(max_workers=min(window, 4), thread_name_prefix="prefetch")
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._entries.clear()
+            self._claimed.clear()
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def advance(self, index):
+        """Row ``index`` is being processed: prefetch the next rows, forget the finished ones."""
+        with self._lock:
+            self._current = index
+            for key in [k for k, e in self._entries.items() if e.row < index]:
+                del self._entries[key]
+            self._claimed = {(row, key) for row, key in self._claimed if row >= index}
+            if self._pool is None:
+                return
+            for ahead in range(index + 1, min(index + 1 + self._window, len(self._rows))):
+                if ahead not in self._scheduled:
+                    self._scheduled.add(ahead)
+                    # Fresh context: spans/log context of the current shop don't leak into the prefetch
+                    self._pool.submit(contextvars.Context().run, self._run, ahead)
+
+    def _run(self, index):
+        with self._lock:
+            if index < self._current or self._prefetch_row is None:
+                return
+            row, prefetch_row = self._rows[index], self._prefetch_row
+        self._local.row = index
+        try:
+            prefetch_row(row)
+        except Exception as e:
+            log.debug(f"Prefetch van rij {row.get('row')} afgebroken: {e}")
+        finally:
+            self._local.row = None
+
+    # ---- background side ----
+
+    def fetch(self, key, loader):
+        """
+        Runs ``loader`` for ``key`` on a prefetch thread and keeps the result for
+        ``take``. Returns the value, or None if the main path got there first
+        (or the load failed), so the caller stops reading ahead.
+        """
+        row = getattr(self._local, "row", None)
+        with self._lock:
+            if row is None or row < self._current or (row, key) in self._claimed:
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(row)
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            entry.done.wait()
+            return entry.value
+        try:
+            entry.value = loader()
+        except Exception as e:
+            entry.error = e
+        finally:
+            entry.done.set()
+        return entry.value
+
+    # ---- main path ----
+
+    def take(self, key, loader):
+        """The prefetched value of ``key`` (waits if in flight), or ``loader()``."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                # Don't prefetch what the main path is reading right now
+                self._claimed.add((self._current, key))
+        if entry is not None:
+            entry.done.wait()
+            if entry.error is None:
+                with self._lock:
+                    self.hits += 1
+                return entry.value
+        with self._lock:
+            self.misses += 1
+        return loader()
+
+    def invalidate(self, *prefix):
+        """Drops prefetched entries whose key starts with ``prefix``."""
+        prefix = tuple(str(part) for part in prefix)
+        with self._lock:
+            for key in [k for k in self._entries if tuple(str(p) for p in k[:len(prefix)]) == prefix]:
+                del self._entries[key]
+
+
+pipeline = Pipeline()
+
+# Trees the tool mutates are re-read, not served from the prefetch
+tree_cache.on_invalidate(lambda customer_id, ad_group_id: pipeline.invalidate("tree", customer_id, ad_group_id))
@@ -0,0 +1,263 @@
+"""
+Opt-in cProfile + tracemalloc profiling per shop and per tree rebuild.
+
+Enable with ``TAGTOPPERS_PROFILE`` or ``--profile``:
+
+    shop      - one profile per sheet row (shop)
+    ad_group  - one profile per rebuild_tree_* call (label ad groups and the
+                tag_toppers tree)
+    all       - both
+
+For every profiled unit ``reports/profiles/<run>/`` gets
+
+    <kind>_<name>.prof       - cProfile stats (``python -m pstats`` / snakeviz)
+    <kind>_<name>.alloc.txt  - top allocation sites grown during the unit
+
+and at the end of the run ``summary.txt`` lists the slowest units with wall
+time, CPU time, peak traced memory and their top functions.
+
+Units can nest (ad group inside shop). cProfile allows one active profiler
+per thread, so the outer profiler is paused while an inner unit runs and the
+inner stats are merged into the outer profile when it is written.
+Ad group units that run on scheduler threads (``scheduler.py``) have no
+outer unit on their thread and are written as separate profiles only.
+tracemalloc is process-wide, so a unit that overlaps a unit on another thread
+has no peak memory (``-`` in the summary) and its allocation growth includes
+the other threads.
+Inside ``with scoped(directory):`` (one job of the job API) profiles and the
+summary go to ``directory``.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+import logs
+
+log = logs.get_logger("profiling")
+
+_MODES = {
+    "": set(),
+    "0": set(),
+    "off": set(),
+    "1": {"shop"},
+    "shop": {"shop"},
+    "ad_group": {"ad_group"},
+    "all": {"shop", "ad_group"},
+}
+
+ENABLED_KINDS = _MODES.get(os.getenv("TAGTOPPERS_PROFILE", "").strip().lower(), set())
+TOP_N = int(os.getenv("TAGTOPPERS_PROFILE_TOP", "10"))
+ALLOCATION_LINES = 25
+
+_local = threading.local()
+# Open units of all threads: tracemalloc's peak is process-wide, so a unit that
+# overlaps a unit on another thread (scheduler workers, job-API workers) gets no peak
+_open_units = set()
+_open_lock = threading.Lock()
+_results = []
+_results_lock = threading.Lock()
+_run_directory = None
+# Results and directory of the job being profiled in this context (job API), see scoped()
+_job = contextvars.ContextVar("profiling_job", default=None)
+
+
+def set_mode(mode: str):
+    """'shop', 'ad_group', 'all' or 'off'."""
+    global ENABLED_KINDS
+    ENABLED_KINDS = set(_MODES[mode])
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _directory():
+    global _run_directory
+    job = _job.get()
+    if job is not None:
+        os.makedirs(job["directory"], exist_ok=True)
+        return job["directory"]
+    if _run_directory is None:
+        _run_directory = os.path.join("reports", "profiles", time.strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(_run_directory, exist_ok=True)
+    return _run_directory
+
+
+class _Unit:
+    def __init__(self, kind, name, attributes):
+        self.kind = kind
+        self.name = name
+        self.attributes = attributes
+        self.profiler = cProfile.Profile()
+        self.children = []
+        self.peak = 0
+        self.concurrent = False
+
+    def __enter__(self):
+        stack = _stack()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.thread = threading.get_ident()
+        with _open_lock:
+            others = [unit for unit in _open_units if unit.thread != self.thread]
+            for unit in others:
+                unit.concurrent = True
+            self.concurrent = bool(others)
+            _open_units.add(self)
+        if stack:
+            parent = stack[-1]
+            parent.profiler.disable()
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        if not self.concurrent:
+            tracemalloc.reset_peak()
+        stack.append(self)
+
+        self._snapshot = tracemalloc.take_snapshot()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        snapshot = tracemalloc.take_snapshot()
+        with _open_lock:
+            _open_units.discard(self)
+
+        stack = _stack()
+        stack.pop()
+        if stack:
+            parent = stack[-1]
+            parent.children.append(self.profiler)
+            parent.peak = max(parent.peak, self.peak)
+            parent.concurrent = parent.concurrent or self.concurrent
+            if not parent.concurrent:
+                tracemalloc.reset_peak()
+            parent.profiler.enable()
+
+        try:
+            self._write(wall, cpu, snapshot)
+        except Exception as e:
+            log.warning(f"⚠️ Profiel voor {self.kind} {self.name} niet geschreven: {e}")
+        return False
+
+    def _write(self, wall, cpu, snapshot):
+        stats = pstats.Stats(self.profiler)
+        for child in self.children:
+            stats.add(child)
+
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(self.name))[:80]
+        base = os.path.join(_directory(), f"{self.kind}_{safe_name}")
+        stats.dump_stats(f"{base}.prof")
+
+        growth = snapshot.compare_to(self._snapshot, "lineno")[:ALLOCATION_LINES]
+        with open(f"{base}.alloc.txt", "w", encoding="utf-8") as f:
+            if self.concurrent:
+                f.write(f"{self.kind} {self.name}: no peak, ran alongside units on other threads; "
+                        f"the growth below is process-wide\n\n")
+            else:
+                f.write(f"{self.kind} {self.name}: peak traced memory {self.peak / 1e6:.1f} MB\n\n")
+            for stat in growth:
+                f.write(f"{stat}\n")
+
+        with _results_lock:
+            _unit_results().append({
+                "kind": self.kind,
+                "name": self.name,
+                "attributes": self.attributes,
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "peak_mb": None if self.concurrent else self.peak / 1e6,
+                "profile": f"{base}.prof",
+                "top_functions": _top_functions(stats),
+            })
+
+
+def _top_functions(stats, limit=5):
+    rows = []
+    for (filename, line, function), (_, calls, _, cumulative, _) in stats.stats.items():
+        rows.append((cumulative, f"{os.path.basename(filename)}:{line}({function})", calls))
+    rows.sort(reverse=True)
+    return [f"{cumulative:8.3f}s  {calls:>8} calls  {where}" for cumulative, where, calls in rows[:limit]]
+
+
+class _NoopUnit:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_UNIT = _NoopUnit()
+
+
+def unit(kind: str, name, **attributes):
+    """Profiles the block as one unit when ``kind`` ('shop' or 'ad_group') is enabled."""
+    if kind not in ENABLED_KINDS:
+        return _NOOP_UNIT
+    return _Unit(kind, name, attributes)
+
+
+def _unit_results():
+    job = _job.get()
+    return _results if job is None else job["results"]
+
+
+@contextlib.contextmanager
+def scoped(directory):
+    """Writes the profiles of the block (one job) and its summary to ``directory``."""
+    token = _job.set({"directory": directory, "results": []})
+    try:
+        yield
+    finally:
+        _job.reset(token)
+
+
+def reset():
+    """Starts a new profile directory and summary (daemon mode: one per poll cycle)."""
+    global _run_directory
+    with _results_lock:
+        _unit_results().clear()
+    _run_directory = None
+
+
+def write_summary(top_n=None):
+    """Writes summary.txt with the slowest units; returns its path (None if nothing was profiled)."""
+    with _results_lock:
+        results = sorted(_unit_results(), key=lambda r: -r["wall_s"])
+    if not results:
+        return None
+
+    lines = [f"Profiled units: {len(results)}", ""]
+    for kind in ("shop", "ad_group"):
+        units = [r for r in results if r["kind"] == kind][:top_n or TOP_N]
+        if not units:
+            continue
+        lines.append(f"Slowest {kind} units")
+        lines.append(f"{'wall s':>9}{'cpu s':>9}{'peak MB':>9}  unit")
+        for r in units:
+            attributes = " ".join(f"{k}={v}" for k, v in r["attributes"].items())
+            peak = "-" if r["peak_mb"] is None else f"{r['peak_mb']:.1f}"
+            lines.append(f"{r['wall_s']:>9.2f}{r['cpu_s']:>9.2f}{peak:>9}  {r['name']} {attributes}")
+            lines.extend(f"{'':>29}{fn}" for fn in r["top_functions"])
+            lines.append(f"{'':>29}{r['profile']}")
+        lines.append("")
+
+    path = os.path.join(_directory(), "summary.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return path
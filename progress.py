@@ -0,0 +1,199 @@
+"""
+Live progress and throughput display for long runs.
+
+Shows shops completed/remaining per account, operations per second (from the
+accounting ledger), the ad groups currently being processed, error counts and
+an ETA based on the throughput of the last shops.
+
+Modes (``TAGTOPPERS_PROGRESS``):
+    tty  - one status line on stderr, redrawn twice per second
+    log  - a plain status line on stderr every ``TAGTOPPERS_PROGRESS_INTERVAL``
+           seconds (default 60), for cron/CI logs
+    off  - no progress output
+Default: ``tty`` when stderr is a terminal, ``log`` otherwise.
+
+The status is rendered from a background thread, so a stalled run is visible
+as a growing "last shop Xs ago" without any output from the main loop.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+import accounting
+
+MODE = os.getenv("TAGTOPPERS_PROGRESS", "").strip().lower() or ("tty" if sys.stderr.isatty() else "log")
+LOG_INTERVAL = float(os.getenv("TAGTOPPERS_PROGRESS_INTERVAL", "60"))
+
+_TTY_INTERVAL = 0.5
+# Completed shops / operation samples used for the recent-throughput ETA
+_RECENT_SHOPS = 10
+_RATE_WINDOW = 60.0
+
+
+def _format_duration(seconds) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressTracker:
+    """Thread-safe run progress; ``render()`` builds the status line."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset({})
+
+    def reset(self, totals_by_account):
+        with self._lock:
+            self.totals = dict(totals_by_account)
+            self.done = collections.Counter()
+            self.failed = collections.Counter()
+            self.errors = 0
+            self.in_flight = {}
+            self.started_at = time.monotonic()
+            self.last_completion = None
+            self._completions = collections.deque(maxlen=_RECENT_SHOPS)
+            self._op_samples = collections.deque()
+
+    # ---- events ----
+
+    def shop_finished(self, account, success=True):
+        now = time.monotonic()
+        with self._lock:
+            self.done[account] += 1
+            if not success:
+                self.failed[account] += 1
+            self.last_completion = now
+            self._completions.append(now)
+
+    def error(self, count=1):
+        with self._lock:
+            self.errors += count
+
+    def ad_group(self, ad_group_id, label=None):
+        """Context manager marking an ad group as in flight."""
+        return _InFlight(self, str(ad_group_id), label or str(ad_group_id))
+
+    # ---- rendering ----
+
+    def _ops_per_second(self, now):
+        operations = accounting.ledger.totals["operations"]
+        samples = self._op_samples
+        samples.append((now, operations))
+        while len(samples) > 2 and now - samples[0][0] > _RATE_WINDOW:
+            samples.popleft()
+        first_time, first_ops = samples[0]
+        if now - first_time <= 0:
+            return 0.0
+        return (operations - first_ops) / (now - first_time)
+
+    def _eta(self, now, remaining):
+        if remaining == 0:
+            return 0
+        completions = self._completions
+        if len(completions) >= 2:
+            shops, elapsed = len(completions) - 1, completions[-1] - completions[0]
+        elif completions:
+            shops, elapsed = len(completions), completions[-1] - self.started_at
+        else:
+            return None
+        # Skipped rows finish within one clock tick (~15 ms on Windows)
+        if elapsed <= 0:
+            return None
+        return remaining * elapsed / shops
+
+    def render(self) -> str:
+        now = time.monotonic()
+        with self._lock:
+            total = sum(self.totals.values())
+            done = sum(self.done.values())
+            accounts = " ".join(f"{account} {self.done[account]}/{count}"
+                                for account, count in sorted(self.totals.items()))
+            in_flight = list(self.in_flight.values())
+            ops_rate = self._ops_per_second(now)
+            eta = self._eta(now, total - done)
+            failed = sum(self.failed.values())
+            errors = self.errors
+            last = now - self.last_completion if self.last_completion is not None else None
+
+        parts = [
+            f"shops {done}/{total} ({accounts})",
+            f"{ops_rate:.1f} ops/s",
+            f"errors {errors} (failed shops {failed})",
+            f"ETA {_format_duration(eta)}",
+            f"elapsed {_format_duration(now - self.started_at)}",
+        ]
+        if last is not None:
+            parts.append(f"last shop {_format_duration(last)} ago")
+        if in_flight:
+            shown = ", ".join(in_flight[:3]) + (f" +{len(in_flight) - 3}" if len(in_flight) > 3 else "")
+            parts.append(f"in flight: {shown}")
+        return " | ".join(parts)
+
+    # ---- display thread ----
+
+    def start(self, totals_by_account, mode=None):
+        """Resets the counters and starts the display thread for a run."""
+        self.reset(totals_by_account)
+        mode = mode or MODE
+        if mode not in ("tty", "log"):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._display, args=(mode,), name="progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _display(self, mode):
+        stream = sys.stderr
+        interval = _TTY_INTERVAL if mode == "tty" else LOG_INTERVAL
+        while not self._stop.wait(interval):
+            line = self.render()
+            if mode == "tty":
+                width = os.get_terminal_size(stream.fileno()).columns if stream.isatty() else 200
+                stream.write("\r\x1b[2K" + line[:width - 1])
+            else:
+                stream.write(f"[progress {time.strftime('%H:%M:%S')}] {line}\n")
+            stream.flush()
+        # Final state
+        stream.write(("\r\x1b[2K" if mode == "tty" else "[progress] ") + self.render() + "\n")
+        stream.flush()
+
+
+class _InFlight:
+    __slots__ = ("_tracker", "_key", "_label")
+
+    def __init__(self, tracker, key, label):
+        self._tracker = tracker
+        self._key = key
+        self._label = label
+
+    def __enter__(self):
+        with self._tracker._lock:
+            self._tracker.in_flight[self._key] = self._label
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._tracker._lock:
+            self._tracker.in_flight.pop(self._key, None)
+        return False
+
+
+tracker = ProgressTracker()
@@ -0,0 +1,217 @@
+"""
+Shared rate governor for all Google Ads calls.
+
+With shops and ad groups processed in parallel, the run has to stay under the
+developer token's rate instead of finding the limit through
+RESOURCE_EXHAUSTED errors. ``governed_client`` wraps the client so every
+search and mutate first takes tokens from two process-wide buckets:
+
+    requests    - 1 token per call    (TAGTOPPERS_MAX_REQUESTS_PER_SECOND, default 10)
+    operations  - 1 token per mutate operation, 1 per search
+                                      (TAGTOPPERS_MAX_OPERATIONS_PER_SECOND, default 500)
+
+When a call fails with a quota error (QuotaError RESOURCE_EXHAUSTED /
+RESOURCE_TEMPORARILY_EXHAUSTED, or gRPC RESOURCE_EXHAUSTED) the governor
+
+    - pauses every caller for the ``retry_delay`` the API returned in
+      ``quota_error_details`` (exponential backoff when there is none),
+    - halves the rate of both buckets for all threads,
+    - retries the call (up to TAGTOPPERS_RATE_LIMIT_RETRIES times, default 5;
+      a rejected request was not applied, so this is safe for mutates).
+
+Every successful call raises the rate again by a small step, up to the
+configured maximum. This is additive increase, multiplicative decrease.
+Throughput climbs to just below the limit and does not bounce off it.
+
+Set both maxima to 0 to disable throttling; quota errors are still retried.
+"""
+
+import os
+import threading
+import time
+
+import logs
+import tracing
+
+log = logs.get_logger("rate_limit")
+
+MAX_REQUESTS_PER_SECOND = float(os.getenv("TAGTOPPERS_MAX_REQUESTS_PER_SECOND", "10"))
+MAX_OPERATIONS_PER_SECOND = float(os.getenv("TAGTOPPERS_MAX_OPERATIONS_PER_SECOND", "500"))
+MAX_RETRIES = int(os.getenv("TAGTOPPERS_RATE_LIMIT_RETRIES", "5"))
+
+# Rate never drops below this fraction of the maximum
+_MIN_FACTOR = 0.05
+# Fraction of the maximum regained per successful call
+_RECOVERY_STEP = 0.01
+_DEFAULT_BACKOFF = 1.0
+_MAX_BACKOFF = 120.0
+
+_QUOTA_ERRORS = {"RESOURCE_EXHAUSTED", "RESOURCE_TEMPORARILY_EXHAUSTED"}
+
+
+class TokenBucket:
+    """
+    Token bucket that allows debt: a call heavier than the burst is let through
+    once the bucket is full, and the next callers wait until the debt is paid off.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, weight, now=None) -> float:
+        """Takes ``weight`` tokens; returns how long the caller has to wait before using them."""
+        if self.rate <= 0:
+            return 0.0
+        now = self._clock() if now is None else now
+        self._refill(now)
+        # Wait until the bucket could hold the whole request, then take it
+        wait = max(0.0, min(weight, self.burst) - self._tokens) / self.rate
+        self._tokens -= weight
+        return wait
+
+
+def retry_delay(exc):
+    """
+    Seconds the API asked to wait for a quota error: the ``retry_delay`` from
+    ``quota_error_details``, 0.0 for a quota error without a delay, None if
+    ``exc`` isn't a quota error.
+    """
+    failure = getattr(exc, "failure", None)
+    if failure is not None:
+        for error in getattr(failure, "errors", []):
+            quota_error = error.error_code.quota_error
+            if getattr(quota_error, "name", str(quota_error)) in _QUOTA_ERRORS:
+                delay = error.details.quota_error_details.retry_delay
+                return delay.seconds + delay.nanos / 1e9
+
+    # gRPC errors (GoogleAdsException.error is the underlying RpcError)
+    for rpc_error in (exc, getattr(exc, "error", None)):
+        code = getattr(rpc_error, "code", None)
+        if callable(code):
+            try:
+                if getattr(code(), "name", None) == "RESOURCE_EXHAUSTED":
+                    return 0.0
+            except Exception:
+                pass
+    return None
+
+
+class Governor:
+    """Process-wide request/operation rate with a shared pause after quota errors."""
+
+    def __init__(self, requests_per_second=MAX_REQUESTS_PER_SECOND,
+                 operations_per_second=MAX_OPERATIONS_PER_SECOND, max_retries=MAX_RETRIES):
+        self._lock = threading.Lock()
+        self.max_requests = requests_per_second
+        self.max_operations = operations_per_second
+        self.max_retries = max_retries
+        self.requests = TokenBucket(requests_per_second)
+        self.operations = TokenBucket(operations_per_second)
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.waited_s = 0.0
+
+    def _set_factor(self, factor):
+        self.factor = max(_MIN_FACTOR, min(1.0, factor))
+        self.requests.rate = self.max_requests * self.factor
+        self.operations.rate = self.max_operations * self.factor
+
+    def acquire(self, operations=1):
+        """Blocks until a call with ``operations`` operations may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.paused_until - now,
+                       self.requests.reserve(1, now),
+                       self.operations.reserve(max(1, operations), now))
+            if wait > 0:
+                self.waited_s += wait
+        if wait > 0:
+            with tracing.span("rate_limit_wait", category="wait", seconds=round(wait, 3), ops=operations):
+                time.sleep(wait)
+
+    def succeeded(self):
+        if self.factor < 1.0:
+            with self._lock:
+                self._set_factor(self.factor + _RECOVERY_STEP)
+
+    def throttle(self, delay, attempt):
+        """Pauses all callers and halves the rate after a quota error."""
+        if not delay:
+            delay = min(_MAX_BACKOFF, _DEFAULT_BACKOFF * 2 ** attempt)
+        with self._lock:
+            self.throttled += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._set_factor(self.factor / 2)
+            factor = self.factor
+        log.warning(f"⚠️ Quota bereikt: alle calls {delay:.1f}s gepauzeerd, tempo naar {factor:.0%} "
+                    f"(poging {attempt + 1}/{self.max_retries})")
+
+    def call(self, method, operations, *args, **kwargs):
+        """Sends one call under the governor, retrying quota errors."""
+        attempt = 0
+        while True:
+            self.acquire(operations)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as exc:
+                delay = retry_delay(exc)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                self.throttle(delay, attempt)
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+
+governor = Governor()
+
+
+def _operation_count(args, kwargs) -> int:
+    operations = kwargs.get("operations")
+    if operations is None and kwargs.get("request") is not None:
+        operations = getattr(kwargs["request"], "operations", None)
+    if operations is None and len(args) > 1:
+        operations = args[1]
+    try:
+        return len(operations) if operations is not None else 1
+    except TypeError:
+        return 1
+
+
+class _GovernedService:
+    def __init__(self, service):
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if name.startswith("mutate"):
+            return lambda *args, **kwargs: governor.call(attr, _operation_count(args, kwargs), *args, **kwargs)
+        if name.startswith("search"):
+            return lambda *args, **kwargs: governor.call(attr, 1, *args, **kwargs)
+        return attr
+
+
+class _GovernedClient:
+    def __init__(self, client):
+        self._client = client
+
+    def get_service(self, name, *args, **kwargs):
+        return _GovernedService(self._client.get_service(name, *args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def governed_client(client):
+    """Wraps a GoogleAdsClient so every search/mutate goes through the shared governor."""
+    return _GovernedClient(client)
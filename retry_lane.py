@@ -0,0 +1,198 @@
+"""
+Deferred retry lane for units that failed with a transient error.
+
+A CONCURRENT_MODIFICATION or a transient backend error (INTERNAL_ERROR,
+TRANSIENT_ERROR, gRPC UNAVAILABLE / DEADLINE_EXCEEDED / ABORTED / INTERNAL)
+usually clears up after a while. Retrying inline holds up every shop behind
+the flaky one, and failing the row postpones it to the next run. A run
+therefore puts the failed unit (one label ad group, or the tag_toppers step
+of a shop) on a ``DeferredQueue`` and continues with the next unit:
+
+    deferred.defer(key, name, fn, error, resources)  - retry fn() later
+    deferred.run_due()                               - between shops: retry the
+                                                       units whose backoff is over
+    deferred.drain()                                 - end of the run: wait for and
+                                                       retry all remaining units
+
+A unit is retried up to ``TAGTOPPERS_DEFERRED_ATTEMPTS`` times (default 4),
+``TAGTOPPERS_DEFERRED_DELAY`` seconds after the failure (default 10),
+doubling per attempt up to 5 minutes. A retry runs in the context of the
+failed unit (row context, accounting scope) and holds the unit's scheduler
+locks. A unit that fails with any other error, or runs out of attempts,
+fails its row. A row whose units are all resolved is finished by the caller
+(``pending(key)`` / ``failed(key)``).
+
+Quota errors are not handled here: the rate governor (rate_limit.py) retries
+those per call.
+"""
+
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import logs
+import scheduler
+import tracing
+
+log = logs.get_logger("retry_lane")
+
+MAX_ATTEMPTS = int(os.getenv("TAGTOPPERS_DEFERRED_ATTEMPTS", "4"))
+BASE_DELAY = float(os.getenv("TAGTOPPERS_DEFERRED_DELAY", "10"))
+_MAX_DELAY = 300.0
+
+# Returned by process_row when units of the row are waiting in the lane
+DEFERRED = "deferred"
+
+_TRANSIENT_ERRORS = {
+    ("database_error", "CONCURRENT_MODIFICATION"),
+    ("internal_error", "INTERNAL_ERROR"),
+    ("internal_error", "TRANSIENT_ERROR"),
+    ("internal_error", "DEADLINE_EXCEEDED"),
+}
+_TRANSIENT_CODES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "ABORTED", "INTERNAL"}
+
+
+def is_transient(exc) -> bool:
+    """Whether ``exc`` is an error that a later retry of the same unit is likely to get past."""
+    failure = getattr(exc, "failure", None)
+    if failure is not None:
+        errors = list(getattr(failure, "errors", []))
+        for error in errors:
+            for field, name in _TRANSIENT_ERRORS:
+                value = getattr(error.error_code, field, None)
+                if value is not None and getattr(value, "name", str(value)) == name:
+                    return True
+        if errors:
+            return False
+
+    # StructuralOperationError from a partial-failure mutate: transient if every rejection is
+    failures = getattr(exc, "failures", None)
+    if failures:
+        return all(tuple(f["error_code"].split(".", 1)) in _TRANSIENT_ERRORS for f in failures)
+
+    # gRPC errors (GoogleAdsException.error is the underlying RpcError)
+    for rpc_error in (exc, getattr(exc, "error", None)):
+        code = getattr(rpc_error, "code", None)
+        if callable(code):
+            try:
+                if getattr(code(), "name", None) in _TRANSIENT_CODES:
+                    return True
+            except Exception:
+                pass
+    return False
+
+
+def backoff(attempt) -> float:
+    """Delay before retry number ``attempt + 1``."""
+    return min(_MAX_DELAY, BASE_DELAY * 2 ** attempt)
+
+
+class _Unit:
+    __slots__ = ("key", "name", "fn", "resources", "context", "attempt")
+
+    def __init__(self, key, name, fn, resources, context):
+        self.key = key
+        self.name = name
+        self.fn = fn
+        self.resources = resources
+        self.context = context
+        self.attempt = 0
+
+
+class DeferredQueue:
+    """Units waiting for a retry, ordered by due time. One queue per run."""
+
+    def __init__(self, max_attempts=None, clock=time.monotonic, sleep=tracing.sleep):
+        self.max_attempts = MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._heap = []
+        self._order = itertools.count()
+        self._pending = {}
+        self._failed = set()
+        self.deferred = 0
+        self.recovered = 0
+
+    def defer(self, key, name, fn, error=None, resources=()):
+        """Retries ``fn()`` later for row ``key``; ``fn`` returns False or raises when the unit fails."""
+        unit = _Unit(key, name, fn, tuple(resources), contextvars.copy_context())
+        with self._lock:
+            self.deferred += 1
+            self._pending[key] = self._pending.get(key, 0) + 1
+        log.warning(f"⏳ {name} uitgesteld na tijdelijke fout, nieuwe poging over {backoff(0):.0f}s: {error}")
+        self._schedule(unit)
+
+    def _schedule(self, unit):
+        with self._lock:
+            heapq.heappush(self._heap, (self._clock() + backoff(unit.attempt), next(self._order), unit))
+
+    def pending(self, key) -> bool:
+        """Whether units of row ``key`` are still waiting for a retry."""
+        return self._pending.get(key, 0) > 0
+
+    def failed(self, key) -> bool:
+        """Whether a deferred unit of row ``key`` failed for good."""
+        return key in self._failed
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _pop_due(self, now):
+        with self._lock:
+            if self._heap and self._heap[0][0] <= now:
+                return heapq.heappop(self._heap)[2]
+        return None
+
+    def _finish(self, unit, success):
+        with self._lock:
+            self._pending[unit.key] -= 1
+            if success:
+                self.recovered += 1
+            else:
+                self._failed.add(unit.key)
+
+    def _retry(self, unit):
+        unit.attempt += 1
+        try:
+            with tracing.span("deferred_retry", unit=unit.name, attempt=unit.attempt):
+                with scheduler.locks.hold(*unit.resources):
+                    success = unit.context.run(unit.fn)
+        except Exception as exc:
+            if is_transient(exc) and unit.attempt < self.max_attempts:
+                log.warning(f"⏳ {unit.name}: poging {unit.attempt}/{self.max_attempts} mislukt, "
+                            f"opnieuw over {backoff(unit.attempt):.0f}s: {exc}")
+                self._schedule(unit)
+                return
+            log.error(f"❌ {unit.name}: opgegeven na {unit.attempt} uitgestelde poging(en): {exc}")
+            self._finish(unit, False)
+            return
+        if success is not False:
+            log.info(f"✅ {unit.name} gelukt bij uitgestelde poging {unit.attempt}")
+        self._finish(unit, success is not False)
+
+    def run_due(self):
+        """Retries every unit whose backoff is over; returns the row keys that have no units left."""
+        settled = []
+        while True:
+            unit = self._pop_due(self._clock())
+            if unit is None:
+                return settled
+            self._retry(unit)
+            if not self.pending(unit.key):
+                settled.append(unit.key)
+
+    def drain(self):
+        """Retries until no unit is left, sleeping until the next one is due; returns the settled row keys."""
+        settled = []
+        while True:
+            settled.extend(self.run_due())
+            with self._lock:
+                if not self._heap:
+                    return settled
+                wait = self._heap[0][0] - self._clock()
+            if wait > 0:
+                self._sleep(wait)
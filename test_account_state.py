@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Tests for the in-memory account state (no Google Ads access needed)"""
+
+import threading
+from types import SimpleNamespace
+
+import account_state
+
+
+class _Remove:
+    def __init__(self, resource_name):
+        self.remove = resource_name
+
+    def WhichOneof(self, name):
+        return "remove"
+
+
+def _node(res_id, parent_id=None):
+    return {
+        "resource_name": f"customers/1/adGroupCriteria/5~{res_id}",
+        "parent": f"customers/1/adGroupCriteria/5~{parent_id}" if parent_id else None,
+    }
+
+
+def test_new_campaign_and_ad_group_are_known_empty():
+    state = account_state.AccountState()
+    state.set_campaign("1", ("shopping", "42", "shop", "tag_toppers"), "customers/1/campaigns/7", created=True)
+    assert state.campaign(1, ("shopping", "42", "shop", "tag_toppers")) == "customers/1/campaigns/7"
+    assert state.is_new("customers/1/campaigns/7")
+
+    state.set_ad_group("1", "customers/1/campaigns/7", "tag_toppers", "customers/1/adGroups/5", created=True)
+    assert state.ad_group("1", "customers/1/campaigns/7", "tag_toppers") == "customers/1/adGroups/5"
+    assert state.is_new("customers/1/adGroups/5")
+    assert state.tree("1", 5) == []
+    assert state.ad("customers/1/adGroups/5") is None
+
+
+def test_found_resources_are_not_new_and_have_no_known_tree():
+    state = account_state.AccountState()
+    state.set_ad_group("1", "customers/1/campaigns/7", "tag_toppers", "customers/1/adGroups/6")
+    assert not state.is_new("customers/1/adGroups/6")
+    assert state.tree("1", "6") is None
+
+
+def test_removing_a_node_drops_its_subtree():
+    state = account_state.AccountState()
+    state.set_tree("1", "5", [_node(1), _node(2, 1), _node(3, 2), _node(4, 1)])
+    operations = [_Remove("customers/1/adGroupCriteria/5~2")]
+    response = SimpleNamespace(results=[SimpleNamespace(resource_name="customers/1/adGroupCriteria/5~2")])
+    state.record_criteria("1", "5", operations, response)
+    assert sorted(n["resource_name"] for n in state.tree("1", "5")) == [
+        "customers/1/adGroupCriteria/5~1", "customers/1/adGroupCriteria/5~4",
+    ]
+
+
+def test_bid_updates_change_the_known_node():
+    state = account_state.AccountState()
+    state.set_tree("1", "5", [dict(_node(1), bid_micros=0), dict(_node(2, 1), bid_micros=100)])
+    update = SimpleNamespace(update=SimpleNamespace(cpc_bid_micros=200), WhichOneof=lambda name: "update")
+    response = SimpleNamespace(results=[SimpleNamespace(resource_name="customers/1/adGroupCriteria/5~2")])
+    state.record_criteria("1", "5", [update], response)
+    assert {n["resource_name"][-1]: n["bid_micros"] for n in state.tree("1", "5")} == {"1": 0, "2": 200}
+
+
+def test_unknown_trees_are_not_recorded_and_reset_forgets_everything():
+    state = account_state.AccountState()
+    response = SimpleNamespace(results=[SimpleNamespace(resource_name="x")])
+    state.record_criteria("1", "5", [_Remove("x")], response)
+    assert state.tree("1", "5") is None
+
+    state.set_label("1", "label", "customers/1/labels/3")
+    state.set_campaign("1", "key", "customers/1/campaigns/7", created=True)
+    state.reset()
+    assert state.label("1", "label") is None
+    assert not state.is_new("customers/1/campaigns/7")
+
+
+def test_scoped_state_is_private_to_its_context():
+    account_state.state.reset()
+    account_state.state.set_label("1", "tag_toppers", "customers/1/labels/1")
+    seen = {}
+
+    def job(name):
+        with account_state.scoped():
+            account_state.state.set_label("1", name, f"customers/1/labels/{name}")
+            seen[name] = (account_state.state.label("1", name), account_state.state.label("1", "tag_toppers"))
+
+    workers = [threading.Thread(target=job, args=(name,)) for name in ("a", "b")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert seen == {"a": ("customers/1/labels/a", None), "b": ("customers/1/labels/b", None)}
+    assert account_state.state.label("1", "a") is None
+    assert account_state.state.label("1", "tag_toppers") == "customers/1/labels/1"
+    account_state.state.reset()
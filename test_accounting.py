@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Tests for API call / operation accounting (no Google Ads access needed)"""
+
+import json
+import threading
+
+import pytest
+
+import accounting
+
+
+class _Response:
+    def __init__(self, n):
+        self.results = [object()] * n
+
+
+class _Service:
+    def search(self, customer_id, query):
+        return iter(["row1", "row2"])
+
+    def mutate_ad_group_criteria(self, customer_id, operations):
+        return _Response(len(operations))
+
+
+class _Client:
+    def get_service(self, name):
+        return _Service()
+
+
+def read_tree(client):
+    return list(client.get_service("GoogleAdsService").search(customer_id="1", query="q"))
+
+
+def test_calls_are_counted_per_shop_ad_group_and_function(tmp_path, monkeypatch):
+    usage_path = str(tmp_path / "quota_usage.json")
+    ledger = accounting.Ledger(budget=10, usage_path=usage_path)
+    monkeypatch.setattr(accounting, "ledger", ledger)
+    client = accounting.accounted_client(_Client())
+
+    with accounting.scope(shop="42:shop.nl"):
+        with accounting.scope(ad_group="7"):
+            assert read_tree(client) == ["row1", "row2"]
+            client.get_service("AdGroupCriterionService").mutate_ad_group_criteria(
+                customer_id="1", operations=[1, 2, 3]
+            )
+        with accounting.call("redshift.get_branded") as call:
+            call.rows = 1
+
+    report = ledger.report()
+    assert report["totals"]["requests"] == 3
+    assert report["totals"]["operations"] == 4
+    assert report["by_shop"]["42:shop.nl"]["requests"] == 3
+    assert report["by_ad_group"]["7"]["operations"] == 4
+    assert report["by_function"]["read_tree"]["rows"] == 2
+    assert report["by_api"]["AdGroupCriterionService.mutate_ad_group_criteria"]["rows"] == 3
+    assert "test_calls_are_counted_per_shop_ad_group_and_function" in report["by_function"]
+
+    ledger.write(str(tmp_path))
+    with open(usage_path) as f:
+        assert list(json.load(f).values()) == [4]
+
+    # The next run starts from today's persisted total
+    assert accounting.Ledger(budget=10, usage_path=usage_path).daily_total() == 4
+
+
+def test_concurrent_job_ledgers_share_the_daily_total(tmp_path, monkeypatch):
+    usage_path = str(tmp_path / "quota_usage.json")
+    monkeypatch.setattr(accounting, "ledger", accounting.Ledger(budget=10, usage_path=usage_path))
+    client = accounting.accounted_client(_Client())
+    ready = threading.Barrier(2)
+    ledgers = {}
+
+    def job(name, operations):
+        with accounting.scoped():
+            client.get_service("AdGroupCriterionService").mutate_ad_group_criteria(
+                customer_id="1", operations=list(range(operations))
+            )
+            ready.wait()
+            ledgers[name] = accounting.current_ledger()
+            ledgers[name].write(str(tmp_path / name))
+
+    workers = [threading.Thread(target=job, args=args) for args in (("a", 2), ("b", 3))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert ledgers["a"].totals["operations"] == 2 and ledgers["b"].totals["operations"] == 3
+    assert accounting.ledger.totals["operations"] == 0
+    with open(usage_path) as f:
+        assert list(json.load(f).values()) == [5]
+
+
+def test_failed_mutates_are_counted(monkeypatch):
+    ledger = accounting.Ledger(budget=0, usage_path="unused.json")
+    monkeypatch.setattr(accounting, "ledger", ledger)
+
+    class _Exhausted:
+        def mutate_ad_group_criteria(self, customer_id, operations):
+            raise RuntimeError("RESOURCE_EXHAUSTED")
+
+    class _FailingClient:
+        def get_service(self, name):
+            return _Exhausted()
+
+    service = accounting.accounted_client(_FailingClient()).get_service("AdGroupCriterionService")
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            service.mutate_ad_group_criteria(customer_id="1", operations=[1, 2])
+
+    counters = ledger.report()["by_api"]["AdGroupCriterionService.mutate_ad_group_criteria"]
+    assert (counters["requests"], counters["operations"], counters["rows"]) == (2, 4, 0)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Tests for BatchJob submission against the local stand-in (no Google Ads access needed)"""
+
+import pytest
+
+import batch_jobs
+from partial_failure import run_report
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def _clean_report():
+    run_report.reset()
+    yield
+    run_report.reset()
+
+
+def _submit(service, plans, **kwargs):
+    clock = _Clock()
+    return batch_jobs.submit(service, plans, clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_operations_are_uploaded_in_chunks_and_results_reach_the_units(monkeypatch):
+    monkeypatch.setattr(batch_jobs, "UPLOAD_CHUNK", 5)
+    plan = batch_jobs.BatchPlan("1")
+    done = {}
+    unit = plan.unit("row1", "tag_toppers", done=lambda names: done.setdefault("row1", names))
+    unit.add("campaign_budget_operation", ["budget"])
+    assert unit.add("campaign_operation", ["campaign"]) == 1
+    unit.add("ad_group_criterion_operation", [f"node{i}" for i in range(10)])
+
+    service = batch_jobs.LocalBatchJobService(resource_name=lambda field, op: f"rn/{op}")
+    outcome, _ = _submit(service, [plan])
+
+    assert outcome == {"row1": True}
+    assert [size for _, size in service.uploads] == [5, 5, 2]
+    assert done["row1"][:2] == ["rn/budget", "rn/campaign"]
+    assert len(done["row1"]) == 12
+
+
+def test_plans_are_split_into_jobs_at_row_boundaries():
+    plan = batch_jobs.BatchPlan("1")
+    plan.unit("row1", "ad group 1").add("f", ["a", "b"])
+    plan.unit("row1", "ad group 2").add("f", ["c"])
+    plan.unit("row2", "ad group 3").add("f", ["d", "e", "f"])
+    plan.unit("row3", "empty")
+    plan.unit("row4", "ad group 4").add("f", ["g"])
+
+    jobs = plan.jobs(max_operations=4)
+    assert [[unit.name for unit in job] for job in jobs] == [
+        ["ad group 1", "ad group 2"],   # row1 whole, row2 doesn't fit next to it
+        ["ad group 3", "ad group 4"],
+    ]
+
+    service = batch_jobs.LocalBatchJobService()
+    outcome, _ = _submit(service, [plan], max_operations=4)
+    assert outcome == {"row1": True, "row2": True, "row3": True, "row4": True}
+    assert [len(job["operations"]) for job in service.jobs.values()] == [3, 4]
+
+
+def test_rejections_fail_the_unit_unless_item_id_or_optional():
+    plan = batch_jobs.BatchPlan("1")
+    done = []
+    plan.unit("row1", "ad group 1", done=done.append).add(
+        "ad_group_criterion_operation", ["subdivision", "bad-item", "item"], item_ids={1: "bad-item", 2: "item"}
+    )
+    unit = plan.unit("row2", "tag_toppers", done=done.append)
+    unit.add("campaign_operation", ["campaign"])
+    unit.add("campaign_criterion_operation", ["bad-negative"], optional=True)
+    plan.unit("row3", "ad group 3", done=done.append).add("ad_group_criterion_operation", ["bad-subdivision"])
+
+    service = batch_jobs.LocalBatchJobService(
+        reject=lambda field, op: "criterion_error.INVALID" if op.startswith("bad") else None
+    )
+    outcome, _ = _submit(service, [plan])
+
+    assert outcome == {"row1": True, "row2": True, "row3": False}
+    assert len(done) == 2
+    assert [failure["item_id"] for failure in run_report.rejected] == ["bad-item"]
+    assert run_report.summary()["rejected_by_error_code"] == {"criterion_error.INVALID": 1}
+
+
+def test_jobs_are_polled_with_backoff_and_rows_stay_open_after_the_timeout(monkeypatch):
+    monkeypatch.setattr(batch_jobs, "POLL_INTERVAL", 10)
+    plan = batch_jobs.BatchPlan("1")
+    plan.unit("row1", "unit").add("f", ["a"])
+    outcome, clock = _submit(batch_jobs.LocalBatchJobService(polls=3), [plan])
+    assert outcome == {"row1": True}
+    assert clock.slept == [10, 20, 40]
+
+    monkeypatch.setattr(batch_jobs, "TIMEOUT", 25)
+    done = []
+    plan = batch_jobs.BatchPlan("1")
+    plan.unit("row1", "unit", done=done.append).add("f", ["a"])
+    outcome, _ = _submit(batch_jobs.LocalBatchJobService(polls=10), [plan])
+    assert outcome == {"row1": False}
+    assert done == []
+
+
+def test_discard_drops_a_half_compiled_row():
+    plan = batch_jobs.BatchPlan("1")
+    plan.unit("row1", "ad group 1").add("f", ["a"])
+    plan.unit("row2", "ad group 2").add("f", ["b", "c"])
+    plan.unit("row2", "tag_toppers").add("f", ["d"])
+    plan.discard("row2")
+    assert plan.operations == [("f", "a")]
+    assert [unit.name for unit in plan.units] == ["ad group 1"]
+
+
+def test_sequence_tokens_are_checked_by_the_stand_in():
+    service = batch_jobs.LocalBatchJobService()
+    job = service.mutate_batch_job(customer_id="1", operation=None).result.resource_name
+    token = service.add_batch_job_operations(resource_name=job, sequence_token=None,
+                                             mutate_operations=[("f", "a")]).next_sequence_token
+    with pytest.raises(ValueError):
+        service.add_batch_job_operations(resource_name=job, sequence_token=None, mutate_operations=[("f", "b")])
+    service.add_batch_job_operations(resource_name=job, sequence_token=token, mutate_operations=[("f", "b")])
+    assert len(service.jobs[job]["operations"]) == 2
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Tests for the checkpoint journal (no Google Ads access needed)"""
+
+import json
+
+from checkpoint import RunJournal, acknowledging, row_key, start_unit
+
+
+class _Result:
+    def __init__(self, resource_name):
+        self.resource_name = resource_name
+
+
+class _Response:
+    def __init__(self, n):
+        self.results = [_Result(f"customers/1/adGroupCriteria/2~{i}") for i in range(n)]
+
+
+class _Service:
+    def mutate_ad_group_criteria(self, customer_id, operations):
+        return _Response(len(operations))
+
+
+class _Client:
+    def get_service(self, name):
+        return _Service()
+
+
+def test_resume_skips_completed_units(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    row = {"row": 5, "shop_id": "123"}
+    key = row_key(row)
+
+    journal = RunJournal.open(path)
+    start_unit()
+    acknowledging(_Client()).get_service("AdGroupCriterionService").mutate_ad_group_criteria(
+        customer_id="1", operations=[1, 2, 3]
+    )
+    journal.unit_done("ad_group_done", key, 111)
+    journal.row_finished({"row": 4, "shop_id": "99"}, success=True)
+    # crash: no run_finished
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[1]["event"] == "ad_group_done"
+    assert records[1]["ops"] == 3
+
+    resumed = RunJournal.open(path, resume=True)
+    assert resumed.run_id == journal.run_id
+    assert resumed.is_done("ad_group_done", key, 111)
+    assert not resumed.is_done("ad_group_done", key, 222)
+    assert "4:99" in resumed.finished_rows
+
+
+def test_finished_run_is_not_resumed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = RunJournal.open(path)
+    journal.unit_done("tag_toppers_done", "1:2")
+    journal.finish()
+
+    # torn line from a crash must not break loading
+    with open(path, "a") as f:
+        f.write('{"run_id": "x", "ev')
+
+    fresh = RunJournal.open(path, resume=True)
+    assert fresh.run_id != journal.run_id
+    assert not fresh.is_done("tag_toppers_done", "1:2")
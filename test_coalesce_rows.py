@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""Tests for merging sheet rows per shop (no Google Ads access needed)"""
+
+from GSD_tagtoppers import coalesce_rows
+
+
+def _row(n, shop_id, domain, item_ids, shop_name="shop.nl"):
+    return {"row": n, "shop_id": shop_id, "shop_name": shop_name, "domain": domain, "item_ids": item_ids}
+
+
+def test_rows_for_same_shop_and_domain_are_merged():
+    merged = coalesce_rows([
+        _row(2, "42", "NL", ["a", "b"]),
+        _row(3, "42", "BE", ["a"]),
+        _row(4, "7", "NL", ["x"]),
+        _row(5, "42", "nl", ["b", "c"], shop_name="Shop.nl"),
+    ])
+
+    assert [(r["row"], r["rows"]) for r in merged] == [(2, [2, 5]), (3, [3]), (4, [4])]
+    assert merged[0]["item_ids"] == ["a", "b", "c"]
+    assert merged[0]["shop_name"] == "Shop.nl"
+
+
+def test_incomplete_rows_are_not_merged():
+    merged = coalesce_rows([_row(2, "", "NL", ["a"]), _row(3, "", "NL", ["b"])])
+    assert [r["rows"] for r in merged] == [[2], [3]]
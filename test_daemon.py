@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Tests for --daemon polling (no Google Ads / Sheets access needed)"""
+
+import os
+import signal
+
+import pytest
+
+import GSD_tagtoppers
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """Runs the daemon against a scripted sheet; stops after the last poll."""
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    # Journal (checkpoints/journal.jsonl) goes to the temporary directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(GSD_tagtoppers.clients, "warm_up", lambda: None)
+    monkeypatch.setattr(GSD_tagtoppers, "wrapped_ads_client", lambda: "ads")
+
+    def run(polls, outcomes, retry_after=0):
+        monkeypatch.setattr(GSD_tagtoppers, "DAEMON_RETRY_AFTER", retry_after)
+        polls = list(polls)
+        processed = []
+
+        def sheet(return_json=False):
+            rows = polls.pop(0)
+            if not polls:
+                os.kill(os.getpid(), signal.SIGTERM)
+            return rows
+
+        def run_rows(ads_client, tag_rows, journal):
+            processed.append([row["row"] for row in tag_rows])
+            unfinished = []
+            for row in tag_rows:
+                if outcomes.get(row["row"], True):
+                    journal.row_finished(row, True)
+                else:
+                    unfinished.append(GSD_tagtoppers.row_key(row))
+            journal.rows_marked([row["row"] for row in tag_rows if outcomes.get(row["row"], True)])
+            return unfinished
+
+        monkeypatch.setattr(GSD_tagtoppers, "get_spreadsheet_input", sheet)
+        monkeypatch.setattr(GSD_tagtoppers, "run_rows", run_rows)
+        try:
+            GSD_tagtoppers.run_daemon(poll_interval=0)
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+        return processed
+
+    return run
+
+
+def _row(n):
+    return {"row": n, "shop_id": str(100 + n), "shop_name": f"shop{n}", "domain": "NL", "item_ids": []}
+
+
+def test_new_rows_are_processed_and_empty_polls_skipped(daemon):
+    processed = daemon([[_row(2)], [], [_row(3), _row(4)]], outcomes={})
+    assert processed == [[2], [3, 4]]
+
+
+def test_failed_rows_wait_for_retry_interval(daemon):
+    processed = daemon([[_row(2)], [_row(2)], [_row(2), _row(3)]], outcomes={2: False}, retry_after=3600)
+    assert processed == [[2], [3]]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Tests for the durable job queue and worker pool (no Google Ads access needed)"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from job_queue import JobQueue, WorkerPool
+
+
+def test_jobs_survive_restart_and_running_jobs_are_requeued(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path)
+    job = queue.submit("42", "shop.nl", "NL", ["a", "b"])
+    assert queue.claim()["id"] == job["id"]
+    queue.close()
+
+    # Server crashed while the job was running
+    queue = JobQueue(path)
+    assert queue.get(job["id"])["status"] == "running"
+    assert queue.requeue_running() == 1
+    claimed = queue.claim()
+    assert claimed["id"] == job["id"]
+    assert claimed["item_ids"] == ["a", "b"]
+    assert claimed["attempts"] == 2
+
+
+def test_one_running_job_per_shop(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    first = queue.submit("42", "shop.nl", "NL", ["a"])
+    second = queue.submit("42", "shop.nl", "NL", ["b"])
+    other = queue.submit("7", "other.nl", "NL", ["c"])
+
+    assert queue.claim()["id"] == first["id"]
+    # Same shop is still running, the other shop is next
+    assert queue.claim()["id"] == other["id"]
+    assert queue.claim() is None
+
+    queue.finish(first["id"], True)
+    assert queue.claim()["id"] == second["id"]
+
+
+def test_worker_pool_records_status_and_latency(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    finished = threading.Semaphore(0)
+
+    def handler(job):
+        try:
+            if job["shop_id"] == "boom":
+                raise ValueError("kapot")
+            return job["shop_id"] == "42"
+        finally:
+            finished.release()
+
+    ok = queue.submit("42", "shop.nl", "NL", ["a"])
+    failed = queue.submit("7", "other.nl", "NL", ["b"])
+    raised = queue.submit("boom", "boom.nl", "NL", [])
+
+    pool = WorkerPool(queue, handler, workers=2)
+    pool.start()
+    for _ in range(3):
+        assert finished.acquire(timeout=5)
+    pool.stop()
+
+    assert queue.get(ok["id"])["status"] == "done"
+    assert queue.get(failed["id"])["status"] == "failed"
+    assert queue.get(raised["id"])["error"] == "ValueError: kapot"
+    stats = queue.stats()
+    assert stats["counts"] == {"done": 1, "failed": 2}
+    assert stats["latency"]["total_s"]["p50"] is not None
+
+
+def test_api_validates_and_reports_jobs(tmp_path):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from job_server import create_app
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    api = TestClient(create_app(queue))
+
+    assert api.post("/jobs", json={"shop_id": "42", "shop_name": "shop.nl", "domain": "FR"}).status_code == 422
+    response = api.post("/jobs", json={"shop_id": "42", "shop_name": "shop.nl", "domain": "nl",
+                                       "item_ids": ["a", "a", " b "]})
+    assert response.status_code == 202
+    job = response.json()
+    assert job["domain"] == "NL" and job["item_ids"] == ["a", "b"]
+    assert api.get(f"/jobs/{job['id']}").json()["status"] == "queued"
+    assert api.get("/jobs/missing").status_code == 404
+    assert api.get("/stats").json()["counts"] == {"queued": 1}
+
+
+def test_concurrent_jobs_keep_their_own_state_and_reports(tmp_path, monkeypatch):
+    import account_state
+    import job_server
+    import tree_cache
+    from partial_failure import run_report
+
+    monkeypatch.setattr(tree_cache, "commit", lambda: None)
+    both_running = threading.Barrier(2)
+    reports = {}
+
+    class _Gsd:
+        """Stands in for GSD_tagtoppers: records state and a rejected Item ID per job."""
+
+        @staticmethod
+        def process_row(client, row, journal, deferred):
+            account_state.state.set_label("1", row["shop_id"], f"label-{row['shop_id']}")
+            run_report.add([{"item_id": row["shop_id"], "error_code": "criterion_error.INVALID"}], 1)
+            both_running.wait(timeout=5)
+            return account_state.state.label("1", "42" if row["shop_id"] == "7" else "7") is None
+
+        @staticmethod
+        def write_run_reports(directory):
+            reports[directory] = [failure["item_id"] for failure in run_report.rejected]
+
+    handler = job_server.ShopJobHandler(journal_path=str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(handler, "_setup", lambda: _Gsd)
+    monkeypatch.setattr(handler, "_journal", SimpleNamespace(row_finished=lambda row, success: None))
+    monkeypatch.setattr(job_server, "JOB_REPORTS_DIR", str(tmp_path))
+
+    results = {}
+    jobs = [{"id": shop_id, "shop_id": shop_id, "shop_name": "s", "domain": "NL", "item_ids": []}
+            for shop_id in ("42", "7")]
+    workers = [threading.Thread(target=lambda job=job: results.setdefault(job["id"], handler(job))) for job in jobs]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert results == {"42": True, "7": True}
+    assert reports == {str(tmp_path / "42"): ["42"], str(tmp_path / "7"): ["7"]}
+    assert run_report.rejected == []
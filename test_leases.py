@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Tests for shop leases in sharded runs (no Google Ads access needed)"""
+
+import multiprocessing
+import time
+
+from leases import LeaseStore
+
+
+def _claim_all(args):
+    path, owner, keys = args
+    store = LeaseStore(owner=owner, path=path, ttl=60)
+    return [key for key in keys if store.claim(key)]
+
+
+def test_lease_is_exclusive_until_done(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    a = LeaseStore(owner="a", path=path, ttl=60)
+    b = LeaseStore(owner="b", path=path, ttl=60)
+
+    assert a.claim("2:42")
+    assert not b.claim("2:42")
+    assert b.states(["2:42", "3:7"]) == {"2:42": "held", "3:7": "free"}
+
+    a.release("2:42", True)
+    assert not b.claim("2:42")
+    assert b.states(["2:42"]) == {"2:42": "done"}
+
+
+def test_failed_and_expired_leases_are_reassigned(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    a = LeaseStore(owner="a", path=path, ttl=0.05, max_attempts=3)
+    b = LeaseStore(owner="b", path=path, ttl=60, max_attempts=3)
+
+    # a dies without heartbeat: b takes over once the lease expired
+    assert a.claim("2:42")
+    time.sleep(0.1)
+    assert a.renew() == 0
+    assert b.claim("2:42")
+
+    # b fails: free again; the third attempt (expired lease counts) is final
+    b.release("2:42", False)
+    assert b.states(["2:42"]) == {"2:42": "free"}
+    assert a.claim("2:42")
+    a.release("2:42", False)
+    assert b.states(["2:42"]) == {"2:42": "failed"}
+    assert not b.claim("2:42")
+
+
+def test_heartbeat_keeps_lease(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    a = LeaseStore(owner="a", path=path, ttl=0.2)
+    b = LeaseStore(owner="b", path=path, ttl=60)
+
+    assert a.claim("2:42")
+    with a.heartbeat(interval=0.05):
+        time.sleep(0.4)
+        assert not b.claim("2:42")
+
+
+def test_workers_in_separate_processes_never_share_a_row(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    LeaseStore(owner="setup", path=path).close()
+    keys = [f"{n}:shop{n}" for n in range(60)]
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        claimed = pool.map(_claim_all, [(path, f"w{n}", keys) for n in range(4)])
+    flat = [key for keys_of_worker in claimed for key in keys_of_worker]
+    assert sorted(flat) == sorted(keys)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Tests for sending temp-ID-linked listing trees (no Google Ads access needed)"""
+
+from types import SimpleNamespace
+
+import listing_tree
+
+
+class _Op:
+    """Shaped like a raw AdGroupCriterionOperation (create)."""
+
+    def __init__(self, name, parent=None):
+        self.create = SimpleNamespace(resource_name=name,
+                                      listing_group=SimpleNamespace(parent_ad_group_criterion=parent))
+
+    def WhichOneof(self, name):
+        return "create"
+
+
+class _Service:
+    def __init__(self):
+        self.requests = []
+
+    def mutate_ad_group_criteria(self, customer_id, operations):
+        self.requests.append([(op.create.resource_name, op.create.listing_group.parent_ad_group_criterion)
+                              for op in operations])
+        return SimpleNamespace(results=[SimpleNamespace(resource_name=op.create.resource_name.replace("-", "real"))
+                                        for op in operations])
+
+
+def _tree(exclusions):
+    structure = [_Op("-1"), _Op("-2", "-1"), _Op("-3", "-1")]
+    return structure + [_Op(f"-{10 + i}", "-3") for i in range(exclusions)], len(structure)
+
+
+def test_a_tree_within_the_limit_is_one_request():
+    service = _Service()
+    operations, structure_count = _tree(5)
+    listing_tree._send_tree_operations(service, "1", operations, structure_count)
+    assert len(service.requests) == 1
+    assert len(service.requests[0]) == 8
+
+
+def test_a_large_tree_sends_its_structure_first_and_the_rest_under_the_created_parents(monkeypatch):
+    monkeypatch.setattr(listing_tree, "MAX_MUTATE_OPERATIONS", 4)
+    service = _Service()
+    operations, structure_count = _tree(6)
+    listing_tree._send_tree_operations(service, "1", operations, structure_count)
+
+    first, *rest = service.requests
+    assert [name for name, _ in first] == ["-1", "-2", "-3", "-10"]
+    assert [len(chunk) for chunk in rest] == [4, 1]
+    assert {parent for chunk in rest for _, parent in chunk} == {"real3"}
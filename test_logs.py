@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Tests for leveled structured logging (no Google Ads access needed)"""
+
+import io
+import json
+
+import logs
+from partial_failure import set_context
+
+
+def test_json_output_with_context_and_extra_fields():
+    stream = io.StringIO()
+    logs.configure(level="INFO", fmt="json", sampling="", stream=stream)
+    try:
+        set_context(row=3, shop_id="42")
+        log = logs.get_logger("tree")
+        log.debug("hidden")
+        log.info("  ✅ Tree updated", extra={"ad_group_id": "7"})
+    finally:
+        set_context()
+        logs.configure()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(records) == 1
+    record = records[0]
+    assert record["level"] == "INFO"
+    assert record["category"] == "tree"
+    assert record["message"] == "✅ Tree updated"
+    assert record["row"] == 3 and record["shop_id"] == "42" and record["ad_group_id"] == "7"
+
+
+def test_sampling_per_category_keeps_warnings():
+    stream = io.StringIO()
+    logs.configure(level="DEBUG", fmt="text", sampling="tree.items=0.1,sheet=0", stream=stream)
+    try:
+        items = logs.get_logger("tree.items")
+        for i in range(100):
+            items.debug(f"item {i}")
+        logs.get_logger("sheet").debug("dropped")
+        logs.get_logger("sheet").warning("kept")
+        logs.get_logger("tree").debug("unsampled")
+    finally:
+        logs.configure()
+
+    lines = stream.getvalue().splitlines()
+    assert len([line for line in lines if line.startswith("item")]) == 10
+    assert "dropped" not in lines
+    assert "kept" in lines and "unsampled" in lines
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Tests for the prefetch pipeline (no Google Ads access needed)"""
+
+import threading
+
+import prefetch
+
+
+def _start(pipeline, rows, window, loader=lambda row: f"tree-{row}"):
+    """Starts a run whose prefetch reads ('tree', '1', row); returns the rows seen and a fetched-event per row."""
+    seen = []
+    fetched = {row: threading.Event() for row in rows}
+
+    def prefetch_row(row):
+        seen.append(row)
+        try:
+            pipeline.fetch(("tree", "1", row), lambda: loader(row))
+        finally:
+            fetched[row].set()
+
+    pipeline.start(rows, prefetch_row, window=window)
+    return seen, fetched
+
+
+def test_window_is_bounded_and_prefetched_values_are_used():
+    pipeline = prefetch.Pipeline()
+    seen, fetched = _start(pipeline, ["r0", "r1", "r2", "r3"], window=2)
+    pipeline.advance(0)
+    assert fetched["r1"].wait(5) and fetched["r2"].wait(5)
+    assert not fetched["r3"].is_set()
+
+    loads = []
+    assert pipeline.take(("tree", "1", "r1"), lambda: loads.append("r1")) == "tree-r1"
+    assert loads == []
+    assert pipeline.hits == 1 and pipeline.misses == 0
+    pipeline.stop()
+    assert sorted(seen) == ["r1", "r2"]
+
+
+def test_mutated_tree_is_not_served_from_prefetch():
+    pipeline = prefetch.Pipeline()
+    _, fetched = _start(pipeline, ["r0", "5"], window=1)
+    pipeline.advance(0)
+    assert fetched["5"].wait(5)
+
+    # What tree_cache.invalidate() calls for a mutated ad group
+    pipeline.invalidate("tree", 1, 5)
+    assert pipeline.take(("tree", "1", "5"), lambda: "fresh") == "fresh"
+    pipeline.stop()
+
+
+def test_failed_prefetch_is_loaded_on_the_main_path():
+    pipeline = prefetch.Pipeline()
+    _, fetched = _start(pipeline, ["r0", "r1"], window=1, loader=lambda row: 1 / 0)
+    pipeline.advance(0)
+    assert fetched["r1"].wait(5)
+    assert pipeline.take(("tree", "1", "r1"), lambda: "retried") == "retried"
+    assert pipeline.misses == 1
+    pipeline.stop()
+
+
+def test_hit_and_miss_counts_are_exact_across_threads():
+    pipeline = prefetch.Pipeline()
+    rows = [f"r{i}" for i in range(9)]
+    _, fetched = _start(pipeline, rows, window=8)
+    pipeline.advance(0)
+    for row in rows[1:]:
+        assert fetched[row].wait(5)
+
+    takers = [threading.Thread(target=pipeline.take, args=(("tree", "1", row), lambda: None)) for row in rows[1:]]
+    takers += [threading.Thread(target=pipeline.take, args=(("campaigns", str(i)), lambda: None)) for i in range(8)]
+    for taker in takers:
+        taker.start()
+    for taker in takers:
+        taker.join()
+    assert (pipeline.hits, pipeline.misses) == (8, 8)
+    pipeline.stop()
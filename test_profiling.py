@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Tests for the opt-in per-unit profiling hooks (no Google Ads access needed)"""
+
+import os
+import pstats
+import threading
+
+import profiling
+
+
+def _busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_nested_units_write_profiles_and_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_run_directory", str(tmp_path))
+    monkeypatch.setattr(profiling, "_results", [])
+    profiling.set_mode("all")
+    try:
+        with profiling.unit("shop", "1_42", shop="shop.nl"):
+            _busy(10_000)
+            with profiling.unit("ad_group", "777"):
+                _busy(50_000)
+    finally:
+        profiling.set_mode("off")
+
+    assert os.path.exists(tmp_path / "ad_group_777.prof")
+    assert os.path.exists(tmp_path / "ad_group_777.alloc.txt")
+
+    # Inner stats are merged into the shop profile
+    shop_stats = pstats.Stats(str(tmp_path / "shop_1_42.prof"))
+    assert any(function == "_busy" and calls == 2
+               for (_, _, function), (_, calls, *_) in shop_stats.stats.items())
+
+    summary = open(profiling.write_summary()).read()
+    assert "Slowest shop units" in summary and "1_42 shop=shop.nl" in summary
+    assert "Slowest ad_group units" in summary
+
+
+def test_disabled_kind_is_noop(monkeypatch):
+    monkeypatch.setattr(profiling, "_results", [])
+    profiling.set_mode("shop")
+    try:
+        with profiling.unit("ad_group", "1"):
+            pass
+    finally:
+        profiling.set_mode("off")
+    assert profiling.write_summary() is None
+
+
+def test_units_overlapping_other_threads_get_no_memory_peak(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_run_directory", str(tmp_path))
+    monkeypatch.setattr(profiling, "_results", [])
+    both_open = threading.Barrier(2)
+
+    def rebuild(name):
+        with profiling.unit("ad_group", name):
+            both_open.wait(timeout=5)
+            _busy(1_000)
+
+    profiling.set_mode("ad_group")
+    try:
+        with profiling.unit("ad_group", "alone"):
+            _busy(1_000)
+        workers = [threading.Thread(target=rebuild, args=(name,)) for name in ("a", "b")]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        profiling.set_mode("off")
+
+    peaks = {r["name"]: r["peak_mb"] for r in profiling._results}
+    assert peaks["alone"] is not None
+    assert peaks["a"] is None and peaks["b"] is None
+    assert "no peak" in open(tmp_path / "ad_group_a.alloc.txt").read()
+    assert "       -  a" in open(profiling.write_summary()).read()
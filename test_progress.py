@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Tests for the progress/ETA display (no Google Ads access needed)"""
+
+import progress
+
+
+def test_render_shows_accounts_in_flight_and_eta(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(progress.time, "monotonic", lambda: clock[0])
+
+    tracker = progress.ProgressTracker()
+    tracker.start({"NL": 3, "BE": 1}, mode="off")
+
+    for _ in range(2):
+        clock[0] += 30
+        tracker.shop_finished("NL")
+    tracker.error()
+
+    with tracker.ad_group(123, "shop.nl/a"):
+        line = tracker.render()
+        assert "shops 2/4 (BE 0/1 NL 2/3)" in line
+        assert "errors 1" in line
+        # 2 completions 30s apart -> 1 shop / 30s -> 2 remaining = 60s
+        assert "ETA 1m00s" in line
+        assert "in flight: shop.nl/a" in line
+
+    assert "in flight" not in tracker.render()
+
+
+def test_eta_unknown_before_first_shop():
+    tracker = progress.ProgressTracker()
+    tracker.start({"NL": 2}, mode="off")
+    assert "ETA ?" in tracker.render()
+
+
+def test_eta_unknown_for_completions_at_the_same_time(monkeypatch):
+    monkeypatch.setattr(progress.time, "monotonic", lambda: 1000.0)
+    tracker = progress.ProgressTracker()
+    tracker.start({"NL": 3}, mode="off")
+    tracker.shop_finished("NL")
+    assert "ETA ?" in tracker.render()
+    tracker.shop_finished("NL")
+    assert "ETA ?" in tracker.render()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Tests for the shared rate governor (no Google Ads access needed)"""
+
+import types
+
+import pytest
+
+import rate_limit
+
+
+def _quota_exception(seconds):
+    error = types.SimpleNamespace(
+        error_code=types.SimpleNamespace(quota_error=types.SimpleNamespace(name="RESOURCE_EXHAUSTED")),
+        details=types.SimpleNamespace(quota_error_details=types.SimpleNamespace(
+            retry_delay=types.SimpleNamespace(seconds=seconds, nanos=500_000_000))),
+    )
+    exc = Exception("quota")
+    exc.failure = types.SimpleNamespace(errors=[error])
+    return exc
+
+
+def test_bucket_waits_in_proportion_to_weight():
+    bucket = rate_limit.TokenBucket(rate=100, burst=100, clock=lambda: 0.0)
+    assert bucket.reserve(100, now=0.0) == 0.0
+    # Bucket empty: 50 operations take half a second
+    assert bucket.reserve(50, now=0.0) == pytest.approx(0.5)
+    # Callers queue behind the debt
+    assert bucket.reserve(1, now=0.0) == pytest.approx(0.51)
+    assert bucket.reserve(1, now=10.0) == 0.0
+
+
+def test_retry_delay_from_quota_error_details():
+    assert rate_limit.retry_delay(_quota_exception(3)) == pytest.approx(3.5)
+    assert rate_limit.retry_delay(ValueError("other")) is None
+
+
+def test_quota_errors_are_retried_and_slow_down_all_callers(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limit.time, "sleep", sleeps.append)
+    governor = rate_limit.Governor(requests_per_second=0, operations_per_second=1000, max_retries=2)
+    calls = []
+
+    def mutate(operations):
+        calls.append(len(operations))
+        if len(calls) == 1:
+            raise _quota_exception(0)
+        return "ok"
+
+    assert governor.call(mutate, 10, [1] * 10) == "ok"
+    assert calls == [10, 10]
+    assert governor.throttled == 1
+    assert sleeps and sleeps[-1] == pytest.approx(0.5, abs=0.05)
+    assert governor.operations.rate == pytest.approx(1000 * (0.5 + rate_limit._RECOVERY_STEP))
+
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(rate_limit.time, "sleep", lambda seconds: None)
+    governor = rate_limit.Governor(requests_per_second=0, operations_per_second=0, max_retries=1)
+
+    def mutate():
+        raise _quota_exception(0)
+
+    with pytest.raises(Exception, match="quota"):
+        governor.call(mutate, 1)
+    assert governor.throttled == 1
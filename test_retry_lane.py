@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Tests for the deferred retry lane (no Google Ads access needed)"""
+
+import contextvars
+from types import SimpleNamespace
+
+import retry_lane
+from partial_failure import StructuralOperationError
+
+_shop = contextvars.ContextVar("shop", default=None)
+
+
+class _AdsError(Exception):
+    """Shaped like GoogleAdsException: ``failure.errors[].error_code``."""
+
+    def __init__(self, field, name):
+        super().__init__(name)
+        code = SimpleNamespace(**{field: SimpleNamespace(name=name)})
+        self.failure = SimpleNamespace(errors=[SimpleNamespace(error_code=code)])
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _queue(clock, max_attempts=3):
+    return retry_lane.DeferredQueue(max_attempts=max_attempts, clock=clock, sleep=clock.sleep)
+
+
+def test_transient_errors_are_recognised():
+    assert retry_lane.is_transient(_AdsError("database_error", "CONCURRENT_MODIFICATION"))
+    assert retry_lane.is_transient(_AdsError("internal_error", "TRANSIENT_ERROR"))
+    assert not retry_lane.is_transient(_AdsError("criterion_error", "INVALID_LISTING_GROUP_HIERARCHY"))
+    assert not retry_lane.is_transient(ValueError("boom"))
+
+    transient = [{"error_code": "database_error.CONCURRENT_MODIFICATION"}]
+    mixed = transient + [{"error_code": "criterion_error.LISTING_GROUP_SUBDIVISION_REQUIRES_OTHERS_CASE"}]
+    assert retry_lane.is_transient(StructuralOperationError(transient))
+    assert not retry_lane.is_transient(StructuralOperationError(mixed))
+
+
+def test_unit_is_retried_after_its_backoff_in_its_own_context():
+    clock = _Clock()
+    deferred = _queue(clock)
+    seen = []
+    _shop.set("shop-a")
+    deferred.defer("row1", "unit", lambda: seen.append(_shop.get()))
+    _shop.set(None)
+
+    assert deferred.pending("row1")
+    assert deferred.run_due() == []   # backoff not over yet
+    clock.now = retry_lane.backoff(0)
+    assert deferred.run_due() == ["row1"]
+    assert seen == ["shop-a"]
+    assert not deferred.pending("row1") and not deferred.failed("row1")
+    assert deferred.recovered == 1
+
+
+def test_transient_failures_back_off_until_the_attempts_run_out():
+    clock = _Clock()
+    deferred = _queue(clock, max_attempts=3)
+    calls = []
+
+    def unit():
+        calls.append(clock.now)
+        raise _AdsError("database_error", "CONCURRENT_MODIFICATION")
+
+    deferred.defer("row1", "unit", unit)
+    assert deferred.drain() == ["row1"]
+    assert len(calls) == 3
+    assert clock.slept == [retry_lane.backoff(0), retry_lane.backoff(1), retry_lane.backoff(2)]
+    assert deferred.failed("row1") and deferred.recovered == 0
+
+
+def test_permanent_errors_and_false_results_fail_the_row_at_once():
+    clock = _Clock()
+    deferred = _queue(clock)
+    calls = []
+
+    def permanent():
+        calls.append(1)
+        raise _AdsError("criterion_error", "INVALID_LISTING_GROUP_HIERARCHY")
+
+    deferred.defer("row1", "unit", permanent)
+    deferred.defer("row2", "unit", lambda: False)
+    assert sorted(deferred.drain()) == ["row1", "row2"]
+    assert calls == [1]
+    assert deferred.failed("row1") and deferred.failed("row2")
+
+
+def test_row_settles_when_its_last_unit_is_resolved():
+    clock = _Clock()
+    deferred = _queue(clock)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _AdsError("internal_error", "INTERNAL_ERROR")
+        return True
+
+    deferred.defer("row1", "ad group 1", lambda: True)
+    deferred.defer("row1", "ad group 2", flaky)
+    deferred.defer("row2", "tag_toppers", lambda: True)
+
+    clock.now = retry_lane.backoff(0)
+    # row1 still has the failed ad group 2 waiting for its second backoff
+    assert deferred.run_due() == ["row2"]
+    assert deferred.pending("row1") and len(deferred) == 1
+    assert deferred.drain() == ["row1"]
+    assert not deferred.failed("row1")
+    assert deferred.deferred == 3 and deferred.recovered == 3
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Tests for the concurrent ad-group scheduler (no Google Ads access needed)"""
+
+import contextvars
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+_shop = contextvars.ContextVar("shop", default=None)
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def task(n):
+        return lambda: (barrier.wait(), n)[1]
+
+    # Deadlocks (BrokenBarrierError) unless all three run at the same time
+    assert scheduler.run_all([([f"ad_group:1:{n}"], task(n)) for n in range(3)], workers=3) == [0, 1, 2]
+
+
+def test_tasks_on_the_same_resource_are_serialised():
+    active = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def task():
+        with lock:
+            active.append(1)
+            overlaps.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.pop()
+
+    scheduler.run_all([(["ad_group:1:7"], task) for _ in range(4)], workers=4)
+    assert overlaps == [1, 1, 1, 1]
+
+
+def test_tasks_inherit_context_and_errors_are_raised():
+    _shop.set("42")
+
+    def failing():
+        raise ValueError("kapot")
+
+    assert scheduler.run_all([(["a"], _shop.get), (["b"], _shop.get)], workers=2) == ["42", "42"]
+    with pytest.raises(ValueError):
+        scheduler.run_all([(["a"], _shop.get), (["b"], failing)], workers=2)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Tests for the per-phase tracing spans (no Google Ads access needed)"""
+
+import json
+
+import tracing
+
+
+class _Service:
+    def mutate_ad_group_criteria(self, customer_id, operations):
+        return len(operations)
+
+
+class _Client:
+    def get_service(self, name):
+        return _Service()
+
+
+def test_spans_inherit_attributes_and_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "_events", [])
+    tracing.set_enabled(True)
+    try:
+        client = tracing.traced_client(_Client())
+        with tracing.span("shop", shop_id="42"):
+            with tracing.span("label_ad_group", ad_group=7):
+                client.get_service("AdGroupCriterionService").mutate_ad_group_criteria(
+                    customer_id="1", operations=[1, 2, 3]
+                )
+            planning = tracing.start_span("tree_planning")
+            planning.end()
+    finally:
+        tracing.set_enabled(False)
+
+    by_name = {e["name"]: e for e in tracing.events()}
+    mutate = by_name["AdGroupCriterionService.mutate_ad_group_criteria"]
+    assert mutate["cat"] == "mutate"
+    assert mutate["args"] == {"shop_id": "42", "ad_group": 7, "ops": 3}
+    assert by_name["tree_planning"]["args"] == {"shop_id": "42"}
+
+    path = tracing.write(str(tmp_path))
+    with open(path) as f:
+        trace = json.load(f)
+    assert len([e for e in trace["traceEvents"] if e["ph"] == "X"]) == 4
+    assert "label_ad_group" in tracing.summary_table()
+
+
+def test_disabled_tracing_records_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, "_events", [])
+    tracing.set_enabled(False)
+    client = _Client()
+    assert tracing.traced_client(client) is client
+    with tracing.span("shop"):
+        tracing.sleep(0)
+    assert tracing.events() == []
+    assert tracing.write() is None
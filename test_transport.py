@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Tests for the service-handle registry and transport tunables (no Google Ads access needed)"""
+
+import transport
+
+
+class _Client:
+    def __init__(self):
+        self.built = []
+
+    def get_service(self, name, version=None, interceptors=None):
+        self.built.append((name, version, tuple(interceptors or ())))
+        return object()
+
+
+def test_one_handle_per_service_and_version():
+    transport.registry.clear()
+    raw = _Client()
+    client = transport._RegisteredClient(raw, ["tuning"])
+
+    first = client.get_service("GoogleAdsService")
+    assert client.get_service("GoogleAdsService") is first
+    assert client.get_service("GoogleAdsService", version="v17") is not first
+    client.get_service("AdGroupCriterionService")
+    assert raw.built == [
+        ("GoogleAdsService", None, ("tuning",)),
+        ("GoogleAdsService", "v17", ("tuning",)),
+        ("AdGroupCriterionService", None, ("tuning",)),
+    ]
+
+    # Call-specific interceptors get their own handle
+    assert client.get_service("GoogleAdsService", interceptors=["extra"]) is not first
+    assert raw.built[-1] == ("GoogleAdsService", None, ("tuning", "extra"))
+
+
+def test_channel_options_override_library_defaults():
+    library = [("grpc.max_metadata_size", 16), ("grpc.max_receive_message_length", 1)]
+    merged = dict(transport.merge_options(library, transport.channel_options()))
+    assert merged["grpc.max_metadata_size"] == 16
+    assert merged["grpc.max_receive_message_length"] == transport.MAX_MESSAGE_MB * 1024 * 1024
+    assert "grpc.keepalive_time_ms" in merged
+
+
+def test_call_deadline_per_method_kind():
+    mutate = "/google.ads.googleads.v17.services.AdGroupCriterionService/MutateAdGroupCriteria"
+    search = "/google.ads.googleads.v17.services.GoogleAdsService/Search"
+    assert transport.call_deadline(mutate) == transport.MUTATE_DEADLINE
+    assert transport.call_deadline(search) == transport.SEARCH_DEADLINE
+    assert transport.call_deadline(search, timeout=5) == 5
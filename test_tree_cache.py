@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Tests for the change_status-validated tree cache (no Google Ads access needed)"""
+
+import datetime
+import re
+import threading
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import proto_fast
+import tree_cache
+
+
+class _Row:
+    """Shaped like a raw GoogleAdsRow: serializes to and from bytes."""
+
+    def __init__(self, data=b""):
+        self.data = data
+
+    def SerializeToString(self):
+        return self.data
+
+    @classmethod
+    def FromString(cls, data):
+        return cls(data)
+
+
+class _Ads:
+    """Fake GoogleAdsService: account time zone, change_status and listing trees."""
+
+    def __init__(self, changed=()):
+        self.changed = list(changed)
+        self.tree_reads = []
+        self.version = 1
+
+    def search(self, customer_id, query):
+        if "FROM customer" in query:
+            return [SimpleNamespace(customer=SimpleNamespace(time_zone="Europe/Amsterdam"))]
+        if "FROM change_status" in query:
+            return [SimpleNamespace(change_status=SimpleNamespace(ad_group=f"customers/{customer_id}/adGroups/{ad_group}"))
+                    for ad_group in self.changed]
+        ad_group = re.search(r"adGroups/(\d+)", query).group(1)
+        self.tree_reads.append(ad_group)
+        return [_Row(f"{ad_group}:{self.version}".encode())]
+
+
+class _Client:
+    def __init__(self, ads):
+        self.ads = ads
+
+    def get_service(self, name):
+        return self.ads
+
+    def get_type(self, name):
+        return _Row()
+
+
+@pytest.fixture(autouse=True)
+def _cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tree_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tree_cache, "ENABLED", True)
+    monkeypatch.setattr(proto_fast, "RAW_PROTO", True)
+    tree_cache._synced.clear()
+    yield
+    tree_cache._synced.clear()
+
+
+def _read(client, ad_group_id):
+    query = f"SELECT ad_group_criterion.resource_name FROM ad_group_criterion WHERE ad_group = 'customers/1/adGroups/{ad_group_id}'"
+    return [row.data for row in tree_cache.read_tree(client, "1", ad_group_id, query)]
+
+
+def _new_run(client):
+    tree_cache.commit()
+    client.ads.tree_reads.clear()
+
+
+def test_sync_with_changed_ad_groups_does_not_deadlock():
+    client = _Client(_Ads())
+    _read(client, "5")
+    _new_run(client)
+    client.ads.changed = ["5"]
+
+    reader = threading.Thread(target=_read, args=(client, "5"), daemon=True)
+    reader.start()
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+    assert client.ads.tree_reads == ["5"]
+
+
+def test_unchanged_ad_groups_are_served_from_the_cache():
+    client = _Client(_Ads())
+    assert _read(client, "5") == [b"5:1"]
+    assert _read(client, "5") == [b"5:1"]
+    assert client.ads.tree_reads == ["5"]
+
+    _new_run(client)
+    client.ads.version = 2
+    assert _read(client, "5") == [b"5:1"]
+    assert client.ads.tree_reads == []
+
+
+def test_changed_ad_groups_are_read_again():
+    client = _Client(_Ads())
+    _read(client, "5")
+    _read(client, "6")
+    _new_run(client)
+    client.ads.changed = ["6"]
+    client.ads.version = 2
+    assert _read(client, "5") == [b"5:1"]
+    assert _read(client, "6") == [b"6:2"]
+    assert client.ads.tree_reads == ["6"]
+
+
+def test_old_syncs_and_too_many_changes_fall_back_to_full_reads(monkeypatch):
+    client = _Client(_Ads())
+    _read(client, "5")
+    _new_run(client)
+    # Older than the change history the API keeps
+    tree_cache._write_json(tree_cache._sync_path("1"), {"last_sync": "2000-01-01 00:00:00",
+                                                         "time_zone": "Europe/Amsterdam"})
+    _read(client, "5")
+    assert client.ads.tree_reads == ["5"]
+
+    _new_run(client)
+    monkeypatch.setattr(tree_cache, "_CHANGE_STATUS_LIMIT", 2)
+    client.ads.changed = ["7", "8"]
+    _read(client, "5")
+    assert client.ads.tree_reads == ["5"]
+
+
+def test_sync_time_is_only_stored_by_commit():
+    client = _Client(_Ads())
+    _read(client, "5")
+    assert tree_cache._read_json(tree_cache._sync_path("1")) is None
+
+    # Crashed run: no commit, the next run finds no sync and reads everything again
+    tree_cache._synced.clear()
+    client.ads.tree_reads.clear()
+    _read(client, "5")
+    assert client.ads.tree_reads == ["5"]
+
+    tree_cache.commit()
+    committed = tree_cache._read_json(tree_cache._sync_path("1"))
+    assert committed["last_sync"] and committed["time_zone"] == "Europe/Amsterdam"
+
+
+def test_failed_change_status_query_keeps_the_last_sync(monkeypatch):
+    yesterday = datetime.datetime.now(ZoneInfo("Europe/Amsterdam")) - datetime.timedelta(days=1)
+    last_sync = {"last_sync": yesterday.strftime(tree_cache._DATE_FORMAT), "time_zone": "Europe/Amsterdam"}
+    tree_cache._write_json(tree_cache._sync_path("1"), last_sync)
+
+    def unavailable(*args):
+        raise RuntimeError("change_status unavailable")
+
+    monkeypatch.setattr(tree_cache, "_changed_ad_groups", unavailable)
+    client = _Client(_Ads())
+    _read(client, "5")
+    tree_cache.commit()
+    assert tree_cache._read_json(tree_cache._sync_path("1")) == last_sync
+
+
+def test_a_slow_customer_sync_does_not_block_other_customers(monkeypatch):
+    release = threading.Event()
+    original = tree_cache._changed_ad_groups
+
+    def changed_ad_groups(client, customer_id, since, until):
+        if customer_id == "1":
+            release.wait(timeout=5)
+        return original(client, customer_id, since, until)
+
+    monkeypatch.setattr(tree_cache, "_changed_ad_groups", changed_ad_groups)
+    client = _Client(_Ads())
+    for customer_id in ("1", "2"):
+        tree_cache._write_json(tree_cache._sync_path(customer_id), {
+            "last_sync": datetime.datetime.now(ZoneInfo("Europe/Amsterdam")).strftime(tree_cache._DATE_FORMAT),
+            "time_zone": "Europe/Amsterdam",
+        })
+
+    slow = threading.Thread(target=tree_cache._sync_customer, args=(client, "1"), daemon=True)
+    slow.start()
+    try:
+        assert tree_cache._sync_customer(client, "2")["valid"]
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join(timeout=5)
+    assert tree_cache._synced["1"]["valid"]
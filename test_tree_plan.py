@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Tests for the pure listing-tree planner (no Google Ads access needed)"""
+
+import tree_plan
+
+ROOT = "customers/1/adGroupCriteria/2~1"
+
+
+def node(res_id, parent_id=None, type_="UNIT", dimension=None, index=None, value=None, negative=False, bid=0):
+    has_case_value = dimension is not None and (index is not None or bool(value))
+    return {
+        "resource_name": f"customers/1/adGroupCriteria/2~{res_id}",
+        "type": type_,
+        "parent": f"customers/1/adGroupCriteria/2~{parent_id}" if parent_id else None,
+        "dimension": dimension,
+        "index": index,
+        "value": value,
+        "has_case_value": has_case_value,
+        "case_value": f"{dimension}:{index}:{value}".encode() if dimension else None,
+        "negative": negative,
+        "bid_micros": bid,
+    }
+
+
+def label_tree(*children):
+    """ROOT -> INDEX0 'a' subdivision (+ INDEX0 OTHERS negative) -> ``children``."""
+    return [
+        node(1, type_="SUBDIVISION"),
+        node(2, 1, "SUBDIVISION", "product_custom_attribute", "INDEX0", "a"),
+        node(3, 1, "UNIT", "product_custom_attribute", "INDEX0", "", negative=True),
+        *children,
+    ]
+
+
+def test_existing_item_id_level_only_gets_exclusions():
+    nodes = label_tree(
+        node(4, 2, dimension="product_item_id", value="", bid=300_000),
+        node(5, 2, dimension="product_item_id", value="old", negative=True),
+    )
+    plan = tree_plan.plan_label_tree(nodes, "a", ["x", "y", "x"], 200_000)
+
+    assert plan["status"] == "ok"
+    assert plan["item_ids"] == ["x", "y"]
+    assert plan["steps"] == [{
+        "kind": "item_ids", "parent": nodes[1]["resource_name"], "parent_ref": None,
+        "add_others": False, "bid_micros": 200_000, "item_ids": ["x", "y"],
+    }]
+    assert plan["subdivisions"] == 1
+
+
+def test_empty_subdivision_gets_item_id_others_and_exclusions():
+    nodes = [node(1, type_="SUBDIVISION")]
+    plan = tree_plan.plan_label_tree(nodes, "a", ["x"])
+    assert plan["steps"][0]["add_others"] is True
+    assert plan["steps"][0]["parent"] == ROOT
+
+
+def test_positive_custom_label_units_are_converted_in_one_rebuild():
+    nodes = label_tree(
+        node(4, 2, dimension="product_custom_attribute", index="INDEX4", value="", bid=250_000),
+        node(5, 2, dimension="product_custom_attribute", index="INDEX4", value="sale", negative=True),
+    )
+    plan = tree_plan.plan_label_tree(nodes, "a", ["x", "y"])
+
+    assert [s["kind"] for s in plan["steps"]] == ["rebuild"]
+    operations = plan["steps"][0]["operations"]
+    removes = [op["resource_name"] for op in operations if op["op"] == "remove"]
+    # Whole tree removed, children before parents
+    assert sorted(removes) == sorted(n["resource_name"] for n in nodes)
+    assert removes.index(nodes[3]["resource_name"]) < removes.index(nodes[1]["resource_name"])
+    assert removes[-1] == ROOT
+
+    creates = [op for op in operations if op["op"] != "remove"]
+    assert [op["op"] for op in creates] == [
+        "subdivision",          # ROOT
+        "subdivision",          # INDEX0 'a'
+        "subdivision",          # INDEX4 OTHERS, was a UNIT
+        "item_id_others",
+        "item_id_exclusions",
+        "unit",                 # INDEX4 'sale' exclusion, preserved
+        "unit",                 # INDEX0 OTHERS negative
+    ]
+    root, label, converted, others, exclusions, sale, label_others = creates
+    assert root["parent_ref"] is None and root["case_value"] is None
+    assert label["parent_ref"] == root["ref"]
+    assert converted["parent_ref"] == label["ref"] and converted["case_value"] == nodes[3]["case_value"]
+    assert others["parent_ref"] == converted["ref"] and others["bid_micros"] == 250_000
+    assert exclusions == {"op": "item_id_exclusions", "parent_ref": converted["ref"], "item_ids": ["x", "y"]}
+    assert sale["negative"] is True and sale["parent_ref"] == label["ref"]
+    assert label_others["parent_ref"] == root["ref"]
+    assert plan["custom_label_structures"] == [
+        {"index": "INDEX4", "value": "sale", "negative": True, "bid_micros": 0},
+    ]
+
+
+def test_item_id_steps_after_a_rebuild_point_to_the_recreated_subdivision():
+    nodes = [
+        node(1, type_="SUBDIVISION"),
+        node(2, 1, "SUBDIVISION", "product_custom_attribute", "INDEX0", "a"),
+        node(3, 1, "SUBDIVISION", "product_custom_attribute", "INDEX0", ""),
+        node(4, 2, dimension="product_custom_attribute", index="INDEX4", value="", bid=1),
+        node(5, 2, dimension="product_custom_attribute", index="INDEX4", value="v", negative=True),
+        node(6, 3, dimension="product_item_id", value="", bid=1),
+    ]
+    plan = tree_plan.plan_label_tree(nodes, "a", ["x"])
+
+    rebuild, item_ids = plan["steps"]
+    assert rebuild["kind"] == "rebuild" and rebuild["targets"] == 1
+    copy_of_3 = [op for op in rebuild["operations"] if op.get("case_value") == nodes[2]["case_value"]][0]
+    assert item_ids["parent"] == nodes[2]["resource_name"]
+    assert item_ids["parent_ref"] == copy_of_3["ref"]
+    assert item_ids["add_others"] is False
+
+
+def test_no_subdivisions_and_empty_trees_are_reported():
+    assert tree_plan.plan_label_tree([], "a", ["x"])["status"] == "empty"
+    assert tree_plan.plan_label_tree([node(1)], "a", ["x"])["status"] == "no_subdivisions"
+
+
+def test_nothing_to_add_is_a_warning_not_a_step():
+    nodes = label_tree(node(4, 2, dimension="product_item_id", value="", bid=1))
+    plan = tree_plan.plan_label_tree(nodes, "a", [])
+    assert plan["steps"] == []
+    assert plan["subdivisions"] == 1
+    assert len(plan["warnings"]) == 1
+
+
+def test_plan_many_on_the_process_pool_matches_in_process_plans(monkeypatch):
+    monkeypatch.setattr(tree_plan, "PROCESSES", 2)
+    monkeypatch.setattr(tree_plan, "POOL_MIN_NODES", 0)
+    jobs = [
+        (label_tree(node(4, 2, dimension="product_item_id", value="", bid=1)), "a", [str(i) for i in range(50)], 1),
+        (label_tree(node(4, 2, dimension="product_custom_attribute", index="INDEX4", value="", bid=1)), "b", ["x"], 1),
+    ]
+    try:
+        assert tree_plan.plan_many(jobs) == [tree_plan.plan_label_tree(*job) for job in jobs]
+        assert tree_plan.plan(*jobs[0]) == tree_plan.plan_label_tree(*jobs[0])
+    finally:
+        tree_plan.shutdown()
+
+
+def inclusion_tree(*units):
+    """ROOT -> negative Item-ID OTHERS + ``units``."""
+    return [
+        node(1, type_="SUBDIVISION"),
+        node(2, 1, dimension="product_item_id", value="", negative=True),
+        *units,
+    ]
+
+
+def test_inclusion_tree_diff_adds_removes_and_rebids():
+    nodes = inclusion_tree(
+        node(3, 1, dimension="product_item_id", value="keep", bid=200_000),
+        node(4, 1, dimension="product_item_id", value="Gone", bid=200_000),
+        node(5, 1, dimension="product_item_id", value="rebid", bid=300_000),
+        node(6, 1, dimension="product_item_id", value="KEEP", bid=200_000),
+    )
+    plan = tree_plan.plan_inclusion_tree(nodes, ["keep", "rebid", "new", "new"], 200_000)
+
+    assert plan["status"] == "ok"
+    assert plan["root"] == ROOT
+    assert plan["add"] == ["new"]
+    # Item IDs compare case-insensitively, so the second 'KEEP' is a duplicate
+    assert plan["remove"] == [nodes[3]["resource_name"], nodes[5]["resource_name"]]
+    assert plan["bids"] == {nodes[4]["resource_name"]: 200_000}
+    assert plan["unchanged"] == 1
+
+
+def test_unchanged_inclusion_tree_needs_no_operations():
+    nodes = inclusion_tree(node(3, 1, dimension="product_item_id", value="x", bid=200_000))
+    plan = tree_plan.plan_inclusion_tree(nodes, ["x"], 200_000)
+    assert (plan["add"], plan["remove"], plan["bids"]) == ([], [], {})
+
+
+def test_other_tree_structures_are_rebuilt():
+    assert tree_plan.plan_inclusion_tree([], ["x"])["status"] == "empty"
+    # positive OTHERS, a non-Item-ID OTHERS, a label tree and a negative Item-ID unit are no inclusion trees
+    positive_others = [node(1, type_="SUBDIVISION"), node(2, 1, dimension="product_item_id", value="", bid=1)]
+    label_others = [
+        node(1, type_="SUBDIVISION"),
+        node(2, 1, dimension="product_custom_attribute", index="INDEX0", value="", negative=True),
+        node(3, 1, dimension="product_item_id", value="x"),
+    ]
+    negative_unit = inclusion_tree(node(3, 1, dimension="product_item_id", value="x", negative=True))
+    for nodes in (positive_others, label_others, label_tree(), negative_unit):
+        plan = tree_plan.plan_inclusion_tree(nodes, ["x"])
+        assert plan["status"] == "rebuild"
+        assert plan["root"] == ROOT
@@ -0,0 +1,270 @@
+"""
+Lightweight per-phase tracing, exported as Chrome/Perfetto trace events.
+
+Enable with ``TAGTOPPERS_TRACE=1`` or ``--trace``. Every phase of a run
+(sheet read, campaign lookup, tree read, tree planning, mutates, sleeps,
+Redshift lookups, write-back) is recorded as a span; API calls are recorded
+by the ``traced_client`` wrapper. Attributes of enclosing spans (shop,
+customer, ad group) are inherited by nested spans, so every API call carries
+the shop it was made for.
+
+At the end of a run ``write()`` stores ``reports/trace_<timestamp>.json``
+(open it in https://ui.perfetto.dev or chrome://tracing) and
+``summary_table()`` returns a per-phase latency table.
+
+When tracing is disabled ``span()`` returns a shared no-op context manager and
+``traced_client`` returns the client unchanged, so the overhead is one flag
+check per span.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+ENABLED = os.getenv("TAGTOPPERS_TRACE", "").strip().lower() in {"1", "true", "yes"}
+
+# Attributes inherited from enclosing spans
+_attributes = contextvars.ContextVar("trace_attributes", default={})
+
+_events = []
+_events_lock = threading.Lock()
+# Events of the job being processed in this context (job API), see scoped()
+_job_events = contextvars.ContextVar("trace_job_events", default=None)
+_origin = time.perf_counter()
+_pid = os.getpid()
+
+
+def set_enabled(enabled: bool):
+    """Turns tracing on or off for the current process."""
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def _now_us() -> float:
+    return (time.perf_counter() - _origin) * 1_000_000
+
+
+class _Span:
+    __slots__ = ("name", "category", "attributes", "_start", "_token")
+
+    def __init__(self, name, category, attributes):
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Adds attributes known only inside the span (e.g. op count of a plan)."""
+        self.attributes.update(attributes)
+
+    def start(self):
+        self.attributes = {**_attributes.get(), **self.attributes}
+        self._token = None
+        self._start = _now_us()
+        return self
+
+    def end(self, exc_type=None):
+        """Records the span (for spans started with ``start_span``)."""
+        end = _now_us()
+        args = {k: v if isinstance(v, (int, float, bool)) or v is None else str(v)
+                for k, v in self.attributes.items()}
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        event = {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": round(self._start, 1),
+            "dur": round(end - self._start, 1),
+            "pid": _pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with _events_lock:
+            _sink().append(event)
+
+    def __enter__(self):
+        self.start()
+        self._token = _attributes.set(self.attributes)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _attributes.reset(self._token)
+        self.end(exc_type)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, exc_type=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, category="phase", **attributes):
+    """
+    Context manager recording one span.
+
+        with tracing.span("tree_read", ad_group=ad_group_id) as s:
+            ...
+            s.set(rows=len(rows))
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, category, attributes)
+
+
+def start_span(name, category="phase", **attributes):
+    """
+    Starts a span that is ended explicitly with ``.end()``, for phases that
+    don't map onto a single block. Spans that are never ended (early return)
+    are not recorded; nested spans don't inherit its attributes.
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, category, attributes).start()
+
+
+def sleep(seconds):
+    """time.sleep that shows up as a 'sleep' span."""
+    if not ENABLED:
+        time.sleep(seconds)
+        return
+    with _Span("sleep", "sleep", {"seconds": seconds}):
+        time.sleep(seconds)
+
+
+# ---- API calls ----
+
+def _operation_count(args, kwargs):
+    operations = kwargs.get("operations")
+    if operations is None and kwargs.get("request") is not None:
+        operations = getattr(kwargs["request"], "operations", None)
+    if operations is None and len(args) > 1:
+        operations = args[1]
+    try:
+        return len(operations) if operations is not None else None
+    except TypeError:
+        return None
+
+
+class _TracedService:
+    def __init__(self, service, service_name):
+        self._service = service
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not (name.startswith("mutate") or name.startswith("search")):
+            return attr
+
+        span_name = f"{self._service_name}.{name}"
+        category = "mutate" if name.startswith("mutate") else "search"
+
+        def call(*args, **kwargs):
+            if not ENABLED:
+                return attr(*args, **kwargs)
+            attributes = {}
+            if category == "mutate":
+                attributes["ops"] = _operation_count(args, kwargs)
+            with _Span(span_name, category, attributes):
+                return attr(*args, **kwargs)
+        return call
+
+
+class _TracedClient:
+    def __init__(self, client):
+        self._client = client
+
+    def get_service(self, name, *args, **kwargs):
+        return _TracedService(self._client.get_service(name, *args, **kwargs), name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def traced_client(client):
+    """Wraps a GoogleAdsClient so every search/mutate call is recorded as a span."""
+    if not ENABLED:
+        return client
+    return _TracedClient(client)
+
+
+# ---- export ----
+
+def _sink():
+    events = _job_events.get()
+    return _events if events is None else events
+
+
+@contextlib.contextmanager
+def scoped():
+    """Records the spans of the block (one job) separately; write() inside it writes only those."""
+    token = _job_events.set([])
+    try:
+        yield
+    finally:
+        _job_events.reset(token)
+
+
+def events():
+    with _events_lock:
+        return list(_sink())
+
+
+def reset():
+    """Drops the recorded events (daemon mode: one trace per poll cycle)."""
+    with _events_lock:
+        _sink().clear()
+
+
+def write(directory="reports"):
+    """Writes the trace-event JSON for this run and returns the path (None when disabled/empty)."""
+    recorded = events()
+    if not recorded:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"trace_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    metadata = [{"name": "process_name", "ph": "M", "pid": _pid, "args": {"name": "GSD tag-toppers"}}]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + recorded, "displayTimeUnit": "ms"}, f)
+    return path
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summary_table():
+    """Per-span-name latency table (count, total, mean, p50, p95, max)."""
+    durations = {}
+    for event in events():
+        durations.setdefault((event["cat"], event["name"]), []).append(event["dur"] / 1000)
+    if not durations:
+        return ""
+
+    lines = [f"{'category':<8} {'span':<48}{'count':>7}{'total s':>10}{'mean ms':>10}"
+             f"{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for (category, name), values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        lines.append(
+            f"{category:<8} {name[:47]:<48}{len(values):>7}{sum(values) / 1000:>10.2f}"
+            f"{sum(values) / len(values):>10.1f}{_percentile(values, 0.5):>10.1f}"
+            f"{_percentile(values, 0.95):>10.1f}{values[-1]:>10.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,194 @@
+"""
+gRPC transport tuning and a shared service-handle registry.
+
+``GoogleAdsClient.get_service()`` builds a new gRPC channel and service
+client on every call, and the code calls it per function (sometimes per
+item). ``registered_client(client)`` returns a client whose ``get_service``
+hands out one service handle per (service, version) per process. Every
+service therefore keeps a single channel with its HTTP/2 connection, TLS
+session and auth state.
+
+Transport tunables (environment):
+
+    TAGTOPPERS_GRPC_COMPRESSION     gzip | none            (default gzip)
+    TAGTOPPERS_GRPC_KEEPALIVE_S     keepalive ping interval (default 30)
+    TAGTOPPERS_GRPC_MAX_MESSAGE_MB  max send/receive size   (default 64)
+    TAGTOPPERS_GRPC_SEARCH_DEADLINE per-call deadline for searches (default 300 s)
+    TAGTOPPERS_GRPC_MUTATE_DEADLINE per-call deadline for mutates  (default 120 s)
+
+Compression and deadlines are set by a client interceptor on every call,
+through the ``interceptors`` argument of ``get_service``. A call that already
+has a shorter deadline keeps it. The channel options, keepalive and message
+size, are merged into the channel options the google-ads library uses for the
+channels it creates, because the library has no public setting for them.
+
+``bench_transport.py`` measures the per-call overhead of a new channel per
+call versus a shared, tuned channel on a local gRPC stand-in server.
+"""
+
+import collections
+import os
+import threading
+
+import logs
+
+log = logs.get_logger("transport")
+
+COMPRESSION = os.getenv("TAGTOPPERS_GRPC_COMPRESSION", "gzip").strip().lower()
+KEEPALIVE_S = float(os.getenv("TAGTOPPERS_GRPC_KEEPALIVE_S", "30"))
+MAX_MESSAGE_MB = int(os.getenv("TAGTOPPERS_GRPC_MAX_MESSAGE_MB", "64"))
+SEARCH_DEADLINE = float(os.getenv("TAGTOPPERS_GRPC_SEARCH_DEADLINE", "300"))
+MUTATE_DEADLINE = float(os.getenv("TAGTOPPERS_GRPC_MUTATE_DEADLINE", "120"))
+
+
+def channel_options():
+    """gRPC channel options: message size limits and keepalive."""
+    max_bytes = MAX_MESSAGE_MB * 1024 * 1024
+    options = [
+        ("grpc.max_send_message_length", max_bytes),
+        ("grpc.max_receive_message_length", max_bytes),
+    ]
+    if KEEPALIVE_S > 0:
+        options += [
+            ("grpc.keepalive_time_ms", int(KEEPALIVE_S * 1000)),
+            ("grpc.keepalive_timeout_ms", 10_000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+    return options
+
+
+def merge_options(existing, overrides):
+    """``existing`` channel options with the keys of ``overrides`` replaced."""
+    keys = {key for key, _ in overrides}
+    return [option for option in existing if option[0] not in keys] + list(overrides)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_library():
+    """Adds channel_options() to the options google-ads uses for new channels (once)."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        from google.ads.googleads import client as googleads_client
+
+        existing = getattr(googleads_client, "_GRPC_CHANNEL_OPTIONS", None)
+        if existing is None:
+            log.warning("⚠️ google-ads kanaalopties niet gevonden; keepalive/berichtgrootte niet aangepast")
+        else:
+            googleads_client._GRPC_CHANNEL_OPTIONS = merge_options(existing, channel_options())
+        _configured = True
+
+
+def call_deadline(method: str, timeout=None):
+    """Deadline for a call to ``method`` (full gRPC method path): ours, or a shorter one already set."""
+    deadline = MUTATE_DEADLINE if "/Mutate" in method else SEARCH_DEADLINE
+    if deadline <= 0:
+        return timeout
+    return deadline if timeout is None else min(timeout, deadline)
+
+
+_interceptor = None
+
+
+def tuning_interceptor():
+    """The shared client interceptor that sets compression and deadlines on every call."""
+    global _interceptor
+    if _interceptor is not None:
+        return _interceptor
+    import grpc
+
+    compression = grpc.Compression.Gzip if COMPRESSION == "gzip" else grpc.Compression.NoCompression
+
+    class _CallDetails(
+        collections.namedtuple(
+            "_CallDetails", ("method", "timeout", "metadata", "credentials", "wait_for_ready", "compression")
+        ),
+        grpc.ClientCallDetails,
+    ):
+        pass
+
+    class _TuningInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+        @staticmethod
+        def _tuned(details):
+            method = details.method.decode() if isinstance(details.method, bytes) else details.method
+            return _CallDetails(
+                details.method,
+                call_deadline(method, details.timeout),
+                details.metadata,
+                details.credentials,
+                getattr(details, "wait_for_ready", None),
+                compression,
+            )
+
+        def intercept_unary_unary(self, continuation, client_call_details, request):
+            return continuation(self._tuned(client_call_details), request)
+
+        def intercept_unary_stream(self, continuation, client_call_details, request):
+            return continuation(self._tuned(client_call_details), request)
+
+    _interceptor = _TuningInterceptor()
+    return _interceptor
+
+
+class ServiceRegistry:
+    """One service handle per (client, service, version) for the whole process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+
+    def get(self, client, name, version=None, interceptors=None):
+        key = (id(client), name, version)
+        handle = self._handles.get(key)
+        if handle is not None:
+            return handle
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                kwargs = {"interceptors": list(interceptors or [])}
+                if version:
+                    kwargs["version"] = version
+                handle = client.get_service(name, **kwargs)
+                self._handles[key] = handle
+        return handle
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+
+
+registry = ServiceRegistry()
+
+
+class _RegisteredClient:
+    def __init__(self, client, interceptors):
+        self._client = client
+        self._interceptors = interceptors
+
+    def get_service(self, name, version=None, interceptors=None):
+        if interceptors:
+            # Call-specific interceptors: not shareable, build a handle as before
+            kwargs = {"interceptors": list(self._interceptors) + list(interceptors)}
+            if version:
+                kwargs["version"] = version
+            return self._client.get_service(name, **kwargs)
+        return registry.get(self._client, name, version, self._interceptors)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def registered_client(client):
+    """
+    Wraps a GoogleAdsClient so ``get_service`` returns the shared handle per
+    service, built with the tuned channel options and the tuning interceptor.
+    """
+    if isinstance(client, _RegisteredClient):
+        return client
+    configure_library()
+    return _RegisteredClient(client, [tuning_interceptor()])
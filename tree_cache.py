@@ -0,0 +1,276 @@
+"""
+Local listing-tree cache, kept honest with the ``change_status`` resource.
+
+Account managers edit trees by hand, so a cached tree is only used when the
+account's change history says the ad group's criteria have not changed since
+the cache was last validated. Per customer, the first tree read of a run
+queries ``change_status`` for AD_GROUP_CRITERION changes since the last
+recorded sync time and drops the cached trees of every ad group that changed.
+All other ad groups are served from the cache; only changed (or uncached) ad
+groups are read from the API.
+
+Layout (``TAGTOPPERS_TREE_CACHE_DIR``, default ``cache/trees``):
+
+    <customer_id>/_sync.json         - last sync time (account time zone)
+    <customer_id>/<ad_group_id>.json - serialized GoogleAdsRow messages
+
+Trees the tool mutates itself are invalidated right before the mutate, so
+they are read again the next time they are needed. A read that was already in flight
+when its ad group was invalidated (a prefetch) doesn't write to the cache. The new sync time is only
+stored by ``commit()`` at the end of a run; after a crash the next run checks
+the same window again.
+
+The cache falls back to plain API reads (without advancing the sync time)
+when ``change_status`` can't be queried, when the last sync is older than the
+change history the API keeps (90 days), or when the query hits its row limit.
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+import os
+import threading
+from zoneinfo import ZoneInfo
+
+import logs
+import proto_fast
+
+log = logs.get_logger("tree_cache")
+
+CACHE_DIR = os.getenv("TAGTOPPERS_TREE_CACHE_DIR", os.path.join("cache", "trees"))
+ENABLED = os.getenv("TAGTOPPERS_TREE_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+
+# change_status keeps 90 days of history and returns at most 10k rows per query
+_MAX_HISTORY = datetime.timedelta(days=89)
+_CHANGE_STATUS_LIMIT = 10_000
+# Overlap between consecutive sync windows, covers clock skew and late-visible changes
+_SYNC_OVERLAP = datetime.timedelta(minutes=5)
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_lock = threading.Lock()
+# customer_id -> {"valid": bool, "sync_time": str or None, "time_zone": str}
+_synced = {}
+# customer_id -> lock held while that customer's change_status is queried
+_customer_locks = {}
+# (customer_id, ad_group_id) -> invalidation count; a read that started before
+# an invalidation (e.g. a prefetch) must not write its stale rows back. Own lock,
+# so invalidate() never depends on who holds _lock
+_generations_lock = threading.Lock()
+_generations = {}
+_listeners = []
+
+
+def set_enabled(enabled: bool):
+    """Turns the tree cache on or off for the current process."""
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def _customer_dir(customer_id) -> str:
+    return os.path.join(CACHE_DIR, str(customer_id))
+
+
+def _entry_path(customer_id, ad_group_id) -> str:
+    return os.path.join(_customer_dir(customer_id), f"{ad_group_id}.json")
+
+
+def _sync_path(customer_id) -> str:
+    return os.path.join(_customer_dir(customer_id), "_sync.json")
+
+
+def _write_json(path, payload):
+    """Atomic write: a crash never leaves a half-written cache file behind."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _drop_customer(customer_id):
+    directory = _customer_dir(customer_id)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(".json") and name != "_sync.json":
+            os.remove(os.path.join(directory, name))
+
+
+# ---- change_status ----
+
+def _account_time_zone(client, customer_id, state) -> str:
+    if state and state.get("time_zone"):
+        return state["time_zone"]
+    ga_service = client.get_service("GoogleAdsService")
+    for row in ga_service.search(customer_id=customer_id, query="SELECT customer.time_zone FROM customer"):
+        return row.customer.time_zone
+    return "UTC"
+
+
+def _changed_ad_groups(client, customer_id, since: str, until: str):
+    """Ad group IDs with AD_GROUP_CRITERION changes in [since, until], or None if the limit was hit."""
+    ga_service = client.get_service("GoogleAdsService")
+    query = f"""
+        SELECT
+            change_status.ad_group,
+            change_status.last_change_date_time
+        FROM change_status
+        WHERE change_status.last_change_date_time >= '{since}'
+            AND change_status.last_change_date_time <= '{until}'
+            AND change_status.resource_type = 'AD_GROUP_CRITERION'
+        LIMIT {_CHANGE_STATUS_LIMIT}
+    """
+    changed = set()
+    count = 0
+    for row in ga_service.search(customer_id=customer_id, query=query):
+        count += 1
+        ad_group = row.change_status.ad_group
+        if ad_group:
+            changed.add(ad_group.rsplit("/", 1)[-1])
+    if count >= _CHANGE_STATUS_LIMIT:
+        return None
+    return changed
+
+
+def _sync_customer(client, customer_id):
+    """Drops cached trees of ad groups changed since the last sync (once per customer per process)."""
+    customer_id = str(customer_id)
+    with _lock:
+        sync = _synced.get(customer_id)
+        if sync is not None:
+            return sync
+        customer_lock = _customer_locks.setdefault(customer_id, threading.Lock())
+
+    # The queries run outside _lock, so a slow customer doesn't hold up the others;
+    # readers of the same customer wait for its one sync
+    with customer_lock:
+        with _lock:
+            sync = _synced.get(customer_id)
+        if sync is not None:
+            return sync
+
+        state = _read_json(_sync_path(customer_id)) or {}
+        sync = {"valid": False, "sync_time": None, "time_zone": state.get("time_zone")}
+        try:
+            time_zone = _account_time_zone(client, customer_id, state)
+            now = datetime.datetime.now(ZoneInfo(time_zone)).replace(tzinfo=None)
+            until = now.strftime(_DATE_FORMAT)
+            sync["time_zone"] = time_zone
+
+            last_sync = state.get("last_sync")
+            since = None
+            if last_sync:
+                since_dt = datetime.datetime.strptime(last_sync, _DATE_FORMAT) - _SYNC_OVERLAP
+                if now - since_dt <= _MAX_HISTORY:
+                    since = since_dt.strftime(_DATE_FORMAT)
+
+            if since is None:
+                # No usable history window: start over with an empty cache
+                _drop_customer(customer_id)
+                log.info(f"ℹ️ Tree cache {customer_id}: geen bruikbare sync, alle bomen worden gelezen")
+            else:
+                changed = _changed_ad_groups(client, customer_id, since, until)
+                if changed is None:
+                    _drop_customer(customer_id)
+                    log.info(f"ℹ️ Tree cache {customer_id}: te veel wijzigingen sinds {since}, cache geleegd")
+                else:
+                    for ad_group_id in changed:
+                        invalidate(customer_id, ad_group_id)
+                    log.info(f"🔄 Tree cache {customer_id}: {len(changed)} gewijzigde ad group(s) sinds {since}")
+
+            sync["valid"] = True
+            sync["sync_time"] = until
+        except Exception as e:
+            log.warning(f"⚠️ Tree cache {customer_id}: change_status niet beschikbaar ({e}), cache wordt niet gebruikt")
+
+        with _lock:
+            _synced[customer_id] = sync
+        return sync
+
+
+# ---- tree reads ----
+
+def _query_digest(query: str) -> str:
+    return hashlib.sha1(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+
+def _wrap_rows(client, serialized_rows):
+    row_class = proto_fast._message_class(client, "GoogleAdsRow")
+    rows = [row_class.FromString(base64.b64decode(data)) for data in serialized_rows]
+    if proto_fast.RAW_PROTO:
+        return rows
+    wrapper = type(client.get_type("GoogleAdsRow"))
+    return [wrapper.wrap(row) for row in rows]
+
+
+def read_tree(client, customer_id, ad_group_id, query):
+    """
+    Listing-tree rows of an ad group: from the cache when the ad group hasn't
+    changed since it was cached, otherwise from the API (and cached).
+
+    Rows are returned like ``proto_fast.rows(ga_service.search(...))``: raw
+    protobuf on the fast path, proto-plus otherwise.
+    """
+    ga_service = client.get_service("GoogleAdsService")
+    if not ENABLED:
+        return list(proto_fast.rows(ga_service.search(customer_id=customer_id, query=query)))
+
+    sync = _sync_customer(client, customer_id)
+    digest = _query_digest(query)
+    path = _entry_path(customer_id, ad_group_id)
+
+    if sync["valid"]:
+        entry = _read_json(path)
+        if entry and entry.get("query") == digest:
+            return _wrap_rows(client, entry["rows"])
+
+    generation = _generations.get((str(customer_id), str(ad_group_id)), 0)
+    rows = list(proto_fast.rows(ga_service.search(customer_id=customer_id, query=query)))
+    if _generations.get((str(customer_id), str(ad_group_id)), 0) != generation:
+        return rows
+    _write_json(path, {
+        "query": digest,
+        "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "rows": [base64.b64encode(proto_fast.raw(row).SerializeToString()).decode("ascii") for row in rows],
+    })
+    return rows
+
+
+def on_invalidate(listener):
+    """Calls ``listener(customer_id, ad_group_id)`` whenever a tree is invalidated."""
+    _listeners.append(listener)
+
+
+def invalidate(customer_id, ad_group_id):
+    """Drops the cached tree of an ad group that is about to be mutated."""
+    key = (str(customer_id), str(ad_group_id))
+    with _generations_lock:
+        _generations[key] = _generations.get(key, 0) + 1
+    try:
+        os.remove(_entry_path(customer_id, ad_group_id))
+    except FileNotFoundError:
+        pass
+    for listener in _listeners:
+        listener(*key)
+
+
+def commit():
+    """Stores the sync time of every customer validated in this run; call at the end of a run."""
+    with _lock:
+        for customer_id, sync in _synced.items():
+            if sync["valid"]:
+                _write_json(_sync_path(customer_id), {
+                    "last_sync": sync["sync_time"],
+                    "time_zone": sync["time_zone"],
+                })
+        # A long-running process checks change_status again in its next run
+        _synced.clear()
@@ -0,0 +1,429 @@
+"""
+Pure planning of label-tree rebuilds, separated from the API calls.
+
+``rebuild_tree_with_label_and_item_ids`` used to walk the listing tree and
+send mutates while it decided what to change. Here the decision logic -
+terminal-subdivision detection, the Case 1-4 classification, custom label
+preservation and the tree clone for UNIT-to-SUBDIVISION conversion - is a
+pure function over plain data:
+
+    nodes = snapshot(rows)                  - listing-tree search rows as
+                                              picklable dicts (in-process)
+    plan  = plan_label_tree(nodes, label, item_ids, bid_micros)
+                                            - the operation plan, no I/O
+    plan  = plan(nodes, label, ...)         - the same, on the planner process
+                                              pool for large trees
+    plans = plan_many(jobs)                 - many ad groups across all cores
+    plan  = plan_inclusion_tree(nodes, item_ids, bid_micros)
+                                            - additions/removals/bid changes for
+                                              a tag_toppers inclusion tree
+
+``listing_tree.apply_tree_plan`` executes a plan against the API.
+
+A plan is a dict with ``status`` ('ok', 'empty' or 'no_subdivisions'), the
+deduplicated ``item_ids``, the ``custom_label_structures`` found in the tree,
+``warnings`` and the ``steps``, one mutate request each:
+
+    {"kind": "rebuild", "targets": n, "operations": [...]}
+        the whole tree removed and re-created (one atomic request); creates
+        carry a plan-wide ``ref`` and point to their parent by ``parent_ref``
+    {"kind": "item_ids", "parent": resource_name, "parent_ref": ref or None,
+     "add_others": bool, "bid_micros": int, "item_ids": [...]}
+        Item-ID OTHERS (optional) plus exclusions under one subdivision
+        (partial failure); ``parent_ref`` points to the re-created copy of the
+        subdivision when a rebuild step precedes it
+
+Trees of at least ``TAGTOPPERS_PLAN_POOL_MIN_NODES`` nodes plus Item IDs
+(default 2000) are planned on a pool of ``TAGTOPPERS_PLAN_PROCESSES``
+processes (default: all cores, 1 plans everything in-process); smaller ones
+are cheaper to plan than to pickle.
+"""
+
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import proto_fast
+
+PROCESSES = max(1, int(os.getenv("TAGTOPPERS_PLAN_PROCESSES", str(os.cpu_count() or 1))))
+POOL_MIN_NODES = int(os.getenv("TAGTOPPERS_PLAN_POOL_MIN_NODES", "2000"))
+
+CUSTOM_ATTRIBUTE = "product_custom_attribute"
+ITEM_ID = "product_item_id"
+
+
+def set_processes(processes: int):
+    """Size of the planner process pool (1 plans in-process); takes effect for a new pool."""
+    global PROCESSES
+    PROCESSES = max(1, int(processes))
+    shutdown()
+
+
+# ---- snapshot ----
+
+def snapshot(rows):
+    """
+    Listing-tree search rows (proto-plus or raw) as plain dicts:
+    resource_name, type, parent, dimension, index, value, has_case_value,
+    case_value (serialized ListingDimensionInfo), negative, bid_micros.
+
+    ``has_case_value`` follows proto-plus truthiness, so an Item-ID OTHERS
+    case value (dimension set, value empty) counts as unset.
+    """
+    return [snapshot_node(row.ad_group_criterion) for row in rows]
+
+
+def snapshot_node(criterion):
+    """One listing-group AdGroupCriterion (proto-plus or raw) as a snapshot dict."""
+    criterion = proto_fast.raw(criterion)
+    lg = criterion.listing_group
+    case_value = lg.case_value
+    dimension = case_value.WhichOneof("dimension")
+    index = value = None
+    if dimension == CUSTOM_ATTRIBUTE:
+        index = proto_fast.custom_attribute_index_name(case_value)
+        value = case_value.product_custom_attribute.value
+    elif dimension == ITEM_ID:
+        value = case_value.product_item_id.value
+    return {
+        "resource_name": criterion.resource_name,
+        "type": proto_fast.listing_group_type_name(lg),
+        "parent": lg.parent_ad_group_criterion or None,
+        "dimension": dimension,
+        "index": index,
+        "value": value,
+        "has_case_value": proto_fast.has_content(case_value),
+        "case_value": case_value.SerializeToString() if dimension else None,
+        "negative": bool(criterion.negative),
+        "bid_micros": int(criterion.cpc_bid_micros),
+    }
+
+
+# ---- planning ----
+
+def _build_tree(nodes):
+    tree_map = {}
+    for node in nodes:
+        tree_map[node["resource_name"]] = dict(node, children=[])
+    for res_name, node in tree_map.items():
+        parent = node["parent"]
+        if parent and parent in tree_map:
+            tree_map[parent]["children"].append(res_name)
+
+    depth_map = {}
+    for res_name in tree_map:
+        # Walk up to the first node with a known depth, then fill in the path
+        path = []
+        current = res_name
+        while current not in depth_map:
+            path.append(current)
+            parent = tree_map[current]["parent"]
+            if not parent or parent not in tree_map:
+                depth_map[current] = 0
+                path.pop()
+                break
+            current = parent
+        for name in reversed(path):
+            depth_map[name] = depth_map[tree_map[name]["parent"]] + 1
+    return tree_map, depth_map
+
+
+def _target_subdivisions(tree_map, depth_map, subdivision_nodes):
+    """Terminal subdivisions: no children, or UNIT children only (else the deepest ones)."""
+    targets = []
+    for sub_res in subdivision_nodes:
+        children = tree_map[sub_res]["children"]
+        if not children:
+            targets.append(sub_res)
+            continue
+        has_unit_children = any(tree_map[child]["type"] == "UNIT" for child in children)
+        has_subdivision_children = any(tree_map[child]["type"] == "SUBDIVISION" for child in children)
+        if has_unit_children and not has_subdivision_children:
+            targets.append(sub_res)
+
+    if not targets:
+        max_depth = max(depth_map[res_name] for res_name in subdivision_nodes)
+        targets = [res_name for res_name in subdivision_nodes if depth_map[res_name] == max_depth]
+    return targets
+
+
+def _custom_label_structures(tree_map):
+    """Custom label units (other than INDEX0 and OTHERS) to preserve."""
+    structures = []
+    for node in tree_map.values():
+        if not node["has_case_value"] or node["dimension"] != CUSTOM_ATTRIBUTE:
+            continue
+        if node["index"] == "INDEX0" or not node["value"]:
+            continue
+        if node["type"] == "UNIT":
+            structures.append({
+                "index": node["index"],
+                "value": node["value"],
+                "negative": node["negative"],
+                "bid_micros": node["bid_micros"],
+            })
+    return structures
+
+
+def _classify_children(tree_map, children):
+    """(has Item-ID OTHERS, has non-Item-ID units, positive custom label units)."""
+    has_item_id_others = False
+    has_non_item_id_units = False
+    positive_units = []
+    for child_res in children:
+        child = tree_map[child_res]
+        if child["has_case_value"]:
+            if child["dimension"] == ITEM_ID:
+                if not child["value"]:
+                    has_item_id_others = True
+            elif child["type"] == "UNIT":
+                has_non_item_id_units = True
+                if child["dimension"] == CUSTOM_ATTRIBUTE and not child["negative"]:
+                    positive_units.append(child_res)
+        elif child["type"] == "UNIT" and not child["negative"]:
+            has_item_id_others = True
+        elif child["type"] == "UNIT":
+            has_non_item_id_units = True
+    return has_item_id_others, has_non_item_id_units, positive_units
+
+
+def _rebuild_operations(tree_map, depth_map, rebuild_targets, item_ids, refs, warnings):
+    """
+    Removes of the whole tree (deepest first) plus creates of its clone, in
+    which every positive custom label UNIT under a rebuild target becomes a
+    SUBDIVISION with Item-ID OTHERS and the exclusions. Returns
+    (operations, {original resource name: ref of its copy}).
+    """
+    roots = [res_name for res_name, node in tree_map.items() if not node["parent"]]
+    if not roots:
+        warnings.append("Could not find ROOT node in tree; tree not rebuilt")
+        return None, {}
+
+    operations = [
+        {"op": "remove", "resource_name": res_name}
+        for res_name in sorted(tree_map, key=depth_map.get, reverse=True)
+    ]
+    copies = {}
+
+    def create(op, parent_ref, **fields):
+        ref = next(refs)
+        operations.append(dict(fields, op=op, ref=ref, parent_ref=parent_ref))
+        return ref
+
+    def clone(res_name, parent_ref):
+        node = tree_map[res_name]
+        case_value = node["case_value"] if parent_ref is not None else None
+        if parent_ref is not None and not node["dimension"]:
+            warnings.append(f"Node {res_name} has no case_value, defaulting to Item-ID OTHERS")
+        if node["type"] == "SUBDIVISION":
+            ref = create("subdivision", parent_ref, case_value=case_value)
+        else:
+            ref = create("unit", parent_ref, case_value=case_value,
+                         negative=node["negative"], bid_micros=node["bid_micros"])
+        copies[res_name] = ref
+
+        if res_name not in rebuild_targets:
+            for child_res in node["children"]:
+                clone(child_res, ref)
+            return
+
+        # Rebuild target: positive custom label units become subdivisions with the
+        # Item-ID level, negative ones are kept as exclusions; others are dropped
+        children = [tree_map[c] for c in node["children"]
+                    if tree_map[c]["has_case_value"] and tree_map[c]["dimension"] == CUSTOM_ATTRIBUTE]
+        for child in children:
+            if child["negative"]:
+                continue
+            sub_ref = create("subdivision", ref, case_value=child["case_value"])
+            create("item_id_others", sub_ref, bid_micros=child["bid_micros"])
+            if item_ids:
+                operations.append({"op": "item_id_exclusions", "parent_ref": sub_ref, "item_ids": list(item_ids)})
+        for child in children:
+            if child["negative"]:
+                create("unit", ref, case_value=child["case_value"], negative=True, bid_micros=child["bid_micros"])
+
+    clone(roots[0], None)
+    return operations, copies
+
+
+def plan_label_tree(nodes, label, item_ids=None, bid_micros=200_000):
+    """
+    Operation plan that adds Item-ID exclusions at the terminal subdivisions of
+    the tree in ``nodes`` (see ``snapshot``). Pure: no client, no I/O.
+    """
+    item_ids = list(dict.fromkeys(str(i) for i in item_ids)) if item_ids else []
+    plan = {
+        "status": "ok",
+        "label": label,
+        "item_ids": item_ids,
+        "nodes": len(nodes),
+        "custom_label_structures": [],
+        "targets": 0,
+        "subdivisions": 0,
+        "warnings": [],
+        "steps": [],
+    }
+    if not nodes:
+        plan["status"] = "empty"
+        return plan
+
+    tree_map, depth_map = _build_tree(nodes)
+    subdivision_nodes = [res_name for res_name, node in tree_map.items() if node["type"] == "SUBDIVISION"]
+    if not subdivision_nodes:
+        plan["status"] = "no_subdivisions"
+        return plan
+
+    targets = _target_subdivisions(tree_map, depth_map, subdivision_nodes)
+    plan["targets"] = len(targets)
+    plan["custom_label_structures"] = _custom_label_structures(tree_map)
+
+    # Subdivisions whose positive custom label units have to become subdivisions:
+    # all of them in one rebuild of the whole tree, so no change overwrites another
+    rebuild_targets = []
+    for sub_res in targets:
+        children = tree_map[sub_res]["children"]
+        if not children:
+            continue
+        has_item_id_others, has_non_item_id_units, positive_units = _classify_children(tree_map, children)
+        if has_non_item_id_units and positive_units and not has_item_id_others:
+            rebuild_targets.append(sub_res)
+
+    refs = itertools.count(1)
+    copies = {}
+    if rebuild_targets:
+        operations, copies = _rebuild_operations(
+            tree_map, depth_map, set(rebuild_targets), item_ids, refs, plan["warnings"]
+        )
+        if operations:
+            plan["steps"].append({"kind": "rebuild", "targets": len(rebuild_targets), "operations": operations})
+
+    for sub_res in targets:
+        if sub_res in rebuild_targets:
+            continue
+        children = tree_map[sub_res]["children"]
+        # Case 1: no children; case 2: Item-ID OTHERS exists (only add exclusions);
+        # cases 3/4: other units or nothing relevant (add Item-ID OTHERS + exclusions)
+        has_item_id_others = bool(children) and _classify_children(tree_map, children)[0]
+        plan["subdivisions"] += 1
+        if has_item_id_others and not item_ids:
+            plan["warnings"].append(f"No operations for {sub_res} (all items may already exist)")
+            continue
+        plan["steps"].append({
+            "kind": "item_ids",
+            "parent": sub_res,
+            "parent_ref": copies.get(sub_res),
+            "add_others": not has_item_id_others,
+            "bid_micros": bid_micros,
+            "item_ids": item_ids,
+        })
+    return plan
+
+
+def _item_id_key(item_id) -> str:
+    # Item IDs are case-insensitive in Google Ads
+    return str(item_id).strip().lower()
+
+
+def plan_inclusion_tree(nodes, item_ids, bid_micros=200_000):
+    """
+    Difference between a tag_toppers inclusion tree (root SUBDIVISION ->
+    negative Item-ID OTHERS + positive Item-ID units) in ``nodes`` and the
+    requested Item IDs. Pure: no client, no I/O.
+
+    Returns a dict with ``status``:
+        'ok'      - the tree has the inclusion structure; ``root``, the Item IDs
+                    to ``add``, the unit resource names to ``remove`` and the
+                    ``bids`` {resource_name: bid_micros} to update
+        'empty'   - no tree yet; build it with all ``item_ids``
+        'rebuild' - any other structure; ``root`` has to be replaced by a new tree
+    """
+    item_ids = list(dict.fromkeys(str(i) for i in item_ids)) if item_ids else []
+    plan = {
+        "status": "ok",
+        "root": None,
+        "item_ids": item_ids,
+        "add": [],
+        "remove": [],
+        "bids": {},
+        "unchanged": 0,
+    }
+    if not nodes:
+        plan["status"] = "empty"
+        return plan
+
+    roots = [node for node in nodes if not node["parent"]]
+    if roots:
+        plan["root"] = roots[0]["resource_name"]
+    others = [node for node in nodes if node["parent"] and not node["value"]]
+    units = [node for node in nodes if node["parent"] and node["value"]]
+    if (len(roots) != 1 or roots[0]["type"] != "SUBDIVISION" or roots[0]["has_case_value"]
+            or len(others) != 1 or others[0]["dimension"] != ITEM_ID or not others[0]["negative"]
+            or any(node["parent"] != plan["root"] or node["type"] != "UNIT" for node in others + units)
+            or any(node["dimension"] != ITEM_ID or node["negative"] for node in units)):
+        plan["status"] = "rebuild"
+        return plan
+
+    wanted = {_item_id_key(item_id): item_id for item_id in item_ids}
+    present = set()
+    for node in units:
+        key = _item_id_key(node["value"])
+        if key not in wanted or key in present:
+            plan["remove"].append(node["resource_name"])
+            continue
+        present.add(key)
+        if node["bid_micros"] != bid_micros:
+            plan["bids"][node["resource_name"]] = bid_micros
+        else:
+            plan["unchanged"] += 1
+    plan["add"] = [item_id for key, item_id in wanted.items() if key not in present]
+    return plan
+
+
+# ---- process pool ----
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the callers are threaded, forking them is not safe
+            _pool = ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown():
+    """Stops the planner processes (a new pool starts on the next large plan)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _use_pool(nodes, item_ids) -> bool:
+    return PROCESSES > 1 and len(nodes) + len(item_ids or []) >= POOL_MIN_NODES
+
+
+def plan(nodes, label, item_ids=None, bid_micros=200_000):
+    """``plan_label_tree`` on the planner pool for large trees, in-process otherwise."""
+    if not _use_pool(nodes, item_ids):
+        return plan_label_tree(nodes, label, item_ids, bid_micros)
+    return _get_pool().submit(plan_label_tree, nodes, label, item_ids, bid_micros).result()
+
+
+def plan_many(jobs):
+    """
+    Plans for many ad groups: ``jobs`` are (nodes, label, item_ids, bid_micros)
+    tuples, planned across the pool; returns the plans in job order.
+    """
+    jobs = list(jobs)
+    if PROCESSES <= 1 or len(jobs) < 2:
+        return [plan(*job) for job in jobs]
+    pool = _get_pool()
+    futures = [pool.submit(plan_label_tree, *job) for job in jobs]
+    return [future.result() for future in futures]